@@ -1,24 +1,64 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, Response, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, Response, jsonify, send_from_directory, g
+from markupsafe import Markup
+import click
 import csv
+import gzip
+import mimetypes
+import shutil
 import os
 import json
+import math
 import sqlite3
 import io
-import random
+import secrets
+import re
+import hashlib
+import time
+import sys
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import closing
 from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
+from werkzeug.middleware.proxy_fix import ProxyFix
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.lib import colors
 from reportlab.lib.units import inch
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.enums import TA_CENTER, TA_LEFT
+from PIL import Image, ImageOps
 import stripe
+import build_css
+import data_backup
+from session_store import ServerSideSessionInterface, SQLiteSessionStore, MemorySessionStore
+from employee_repository import (
+    list_employees, page_employees, get_employee, update_employee, get_attendance, list_attendance,
+    employee_list_statement, employee_page_statement, attendance_statement, STATEMENT_COUNT
+)
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; gzip variants are always built
+    brotli = None
+
+try:
+    import fcntl
+except ImportError:  # no flock on Windows; manifest updates are then only serialised per process
+    fcntl = None
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-change-this-in-production')  # Use environment variable in production
 
+# Render's proxy appends the client address to X-Forwarded-For; trusting that many hops
+# makes request.remote_addr the real client, which sign-in throttling keys on.
+# Set TRUSTED_PROXY_HOPS=0 when clients connect to the app directly.
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 1))
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
+
 # Stripe Configuration
 stripe.api_key = os.environ.get('STRIPE_SECRET_KEY', 'sk_test_your_stripe_secret_key_here')
 STRIPE_PUBLISHABLE_KEY = os.environ.get('STRIPE_PUBLISHABLE_KEY', 'pk_test_your_stripe_publishable_key_here')
@@ -57,6 +97,10 @@ ADMIN_SETTINGS_JSON = os.path.join(DATA_DIR, 'admin_settings.json')
 ROLE_RATES_JSON = os.path.join(DATA_DIR, 'role_rates.json')
 EMPLOYEES_DB = os.path.join(DATA_DIR, 'employees.db')
 COUPONS_CSV = os.path.join(DATA_DIR, 'coupons.csv')
+USERS_INDEX_DB = os.path.join(DATA_DIR, 'users_index.db')
+SESSIONS_DB = os.path.join(DATA_DIR, 'sessions.db')
+CARTS_DB = os.path.join(DATA_DIR, 'carts.db')
+COUPONS_DB = os.path.join(DATA_DIR, 'coupons.db')
 
 # Default job categories for employees
 JOB_CATEGORIES_DEFAULT = [
@@ -75,20 +119,441 @@ ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Uploads are stored under a hash of their content so identical images share one file
+UPLOAD_HASH_LENGTH = 32
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Unreferenced uploads younger than this are kept (the form that uses them may still be saving)
+IMAGE_GC_GRACE_SECONDS = 3600
+
 def save_uploaded_image(file_storage):
     if not file_storage or file_storage.filename == '' or not allowed_file(file_storage.filename):
         return None
-    filename = secure_filename(file_storage.filename)
-    name, ext = os.path.splitext(filename)
-    counter = 1
-    save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    while os.path.exists(save_path):
-        filename = f"{name}_{counter}{ext}"
+    # allowed_file has validated the raw name's extension; secure_filename would strip
+    # non-ASCII names down to just the extension ('файл.png' -> 'png')
+    ext = file_storage.filename.rsplit('.', 1)[1].lower()
+    if ext == 'jpeg':
+        ext = 'jpg'
+
+    # Hash while streaming to a temp file, then move it into place only if it is new
+    digest = hashlib.sha256()
+    tmp_path = os.path.join(app.config['UPLOAD_FOLDER'], f".upload-{os.getpid()}-{time.time_ns()}.tmp")
+    try:
+        with open(tmp_path, 'wb') as out:
+            while True:
+                chunk = file_storage.stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+        filename = f"{digest.hexdigest()[:UPLOAD_HASH_LENGTH]}.{ext}"
         save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        counter += 1
-    file_storage.save(save_path)
+        if os.path.exists(save_path):
+            # Duplicate upload: refresh mtime so the GC grace period applies to this reuse too
+            os.utime(save_path)
+        else:
+            os.replace(tmp_path, save_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    if filename not in load_image_manifest():
+        generate_image_derivatives(filename)
     return filename
 
+# Responsive image derivatives: named size -> target width in pixels
+IMAGE_DERIVATIVE_SIZES = {'thumb': 160, 'card': 480, 'hero': 1200}
+IMAGE_DERIVED_FOLDER = os.path.join(app.config['UPLOAD_FOLDER'], 'derived')
+IMAGE_MANIFEST_JSON = os.path.join(IMAGE_DERIVED_FOLDER, 'manifest.json')
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+
+# Cache for the derivative manifest, reloaded when the file changes on disk
+_image_manifest_cache = None
+_image_manifest_mtime = None
+
+def load_image_manifest():
+    """Load the derivative manifest (original filename -> generated widths)"""
+    global _image_manifest_cache, _image_manifest_mtime
+    try:
+        mtime = os.path.getmtime(IMAGE_MANIFEST_JSON)
+    except OSError:
+        return {}
+    if _image_manifest_cache is not None and _image_manifest_mtime == mtime:
+        return _image_manifest_cache
+    with open(IMAGE_MANIFEST_JSON, 'r', encoding='utf-8') as f:
+        try:
+            manifest = json.load(f)
+        except json.JSONDecodeError:
+            manifest = {}
+    _image_manifest_cache = manifest
+    _image_manifest_mtime = mtime
+    return manifest
+
+def save_image_manifest(manifest):
+    global _image_manifest_cache, _image_manifest_mtime
+    os.makedirs(IMAGE_DERIVED_FOLDER, exist_ok=True)
+    tmp_path = f"{IMAGE_MANIFEST_JSON}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, IMAGE_MANIFEST_JSON)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    _image_manifest_cache = None
+    _image_manifest_mtime = None
+
+# Serialises manifest read-modify-writes across threads; the flock on IMAGE_MANIFEST_LOCK
+# extends that to other processes (web workers, backfill-images, gc-images)
+_image_manifest_lock = threading.Lock()
+IMAGE_MANIFEST_LOCK = os.path.join(IMAGE_DERIVED_FOLDER, 'manifest.lock')
+
+def update_image_manifest(entries=None, remove=()):
+    """Add or replace `entries` and drop `remove` from the manifest, re-reading it under the lock"""
+    global _image_manifest_cache
+    os.makedirs(IMAGE_DERIVED_FOLDER, exist_ok=True)
+    with _image_manifest_lock, open(IMAGE_MANIFEST_LOCK, 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)  # released when lock_file closes
+        # Another process may have rewritten it within the mtime's resolution: always re-read
+        _image_manifest_cache = None
+        manifest = dict(load_image_manifest())
+        manifest.update(entries or {})
+        for filename in remove:
+            manifest.pop(filename, None)
+        save_image_manifest(manifest)
+
+def derived_image_name(filename, size, ext):
+    return f"{filename}.{size}.{ext}"
+
+def generate_image_derivatives(filename):
+    """Write resized WebP + JPEG/PNG derivatives for an uploaded image.
+
+    Returns the manifest entry, or None if the file could not be processed
+    (missing, not an image, or an animated GIF that we serve as-is).
+    """
+    source_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    try:
+        with Image.open(source_path) as original:
+            if getattr(original, 'is_animated', False):
+                return None
+            image = ImageOps.exif_transpose(original)
+            image.load()
+    except (OSError, Image.DecompressionBombError):
+        return None
+
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+    fallback_ext = 'png' if has_alpha else 'jpg'
+
+    os.makedirs(IMAGE_DERIVED_FOLDER, exist_ok=True)
+    widths = {}
+    for size, target_width in IMAGE_DERIVATIVE_SIZES.items():
+        # Never upscale; small originals are only recompressed
+        width = min(target_width, image.width)
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+        resized.save(os.path.join(IMAGE_DERIVED_FOLDER, derived_image_name(filename, size, 'webp')),
+                     'WEBP', quality=WEBP_QUALITY, method=6)
+        fallback_path = os.path.join(IMAGE_DERIVED_FOLDER, derived_image_name(filename, size, fallback_ext))
+        if has_alpha:
+            resized.save(fallback_path, 'PNG', optimize=True)
+        else:
+            resized.save(fallback_path, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+        widths[size] = width
+
+    entry = {'fallback': fallback_ext, 'widths': widths}
+    update_image_manifest({filename: entry})
+    return entry
+
+def get_image_reference_counts():
+    """Count references to uploaded images from the menu, employees and admin profile"""
+    counts = {}
+
+    def add(filename):
+        if filename:
+            counts[filename] = counts.get(filename, 0) + 1
+
+    if os.path.exists(MENU_CSV):
+        with open(MENU_CSV, 'r', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                add(row.get('image'))
+    with get_employee_connection() as conn:
+        for row in conn.execute("SELECT profile_picture FROM employees WHERE profile_picture IS NOT NULL AND profile_picture != ''"):
+            add(row['profile_picture'])
+    add(load_admin_profile().get('avatar'))
+    for filename in get_static_image_references():
+        add(filename)
+    return counts
+
+# Literal `images/<name>` paths in templates and stylesheets (logo, favicon, hero background)
+STATIC_IMAGE_REFERENCE_RE = re.compile(r'images/([\w.\-]+)')
+
+def get_static_image_references():
+    """Image filenames that templates and the source stylesheet refer to by name"""
+    names = set()
+    sources = [os.path.join(app.static_folder, 'style.css')]
+    for root, _dirs, files in os.walk(os.path.join(app.root_path, app.template_folder)):
+        sources.extend(os.path.join(root, name) for name in files if name.endswith('.html'))
+    for path in sources:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                names.update(STATIC_IMAGE_REFERENCE_RE.findall(f.read()))
+        except OSError:
+            continue
+    return names
+
+def collect_unreferenced_images(dry_run=False, grace_seconds=IMAGE_GC_GRACE_SECONDS):
+    """Delete uploads (and their derivatives) that nothing references.
+
+    Both content-addressed uploads and images stored under their original names
+    before uploads were hashed are candidates; assets that templates or style.css
+    name directly (logo, hero background) count as references, and subfolders are
+    never touched. Returns (removed, bytes_freed).
+    """
+    counts = get_image_reference_counts()
+    upload_folder = app.config['UPLOAD_FOLDER']
+    now = time.time()
+    manifest = load_image_manifest()
+    removed = []
+    bytes_freed = 0
+    for filename in os.listdir(upload_folder):
+        path = os.path.join(upload_folder, filename)
+        if not allowed_file(filename) or counts.get(filename) or not os.path.isfile(path):
+            continue
+        if now - os.path.getmtime(path) < grace_seconds:
+            continue
+        paths = [path]
+        entry = manifest.get(filename)
+        if entry:
+            for size in entry['widths']:
+                for ext in ('webp', entry['fallback']):
+                    paths.append(os.path.join(IMAGE_DERIVED_FOLDER, derived_image_name(filename, size, ext)))
+        for file_path in paths:
+            if not os.path.exists(file_path):
+                continue
+            bytes_freed += os.path.getsize(file_path)
+            if not dry_run:
+                os.remove(file_path)
+        removed.append(filename)
+    if removed and not dry_run:
+        update_image_manifest(remove=removed)
+    return removed, bytes_freed
+
+@app.template_global()
+def responsive_image_sources(filename, size='card'):
+    """Return src/srcset values for an image, or None if it has no derivatives"""
+    entry = load_image_manifest().get(filename) if filename else None
+    if not entry:
+        return None
+
+    def derived_url(name, ext):
+        return url_for('static', filename=f"images/derived/{derived_image_name(filename, name, ext)}")
+
+    # Distinct widths only: small originals produce identical derivatives
+    candidates = {}
+    for name, width in sorted(entry['widths'].items(), key=lambda x: x[1]):
+        candidates.setdefault(width, name)
+    fallback_ext = entry['fallback']
+    return {
+        'src': derived_url(size if size in entry['widths'] else 'card', fallback_ext),
+        'webp_srcset': ', '.join(f"{derived_url(name, 'webp')} {width}w" for width, name in candidates.items()),
+        'fallback_srcset': ', '.join(f"{derived_url(name, fallback_ext)} {width}w" for width, name in candidates.items())
+    }
+
+# Fingerprinted static assets (built by `flask build-static`)
+STATIC_DIST_DIR = os.path.join(app.static_folder, 'dist')
+STATIC_MANIFEST_JSON = os.path.join(STATIC_DIST_DIR, 'manifest.json')
+STATIC_HASH_LENGTH = 12
+STATIC_IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+# Only code and fonts are fingerprinted; images keep their one copy under static/
+# (copying the originals into dist/ would double the image footprint)
+FINGERPRINTED_EXTENSIONS = {'.css', '.js', '.mjs', '.woff', '.woff2', '.ttf', '.otf', '.eot'}
+# Text formats worth precompressing; fonts like woff2 are already compressed
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.mjs', '.svg', '.json', '.txt', '.html', '.ttf', '.otf', '.eot'}
+CSS_URL_RE = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+_static_manifest_cache = None
+_static_manifest_by_path = {}
+_static_manifest_mtime = None
+
+def load_static_manifest():
+    """Return {logical path: {'path': dist path, 'encodings': [...]}} for built assets"""
+    global _static_manifest_cache, _static_manifest_by_path, _static_manifest_mtime
+    try:
+        mtime = os.path.getmtime(STATIC_MANIFEST_JSON)
+    except OSError:
+        return {}
+    if _static_manifest_cache is not None and _static_manifest_mtime == mtime:
+        return _static_manifest_cache
+    with open(STATIC_MANIFEST_JSON, 'r', encoding='utf-8') as f:
+        try:
+            assets = json.load(f)
+        except json.JSONDecodeError:
+            assets = {}
+    # Index by dist path too, so the static view can recognise fingerprinted requests
+    _static_manifest_by_path = {entry['path']: entry for entry in assets.values()}
+    _static_manifest_cache = assets
+    _static_manifest_mtime = mtime
+    return assets
+
+def get_static_asset_by_path(dist_path):
+    """The manifest entry whose fingerprinted copy is `dist_path`, or None"""
+    if not load_static_manifest():
+        return None
+    return _static_manifest_by_path.get(dist_path)
+
+def fingerprinted_name(logical_path, content):
+    name, ext = os.path.splitext(logical_path)
+    digest = hashlib.sha256(content).hexdigest()[:STATIC_HASH_LENGTH]
+    return f"dist/{name}.{digest}{ext}"
+
+def rewrite_css_urls(css_text, css_logical_path, assets):
+    """Point relative url() references in a stylesheet at their fingerprinted copies"""
+    css_dir = os.path.dirname(css_logical_path)
+
+    static_prefix = app.static_url_path + '/'
+
+    def replace(match):
+        quote, target = match.group(1), match.group(2).strip()
+        clean_target = target.split('?', 1)[0].split('#', 1)[0]
+        if clean_target.startswith(static_prefix):
+            # Absolute /static/ URLs (used by inlined critical CSS) stay absolute
+            entry = assets.get(clean_target[len(static_prefix):])
+            return f"url({quote}{static_prefix}{entry['path']}{quote})" if entry else match.group(0)
+        if target.startswith(('data:', 'http:', 'https:', '//', '#', '/')):
+            return match.group(0)
+        logical = os.path.normpath(os.path.join(css_dir, clean_target)).replace(os.sep, '/')
+        entry = assets.get(logical)
+        if not entry and not os.path.isfile(os.path.join(app.static_folder, logical)):
+            return match.group(0)
+        # The stylesheet moves into dist/: re-point relative references at the hashed
+        # copy, or at the original for files (images) that are not fingerprinted
+        css_dist_dir = os.path.dirname(fingerprinted_name(css_logical_path, b''))
+        new_target = os.path.relpath(entry['path'] if entry else logical, css_dist_dir).replace(os.sep, '/')
+        return f"url({quote}{new_target}{target[len(clean_target):]}{quote})"
+
+    return CSS_URL_RE.sub(replace, css_text)
+
+def write_static_asset(logical_path, content):
+    """Write one fingerprinted file plus gzip/brotli variants; return its manifest entry"""
+    dist_path = fingerprinted_name(logical_path, content)
+    target = os.path.join(app.static_folder, dist_path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as f:
+        f.write(content)
+    encodings = []
+    if os.path.splitext(logical_path)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+        variants = []
+        if brotli is not None:
+            variants.append(('br', '.br', brotli.compress(content, quality=11)))
+        variants.append(('gzip', '.gz', gzip.compress(content, compresslevel=9, mtime=0)))
+        for encoding, suffix, compressed in variants:
+            if len(compressed) < len(content):
+                with open(target + suffix, 'wb') as f:
+                    f.write(compressed)
+                encodings.append(encoding)
+    return {'path': dist_path, 'encodings': encodings}
+
+def build_static_assets():
+    """Fingerprint the CSS, JS and fonts under static/ into static/dist and write the manifest"""
+    if os.path.isdir(STATIC_DIST_DIR):
+        shutil.rmtree(STATIC_DIST_DIR)
+    sources = []
+    for root, dirs, files in os.walk(app.static_folder):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != STATIC_DIST_DIR]
+        for name in files:
+            if os.path.splitext(name)[1].lower() not in FINGERPRINTED_EXTENSIONS:
+                continue
+            full_path = os.path.join(root, name)
+            sources.append(os.path.relpath(full_path, app.static_folder).replace(os.sep, '/'))
+
+    assets = {}
+    # Stylesheets go last so their url() references can point at already-hashed files
+    for logical_path in sorted(sources, key=lambda p: (p.endswith('.css'), p)):
+        with open(os.path.join(app.static_folder, logical_path), 'rb') as f:
+            content = f.read()
+        if logical_path.endswith('.css'):
+            content = rewrite_css_urls(content.decode('utf-8'), logical_path, assets).encode('utf-8')
+        assets[logical_path] = write_static_asset(logical_path, content)
+
+    os.makedirs(STATIC_DIST_DIR, exist_ok=True)
+    tmp_path = STATIC_MANIFEST_JSON + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(assets, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, STATIC_MANIFEST_JSON)
+    return assets
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    """Make url_for('static', ...) resolve to the fingerprinted copy when one is built"""
+    if endpoint != 'static' or app.debug:
+        return
+    entry = load_static_manifest().get(values.get('filename'))
+    if entry and 'path' in entry:
+        values['filename'] = entry['path']
+
+def serve_static(filename):
+    """Static view: fingerprinted files get precompressed variants and immutable caching"""
+    entry = get_static_asset_by_path(filename)
+    if not entry:
+        return app.send_static_file(filename)
+
+    path = filename
+    encoding = None
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if candidate in entry['encodings'] and candidate in request.accept_encodings:
+            path = filename + suffix
+            encoding = candidate
+            break
+    response = send_from_directory(
+        app.static_folder, path,
+        mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+        max_age=STATIC_IMMUTABLE_MAX_AGE
+    )
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Cache-Control'] = f'public, max-age={STATIC_IMMUTABLE_MAX_AGE}, immutable'
+    response.vary.add('Accept-Encoding')
+    return response
+
+app.view_functions['static'] = serve_static
+
+# Per-area CSS bundles and inlined critical CSS (built by build_css.py)
+CSS_BUNDLE_DIR = os.path.join(app.static_folder, 'css')
+CSS_BUNDLES_JSON = os.path.join(CSS_BUNDLE_DIR, 'bundles.json')
+
+_critical_css_cache = {}
+
+@app.template_global()
+def stylesheet_urls(bundle):
+    """Stylesheets for a template family: shared + area bundle, or the full style.css if not built"""
+    if app.debug or not os.path.exists(CSS_BUNDLES_JSON):
+        return [url_for('static', filename='style.css')]
+    return [
+        url_for('static', filename='css/shared.css'),
+        url_for('static', filename=f'css/{bundle}.css')
+    ]
+
+@app.template_global()
+def critical_css(page):
+    """Above-the-fold rules to inline for a page, or '' when bundles are not built"""
+    if app.debug or not os.path.exists(CSS_BUNDLES_JSON):
+        return ''
+    # Prefer the fingerprinted copy, whose url() references point at hashed assets
+    entry = load_static_manifest().get(f'css/critical-{page}.css')
+    path = os.path.join(app.static_folder, entry['path']) if entry else os.path.join(CSS_BUNDLE_DIR, f'critical-{page}.css')
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return ''
+    cached = _critical_css_cache.get(page)
+    if cached is None or cached[:2] != (path, mtime):
+        with open(path, 'r', encoding='utf-8') as f:
+            cached = (path, mtime, Markup(f.read()))
+        _critical_css_cache[page] = cached
+    return cached[2]
+
 def get_categories():
     categories = []
     if os.path.exists(CATEGORIES_CSV):
@@ -102,180 +567,500 @@ def get_categories():
 
 def save_categories(categories):
     unique_sorted = sorted(set([c.strip() for c in categories if c.strip()]))
-    with open(CATEGORIES_CSV, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(['category'])
-        for category in unique_sorted:
-            writer.writerow([category])
+    write_csv_atomic(CATEGORIES_CSV, ['category'], ([category] for category in unique_sorted))
     return unique_sorted
 
-def get_user_map():
-    users = {}
-    if os.path.exists(USERS_CSV):
-        with open(USERS_CSV, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                users[row['user_id']] = row['name']
-    return users
+# employees.db connections are pooled one per thread (so one per request under gthread)
+# and run in WAL mode, letting dashboard reads proceed while a check-out commits.
+EMPLOYEE_DB_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',   # safe with WAL; fsync only at checkpoints
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA cache_size=-8000',     # 8 MB page cache per connection
+    'PRAGMA temp_store=MEMORY',
+]
+EMPLOYEE_DB_HEALTH_CHECK_SECONDS = 30
+_employee_db_local = threading.local()
 
-def get_employee_connection():
-    conn = sqlite3.connect(EMPLOYEES_DB)
+def open_employee_connection():
+    # Room for every employee_repository statement plus the ad hoc ones in this module
+    conn = sqlite3.connect(EMPLOYEES_DB, timeout=5, cached_statements=STATEMENT_COUNT + 128)
     conn.row_factory = sqlite3.Row
+    for pragma in EMPLOYEE_DB_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
-def init_employee_db():
+def get_employee_connection():
+    """Return this thread's pooled employees.db connection.
+
+    The connection is replaced if the process forked, the database file was
+    swapped out (e.g. restored from a backup), or a periodic `SELECT 1` health
+    check fails. Callers keep using `with get_employee_connection() as conn:`,
+    which commits or rolls back but leaves the connection open for reuse.
+    """
+    pooled = getattr(_employee_db_local, 'pooled', None)
+    now = time.monotonic()
+    try:
+        inode = os.stat(EMPLOYEES_DB).st_ino
+    except FileNotFoundError:
+        inode = None
+    if pooled is not None:
+        if pooled['pid'] != os.getpid() or pooled['inode'] != inode:
+            pooled = None  # a forked child must not share the parent's handle
+        elif now - pooled['checked_at'] > EMPLOYEE_DB_HEALTH_CHECK_SECONDS:
+            try:
+                pooled['conn'].execute('SELECT 1').fetchone()
+                pooled['checked_at'] = now
+            except sqlite3.Error:
+                pooled['conn'].close()
+                pooled = None
+    if pooled is None:
+        conn = open_employee_connection()
+        pooled = {'conn': conn, 'pid': os.getpid(), 'inode': os.stat(EMPLOYEES_DB).st_ino, 'checked_at': now}
+        _employee_db_local.pooled = pooled
+    return pooled['conn']
+
+def close_employee_connection():
+    """Close this thread's pooled connection (the next call opens a fresh one)"""
+    pooled = getattr(_employee_db_local, 'pooled', None)
+    _employee_db_local.pooled = None
+    if pooled is not None and pooled['pid'] == os.getpid():
+        pooled['conn'].close()
+
+@app.teardown_appcontext
+def release_employee_connection(exc):
+    """Roll back anything a request left uncommitted so the pooled connection holds no locks"""
+    pooled = getattr(_employee_db_local, 'pooled', None)
+    if pooled is not None and pooled['pid'] == os.getpid() and pooled['conn'].in_transaction:
+        pooled['conn'].rollback()
+
+# employees.db schema migrations, applied in order and recorded in schema_version.
+# Each runs exactly once per database, so request code can rely on the latest schema.
+def _migration_base_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS employees (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            employee_id TEXT UNIQUE NOT NULL,
+            first_name TEXT NOT NULL,
+            last_name TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            gender TEXT,
+            dob TEXT,
+            mobile TEXT,
+            address TEXT,
+            job_title TEXT,
+            notes TEXT,
+            status TEXT DEFAULT 'active',
+            created_at TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS attendance (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            employee_id TEXT NOT NULL,
+            date TEXT NOT NULL,
+            check_in_time TEXT,
+            check_out_time TEXT,
+            hours_worked REAL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (employee_id) REFERENCES employees(employee_id),
+            UNIQUE(employee_id, date)
+        )
+    ''')
+
+def _migration_employee_columns(conn):
+    # Databases created before schema_version existed may already have some of these
+    existing_columns = {row['name'] for row in conn.execute("PRAGMA table_info(employees)")}
+    if 'status' not in existing_columns:
+        conn.execute("ALTER TABLE employees ADD COLUMN status TEXT DEFAULT 'active'")
+    if 'schedule' not in existing_columns:
+        # SQLite doesn't support parameterized DEFAULT values in ALTER TABLE
+        # Escape single quotes in the JSON string
+        escaped_schedule = json.dumps(get_default_schedule()).replace("'", "''")
+        conn.execute(f"ALTER TABLE employees ADD COLUMN schedule TEXT DEFAULT '{escaped_schedule}'")
+    if 'hours_this_period' not in existing_columns:
+        conn.execute("ALTER TABLE employees ADD COLUMN hours_this_period REAL DEFAULT 0")
+    if 'last_paid_date' not in existing_columns:
+        conn.execute("ALTER TABLE employees ADD COLUMN last_paid_date TEXT")
+    if 'profile_picture' not in existing_columns:
+        conn.execute("ALTER TABLE employees ADD COLUMN profile_picture TEXT")
+    if 'hourly_rate' not in existing_columns:
+        conn.execute("ALTER TABLE employees ADD COLUMN hourly_rate REAL")
+
+def _migration_dashboard_indexes(conn):
+    # created_at is compared and sorted as text, so every row must use the same
+    # zero-padded 'YYYY-MM-DD HH:MM:SS' form (rows SQLite cannot parse are left alone)
+    conn.execute('''
+        UPDATE employees SET created_at = strftime('%Y-%m-%d %H:%M:%S', created_at)
+        WHERE strftime('%Y-%m-%d %H:%M:%S', created_at) IS NOT NULL
+          AND created_at != strftime('%Y-%m-%d %H:%M:%S', created_at)
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_employees_created_at ON employees(created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_employees_status_created_at ON employees(status, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_employees_job_title_status ON employees(job_title, status)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_attendance_date ON attendance(date, check_in_time)")
+
+EMPLOYEE_SEARCH_COLUMNS = ['employee_id', 'first_name', 'last_name', 'email', 'mobile', 'job_title']
+
+def _migration_employee_search(conn):
+    # External-content FTS5 index over the directory fields, kept in step by triggers
+    columns = ', '.join(EMPLOYEE_SEARCH_COLUMNS)
+    new_values = ', '.join(f'new.{column}' for column in EMPLOYEE_SEARCH_COLUMNS)
+    old_values = ', '.join(f'old.{column}' for column in EMPLOYEE_SEARCH_COLUMNS)
+    conn.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS employee_search USING fts5(
+            {columns}, content='employees', content_rowid='id', prefix='2 3', tokenize='unicode61'
+        )
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS employees_search_insert AFTER INSERT ON employees BEGIN
+            INSERT INTO employee_search (rowid, {columns}) VALUES (new.id, {new_values});
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS employees_search_delete AFTER DELETE ON employees BEGIN
+            INSERT INTO employee_search (employee_search, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS employees_search_update AFTER UPDATE OF {columns} ON employees BEGIN
+            INSERT INTO employee_search (employee_search, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+            INSERT INTO employee_search (rowid, {columns}) VALUES (new.id, {new_values});
+        END
+    """)
+    conn.execute("INSERT INTO employee_search (employee_search) VALUES ('rebuild')")
+
+def _migration_schedules_table(conn):
+    # One typed row per employee per weekday replaces the JSON schedule column,
+    # which is left in place but no longer read or written
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schedules (
+            employee_id TEXT NOT NULL,
+            weekday INTEGER NOT NULL CHECK (weekday BETWEEN 0 AND 6),
+            enabled INTEGER NOT NULL DEFAULT 0,
+            start_minute INTEGER NOT NULL,
+            end_minute INTEGER NOT NULL,
+            PRIMARY KEY (employee_id, weekday),
+            FOREIGN KEY (employee_id) REFERENCES employees(employee_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_schedules_weekday ON schedules(weekday, enabled, start_minute)")
+
+    def legacy_rows():
+        for row in conn.execute("SELECT employee_id, schedule FROM employees").fetchall():
+            try:
+                schedule = json.loads(row['schedule']) if row['schedule'] else None
+            except (json.JSONDecodeError, TypeError):
+                schedule = None
+            yield from schedule_rows(row['employee_id'], schedule)
+    conn.executemany(
+        "INSERT OR REPLACE INTO schedules (employee_id, weekday, enabled, start_minute, end_minute) VALUES (?, ?, ?, ?, ?)",
+        legacy_rows()
+    )
+
+    # New employees start on the default schedule (as of this migration); rows go with the employee
+    default_rows = ', '.join(
+        f"(new.employee_id, {weekday}, {enabled}, {start}, {end})"
+        for _, weekday, enabled, start, end in schedule_rows(None, get_default_schedule())
+    )
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS employees_schedule_insert AFTER INSERT ON employees BEGIN
+            INSERT OR IGNORE INTO schedules (employee_id, weekday, enabled, start_minute, end_minute) VALUES {default_rows};
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS employees_schedule_delete AFTER DELETE ON employees BEGIN
+            DELETE FROM schedules WHERE employee_id = old.employee_id;
+        END
+    """)
+
+def _migration_employee_id_allocator(conn):
+    # Counter and secret key for allocate_employee_id. IDs handed out before the
+    # allocator existed were random, so the permutation indices that map onto
+    # them are reserved and skipped.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS employee_id_allocator (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            secret TEXT NOT NULL,
+            next_index INTEGER NOT NULL
+        )
+    ''')
+    conn.execute("CREATE TABLE IF NOT EXISTS employee_id_reserved (permutation_index INTEGER PRIMARY KEY)")
+    secret = secrets.token_hex(16)
+    conn.execute("INSERT OR IGNORE INTO employee_id_allocator (id, secret, next_index) VALUES (1, ?, 0)", (secret,))
+    secret = conn.execute("SELECT secret FROM employee_id_allocator WHERE id = 1").fetchone()[0]
+    conn.executemany(
+        "INSERT OR IGNORE INTO employee_id_reserved (permutation_index) VALUES (?)",
+        ((unpermute_employee_index(int(row[0]), secret),)
+         for row in conn.execute("SELECT employee_id FROM employees").fetchall()
+         if len(row[0]) == 6 and row[0].isdigit())
+    )
+
+def _migration_directory_keyset_indexes(conn):
+    # The directory pages on (created_at, employee_id); employee_id breaks ties between
+    # employees added in the same second (bulk imports share one created_at)
+    conn.execute("DROP INDEX IF EXISTS idx_employees_created_at")
+    conn.execute("DROP INDEX IF EXISTS idx_employees_status_created_at")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_employees_created_at_id ON employees(created_at, employee_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_employees_status_created_at_id ON employees(status, created_at, employee_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_employees_job_title_created_at_id ON employees(job_title, created_at, employee_id)")
+
+EMPLOYEE_MIGRATIONS = [
+    (1, 'Base employees and attendance tables', _migration_base_tables),
+    (2, 'Status, schedule, payroll, profile picture and hourly rate columns', _migration_employee_columns),
+    (3, 'Indexes for dashboard employee/attendance queries; normalised created_at', _migration_dashboard_indexes),
+    (4, 'FTS5 employee directory search', _migration_employee_search),
+    (5, 'Per-weekday schedules table migrated from the JSON schedule column', _migration_schedules_table),
+    (6, 'Keyed-permutation employee ID allocator', _migration_employee_id_allocator),
+    (7, 'Keyset pagination indexes for the employee directory', _migration_directory_keyset_indexes),
+]
+
+def get_employee_schema_version(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    ''')
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+def migrate_employee_db():
+    """Apply pending employees.db migrations; returns the (version, description) pairs applied.
+
+    Runs under BEGIN IMMEDIATE so workers starting together apply each migration once.
+    """
     os.makedirs(DATA_DIR, exist_ok=True)
+    latest = EMPLOYEE_MIGRATIONS[-1][0]
+    with closing(open_employee_connection()) as conn:
+        conn.isolation_level = None
+        if get_employee_schema_version(conn) >= latest:
+            return []
+        applied = []
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            current = get_employee_schema_version(conn)
+            for version, description, migrate in EMPLOYEE_MIGRATIONS:
+                if version > current:
+                    migrate(conn)
+                    conn.execute(
+                        "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                        (version, description, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+                    )
+                    applied.append((version, description))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    return applied
+
+def init_employee_db():
+    migrate_employee_db()
+
+# Employee IDs are six digits. The n-th employee gets permute_employee_index(n): a
+# 4-round Feistel network over the two three-digit halves, keyed by a per-database
+# secret, so consecutive hires get unrelated-looking IDs that can never repeat.
+EMPLOYEE_ID_SPACE = 1_000_000
+_EMPLOYEE_ID_HALF = 1000
+_EMPLOYEE_ID_ROUNDS = 4
+
+def _employee_id_round(secret, round_number, half):
+    digest = hashlib.blake2b(f"{round_number}:{half}".encode(), key=bytes.fromhex(secret), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % _EMPLOYEE_ID_HALF
+
+def permute_employee_index(index, secret):
+    left, right = divmod(index, _EMPLOYEE_ID_HALF)
+    for round_number in range(_EMPLOYEE_ID_ROUNDS):
+        left, right = right, (left + _employee_id_round(secret, round_number, right)) % _EMPLOYEE_ID_HALF
+    return left * _EMPLOYEE_ID_HALF + right
+
+def unpermute_employee_index(value, secret):
+    left, right = divmod(value, _EMPLOYEE_ID_HALF)
+    for round_number in reversed(range(_EMPLOYEE_ID_ROUNDS)):
+        left, right = (right - _employee_id_round(secret, round_number, left)) % _EMPLOYEE_ID_HALF, left
+    return left * _EMPLOYEE_ID_HALF + right
+
+def allocate_employee_ids(conn, count):
+    """Take the next `count` employee IDs from the allocator.
+
+    Call it inside the transaction that inserts the employees: the counter bump
+    then commits or rolls back together with the rows, and concurrent hires
+    serialise on SQLite's write lock instead of racing each other.
+    """
+    employee_ids = []
+    while len(employee_ids) < count:
+        needed = count - len(employee_ids)
+        end, secret = conn.execute(
+            "UPDATE employee_id_allocator SET next_index = next_index + ? WHERE id = 1 RETURNING next_index, secret",
+            (needed,)
+        ).fetchone()
+        if end > EMPLOYEE_ID_SPACE:
+            raise ValueError("Employee ID space exhausted")
+        # Only databases with pre-allocator (random) IDs have reserved indices
+        reserved = {row[0] for row in conn.execute(
+            "SELECT permutation_index FROM employee_id_reserved WHERE permutation_index >= ? AND permutation_index < ?",
+            (end - needed, end)
+        )}
+        employee_ids.extend(
+            f"{permute_employee_index(index, secret):06d}" for index in range(end - needed, end) if index not in reserved
+        )
+    return employee_ids
+
+def get_employees(search_query=None, limit=None, status_filter=None, job_title=None):
     with get_employee_connection() as conn:
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS employees (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                employee_id TEXT UNIQUE NOT NULL,
-                first_name TEXT NOT NULL,
-                last_name TEXT NOT NULL,
-                email TEXT UNIQUE NOT NULL,
-                gender TEXT,
-                dob TEXT,
-                mobile TEXT,
-                address TEXT,
-                job_title TEXT,
-                notes TEXT,
-                status TEXT DEFAULT 'active',
-                created_at TEXT NOT NULL
-            )
-        ''')
-        existing_columns = {row['name'] for row in conn.execute("PRAGMA table_info(employees)")}
-        if 'status' not in existing_columns:
-            conn.execute("ALTER TABLE employees ADD COLUMN status TEXT DEFAULT 'active'")
-        if 'schedule' not in existing_columns:
-            # Default schedule: Mon-Fri, 9AM-5PM
-            default_schedule = json.dumps({
-                'monday': {'enabled': True, 'start': '09:00', 'end': '17:00'},
-                'tuesday': {'enabled': True, 'start': '09:00', 'end': '17:00'},
-                'wednesday': {'enabled': True, 'start': '09:00', 'end': '17:00'},
-                'thursday': {'enabled': True, 'start': '09:00', 'end': '17:00'},
-                'friday': {'enabled': True, 'start': '09:00', 'end': '17:00'},
-                'saturday': {'enabled': False, 'start': '09:00', 'end': '17:00'},
-                'sunday': {'enabled': False, 'start': '09:00', 'end': '17:00'}
-            })
-            # SQLite doesn't support parameterized DEFAULT values in ALTER TABLE
-            # Escape single quotes in the JSON string
-            escaped_schedule = default_schedule.replace("'", "''")
-            conn.execute(f"ALTER TABLE employees ADD COLUMN schedule TEXT DEFAULT '{escaped_schedule}'")
-        if 'hours_this_period' not in existing_columns:
-            conn.execute("ALTER TABLE employees ADD COLUMN hours_this_period REAL DEFAULT 0")
-        if 'last_paid_date' not in existing_columns:
-            conn.execute("ALTER TABLE employees ADD COLUMN last_paid_date TEXT")
-        if 'profile_picture' not in existing_columns:
-            conn.execute("ALTER TABLE employees ADD COLUMN profile_picture TEXT")
-        if 'hourly_rate' not in existing_columns:
-            conn.execute("ALTER TABLE employees ADD COLUMN hourly_rate REAL")
-        
-        # Create attendance table
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS attendance (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                employee_id TEXT NOT NULL,
-                date TEXT NOT NULL,
-                check_in_time TEXT,
-                check_out_time TEXT,
-                hours_worked REAL DEFAULT 0,
-                created_at TEXT NOT NULL,
-                FOREIGN KEY (employee_id) REFERENCES employees(employee_id),
-                UNIQUE(employee_id, date)
-            )
-        ''')
-        conn.commit()
+        employees = list_employees(conn, search_query, status_filter, job_title, limit)
+        # Without filters every employee is listed, so read every schedule in one pass
+        filtered = search_query or limit or status_filter or job_title
+        schedules = load_schedules(conn, [emp['employee_id'] for emp in employees] if filtered else None)
+    for emp in employees:
+        emp.schedule = schedules.get(emp.employee_id) or get_default_schedule()
+    return employees
+
+EMPLOYEE_PAGE_SIZE = 50
 
-def employee_id_exists(candidate):
+def encode_employee_cursor(employee):
+    return f"{employee['created_at']}|{employee['employee_id']}"
+
+def decode_employee_cursor(cursor):
+    created_at, separator, employee_id = (cursor or '').rpartition('|')
+    return (created_at, employee_id) if separator else None
+
+def get_employee_page(status_filter=None, job_title=None, cursor=None, limit=EMPLOYEE_PAGE_SIZE):
+    """One page of employees and the cursor for the next page (None on the last page)"""
     with get_employee_connection() as conn:
-        row = conn.execute(
-            "SELECT 1 FROM employees WHERE employee_id = ? LIMIT 1",
-            (candidate,)
-        ).fetchone()
-    return row is not None
-
-def generate_employee_id():
-    attempts = 0
-    while attempts < 1000:
-        candidate = f"{random.randint(0, 999_999):06d}"
-        if not employee_id_exists(candidate):
-            return candidate
-        attempts += 1
-    raise ValueError("Unable to generate unique employee ID")
-
-def get_employees(search_query=None, limit=None, status_filter=None):
-    query = "SELECT employee_id, first_name, last_name, email, gender, dob, mobile, address, job_title, notes, status, created_at, schedule FROM employees"
-    params = []
-    if search_query:
-        query += " WHERE (employee_id LIKE ? OR first_name LIKE ? OR last_name LIKE ? OR email LIKE ? OR mobile LIKE ?)"
-        search_term = f"%{search_query}%"
-        params.extend([search_term] * 5)
-    if status_filter:
-        clause = "status = ?"
-        if "WHERE" in query:
-            query += f" AND {clause}"
-        else:
-            query += f" WHERE {clause}"
-        params.append(status_filter)
-    query += " ORDER BY datetime(created_at) DESC"
-    if limit:
-        query += " LIMIT ?"
-        params.append(limit)
+        employees, has_more = page_employees(conn, status_filter, job_title, decode_employee_cursor(cursor), limit)
+        schedules = load_schedules(conn, [emp.employee_id for emp in employees])
+    for emp in employees:
+        emp.schedule = schedules.get(emp.employee_id) or get_default_schedule()
+    return employees, (encode_employee_cursor(employees[-1]) if has_more else None)
+
+def get_employee_stats():
+    """Directory-wide counts for the admin dashboard, aggregated by SQLite"""
+    with get_employee_connection() as conn:
+        total, complete_profiles = conn.execute('''
+            SELECT COUNT(*),
+                   COALESCE(SUM(COALESCE(email, '') != '' AND COALESCE(mobile, '') != '' AND COALESCE(address, '') != ''), 0)
+            FROM employees
+        ''').fetchone()
+        # Group on the raw columns (so the job_title/status indexes cover the scan),
+        # then fold NULL and '' into one label
+        def grouped(column, empty_label):
+            counts = {}
+            for value, count in conn.execute(f"SELECT {column}, COUNT(*) FROM employees GROUP BY {column}"):
+                label = value or empty_label
+                counts[label] = counts.get(label, 0) + count
+            return counts
+        return {
+            'total': total,
+            'complete_profiles': complete_profiles,
+            'gender_counts': grouped('gender', 'Not set'),
+            'role_counts': grouped('job_title', 'Unassigned'),
+            'status_counts': grouped('status', 'active'),
+        }
 
+def get_employee_choices():
+    """(employee_id, first_name, last_name) for every employee, for pickers"""
     with get_employee_connection() as conn:
-        rows = conn.execute(query, params).fetchall()
-        employees = []
-        for row in rows:
-            emp = dict(row)
-            # Parse schedule JSON
-            if emp.get('schedule'):
-                try:
-                    emp['schedule'] = json.loads(emp['schedule'])
-                except:
-                    emp['schedule'] = get_default_schedule()
-            else:
-                emp['schedule'] = get_default_schedule()
-            employees.append(emp)
-        return employees
+        return conn.execute("SELECT employee_id, first_name, last_name FROM employees ORDER BY first_name, last_name").fetchall()
 
 def create_employee_record(first_name, last_name, email, gender='', dob='', mobile='', address='', job_title='', notes='', status='active'):
     created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    employee_id = generate_employee_id()
-    default_schedule = json.dumps(get_default_schedule())
+    # The employees_schedule_insert trigger gives the new employee the default schedule
     with get_employee_connection() as conn:
-        # Check if schedule column exists
-        existing_columns = {row['name'] for row in conn.execute("PRAGMA table_info(employees)")}
-        if 'schedule' in existing_columns:
-            conn.execute('''
-                INSERT INTO employees (employee_id, first_name, last_name, email, gender, dob, mobile, address, job_title, notes, status, created_at, schedule)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (employee_id, first_name, last_name, email, gender, dob, mobile, address, job_title, notes, status, created_at, default_schedule))
-        else:
-            conn.execute('''
-                INSERT INTO employees (employee_id, first_name, last_name, email, gender, dob, mobile, address, job_title, notes, status, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (employee_id, first_name, last_name, email, gender, dob, mobile, address, job_title, notes, status, created_at))
+        employee_id = allocate_employee_ids(conn, 1)[0]
+        conn.execute('''
+            INSERT INTO employees (employee_id, first_name, last_name, email, gender, dob, mobile, address, job_title, notes, status, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (employee_id, first_name, last_name, email, gender, dob, mobile, address, job_title, notes, status, created_at))
         conn.commit()
     return employee_id
 
-def update_employee_record(employee_id, **fields):
-    allowed_fields = {'first_name', 'last_name', 'email', 'gender', 'dob', 'mobile', 'address', 'job_title', 'notes', 'schedule'}
-    updates = []
-    params = []
-    for key, value in fields.items():
-        if key in allowed_fields and value is not None:
-            if key == 'schedule' and isinstance(value, dict):
-                # Convert schedule dict to JSON string
-                value = json.dumps(value)
-            updates.append(f"{key} = ?")
-            params.append(value)
-    if not updates:
-        return False
-    params.append(employee_id)
+EMPLOYEE_IMPORT_FIELDS = ['first_name', 'last_name', 'email', 'gender', 'dob', 'mobile', 'address', 'job_title', 'notes', 'status']
+EMPLOYEE_IMPORT_MAX = 5000
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+def parse_employee_upload(file_storage):
+    """Read employee rows from an uploaded CSV; headers like 'First Name' match first_name"""
+    if not (file_storage.filename or '').lower().endswith('.csv'):
+        raise ValueError('Upload a .csv file')
+    reader = csv.DictReader(io.StringIO(file_storage.read().decode('utf-8-sig')))
+    reader.fieldnames = [name.strip().lower().replace(' ', '_') for name in reader.fieldnames or []]
+    missing = [field for field in ('first_name', 'last_name', 'email') if field not in reader.fieldnames]
+    if missing:
+        raise ValueError(f"missing column(s) {', '.join(missing)}")
+    return list(reader)
+
+def validate_employee_row(row):
+    """Clean one import row; returns (record, None) or (None, problem)"""
+    record = {field: str(row.get(field) or '').strip() for field in EMPLOYEE_IMPORT_FIELDS}
+    missing = [field for field in ('first_name', 'last_name', 'email') if not record[field]]
+    if missing:
+        return None, f"missing {', '.join(missing)}"
+    if not EMAIL_PATTERN.match(record['email']):
+        return None, f"invalid email {record['email']}"
+    if record['dob']:
+        try:
+            datetime.strptime(record['dob'], '%Y-%m-%d')
+        except ValueError:
+            return None, 'dob must be YYYY-MM-DD'
+    record['status'] = record['status'].lower() or 'active'
+    if record['status'] not in {'active', 'suspended'}:
+        return None, "status must be 'active' or 'suspended'"
+    return record, None
+
+def import_employees(rows):
+    """Validate a batch of employee rows and insert the valid ones in one transaction.
+
+    Bad rows (including emails already on file or repeated in the batch) are
+    reported and skipped without aborting the rest. Returns
+    {'added': [(employee_id, first_name, last_name)], 'errors': [...]}.
+    """
+    records = []
+    errors = []
+    seen_emails = set()
+    for index, row in enumerate(rows, start=1):
+        record, problem = validate_employee_row(row)
+        if record and record['email'].lower() in seen_emails:
+            problem = f"duplicate email {record['email']} in file"
+        if problem:
+            errors.append((index, problem))
+            continue
+        seen_emails.add(record['email'].lower())
+        records.append((index, record))
+
     with get_employee_connection() as conn:
-        conn.execute(f"UPDATE employees SET {', '.join(updates)} WHERE employee_id = ?", params)
+        # Take the write lock first so no other hire can claim an email between the check and the insert
+        conn.execute('BEGIN IMMEDIATE')
+        # Case-insensitive, like the in-file duplicate check above
+        emails = [record['email'].lower() for _, record in records]
+        existing = {row[0] for row in conn.execute(
+            f"SELECT lower(email) FROM employees WHERE lower(email) IN ({', '.join('?' * len(emails))})", emails
+        )} if emails else set()
+        for index, record in records:
+            if record['email'].lower() in existing:
+                errors.append((index, f"an employee with email {record['email']} already exists"))
+        records = [record for _, record in records if record['email'].lower() not in existing]
+
+        created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        employee_ids = allocate_employee_ids(conn, len(records)) if records else []
+        conn.executemany('''
+            INSERT INTO employees (employee_id, first_name, last_name, email, gender, dob, mobile, address, job_title, notes, status, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (employee_id, *(record[field] for field in EMPLOYEE_IMPORT_FIELDS), created_at)
+            for employee_id, record in zip(employee_ids, records)
+        ])
         conn.commit()
-    return True
+    added = [(employee_id, record['first_name'], record['last_name']) for employee_id, record in zip(employee_ids, records)]
+    return {'added': added, 'errors': [f"Row {index}: {problem}" for index, problem in sorted(errors)]}
+
+def update_employee_record(employee_id, **fields):
+    schedule = fields.pop('schedule', None)
+    # One transaction for the schedule rows and the fields, so a failure saves neither
+    with get_employee_connection() as conn:
+        schedule_saved = schedule is not None and write_employee_schedule(conn, employee_id, schedule)
+        fields_saved = update_employee(conn, employee_id, fields)
+    return fields_saved or schedule_saved
 
 def update_employee_status(employee_id, status):
     if status not in {'active', 'suspended'}:
@@ -302,47 +1087,104 @@ def get_default_schedule():
         'sunday': {'enabled': False, 'start': '09:00', 'end': '17:00'}
     }
 
-# Cache for table structure to avoid repeated PRAGMA calls
-_employee_table_columns = None
+# schedules.weekday numbers the days like datetime.weekday(): 0 is Monday
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+def time_to_minutes(value):
+    """'HH:MM' -> minutes after midnight; raises ValueError for anything else"""
+    hours, minutes = (int(part) for part in str(value).strip().split(':'))
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(f"Invalid time: {value!r}")
+    return hours * 60 + minutes
+
+def minutes_to_time(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+def schedule_rows(employee_id, schedule):
+    """schedules rows (employee_id, weekday, enabled, start_minute, end_minute) for a schedule dict.
+
+    Days that are missing, or whose times can't be read, fall back to the default for that day.
+    """
+    default = get_default_schedule()
+    rows = []
+    for weekday, day in enumerate(WEEKDAYS):
+        day_schedule = schedule.get(day) if isinstance(schedule, dict) else None
+        if not isinstance(day_schedule, dict):
+            day_schedule = default[day]
+        try:
+            start = time_to_minutes(day_schedule.get('start', default[day]['start']))
+            end = time_to_minutes(day_schedule.get('end', default[day]['end']))
+        except (TypeError, ValueError):
+            start, end = time_to_minutes(default[day]['start']), time_to_minutes(default[day]['end'])
+        enabled = day_schedule.get('enabled') in (True, 'true', 'on')
+        rows.append((employee_id, weekday, int(enabled), start, end))
+    return rows
+
+def load_schedules(conn, employee_ids=None):
+    """Schedule dicts ({'monday': {'enabled', 'start', 'end'}, ...}) keyed by employee_id,
+    for the given employees or for everyone"""
+    query = "SELECT employee_id, weekday, enabled, start_minute, end_minute FROM schedules"
+    params = []
+    if employee_ids is not None:
+        if not employee_ids:
+            return {}
+        query += f" WHERE employee_id IN ({', '.join('?' * len(employee_ids))})"
+        params = list(employee_ids)
+    schedules = {}
+    for row in conn.execute(query, params):
+        schedule = schedules.setdefault(row['employee_id'], get_default_schedule())
+        schedule[WEEKDAYS[row['weekday']]] = {
+            'enabled': bool(row['enabled']),
+            'start': minutes_to_time(row['start_minute']),
+            'end': minutes_to_time(row['end_minute'])
+        }
+    return schedules
+
+def get_day_schedule(employee_id, weekday):
+    """The schedules row (enabled, start_minute, end_minute) for one employee and weekday"""
+    with get_employee_connection() as conn:
+        return conn.execute(
+            "SELECT enabled, start_minute, end_minute FROM schedules WHERE employee_id = ? AND weekday = ?",
+            (employee_id, weekday)
+        ).fetchone()
+
+def write_employee_schedule(conn, employee_id, schedule):
+    """Replace an employee's seven schedules rows in the caller's transaction; False if
+    the employee doesn't exist"""
+    if conn.execute("SELECT 1 FROM employees WHERE employee_id = ?", (employee_id,)).fetchone() is None:
+        return False
+    conn.executemany(
+        "INSERT OR REPLACE INTO schedules (employee_id, weekday, enabled, start_minute, end_minute) VALUES (?, ?, ?, ?, ?)",
+        schedule_rows(employee_id, schedule)
+    )
+    return True
+
+def scheduled_employees_query(weekday, start_minute, end_minute):
+    """SQL and parameters for active employees whose shift on `weekday` overlaps [start, end)"""
+    query = '''
+        SELECT e.employee_id, e.first_name, e.last_name, e.job_title, s.start_minute, s.end_minute
+        FROM schedules s JOIN employees e ON e.employee_id = s.employee_id
+        WHERE s.weekday = ? AND s.enabled = 1 AND s.start_minute < ? AND s.end_minute > ? AND e.status = 'active'
+        ORDER BY s.start_minute
+    '''
+    return query, [weekday, end_minute, start_minute]
+
+def get_scheduled_employees(weekday, start, end):
+    """Who is on shift at some point between `start` and `end` ('HH:MM') on `weekday` (0=Monday)"""
+    query, params = scheduled_employees_query(weekday, time_to_minutes(start), time_to_minutes(end))
+    with get_employee_connection() as conn:
+        rows = conn.execute(query, params).fetchall()
+    return [
+        dict(row, start=minutes_to_time(row['start_minute']), end=minutes_to_time(row['end_minute']))
+        for row in rows
+    ]
 
 def get_employee_by_id(employee_id):
     """Get employee by employee_id"""
-    global _employee_table_columns
     with get_employee_connection() as conn:
-        # Cache table structure check
-        if _employee_table_columns is None:
-            table_info = conn.execute("PRAGMA table_info(employees)").fetchall()
-            _employee_table_columns = [col['name'] for col in table_info]
-        
-        # Build SELECT query dynamically based on available columns
-        columns = ['employee_id', 'first_name', 'last_name', 'email', 'gender', 'dob', 'mobile', 'address', 'job_title', 'notes', 'status', 'created_at']
-        if 'schedule' in _employee_table_columns:
-            columns.append('schedule')
-        if 'hourly_rate' in _employee_table_columns:
-            columns.append('hourly_rate')
-        if 'profile_picture' in _employee_table_columns:
-            columns.append('profile_picture')
-        
-        query = f"SELECT {', '.join(columns)} FROM employees WHERE employee_id = ?"
-        row = conn.execute(query, (employee_id,)).fetchone()
-        
-        if row:
-            emp = dict(row)
-            # Parse schedule JSON
-            schedule_str = emp.get('schedule')
-            if schedule_str and schedule_str.strip():
-                try:
-                    parsed_schedule = json.loads(schedule_str)
-                    # Ensure it's a dict and has the expected structure
-                    if isinstance(parsed_schedule, dict):
-                        emp['schedule'] = parsed_schedule
-                    else:
-                        emp['schedule'] = get_default_schedule()
-                except (json.JSONDecodeError, TypeError, ValueError) as e:
-                    # If parsing fails, use default schedule
-                    emp['schedule'] = get_default_schedule()
-            else:
-                emp['schedule'] = get_default_schedule()
+        emp = get_employee(conn, employee_id)
+        if emp:
+            emp.schedule = load_schedules(conn, [employee_id]).get(employee_id) or get_default_schedule()
             return emp
     return None
 
@@ -350,13 +1192,7 @@ def get_employee_by_id(employee_id):
 def get_today_attendance(employee_id, date):
     """Get today's attendance record for an employee"""
     with get_employee_connection() as conn:
-        row = conn.execute(
-            "SELECT * FROM attendance WHERE employee_id = ? AND date = ?",
-            (employee_id, date)
-        ).fetchone()
-        if row:
-            return dict(row)
-    return None
+        return get_attendance(conn, employee_id, date)
 
 def check_in_employee(employee_id):
     """Record employee check-in"""
@@ -366,10 +1202,7 @@ def check_in_employee(employee_id):
     
     with get_employee_connection() as conn:
         # Check if attendance record exists for today
-        existing = conn.execute(
-            "SELECT * FROM attendance WHERE employee_id = ? AND date = ?",
-            (employee_id, date)
-        ).fetchone()
+        existing = get_attendance(conn, employee_id, date)
         
         if existing:
             # Update check-in time if not already set
@@ -398,10 +1231,7 @@ def check_out_employee(employee_id):
     
     with get_employee_connection() as conn:
         # Get today's attendance record
-        attendance = conn.execute(
-            "SELECT * FROM attendance WHERE employee_id = ? AND date = ?",
-            (employee_id, date)
-        ).fetchone()
+        attendance = get_attendance(conn, employee_id, date)
         
         if not attendance:
             return False  # No check-in found
@@ -421,47 +1251,18 @@ def check_out_employee(employee_id):
         )
         
         # Update hours_this_period in employees table
-        existing_columns = {row['name'] for row in conn.execute("PRAGMA table_info(employees)")}
-        if 'hours_this_period' in existing_columns:
-            conn.execute(
-                "UPDATE employees SET hours_this_period = COALESCE(hours_this_period, 0) + ? WHERE employee_id = ?",
-                (hours_worked, employee_id)
-            )
+        conn.execute(
+            "UPDATE employees SET hours_this_period = COALESCE(hours_this_period, 0) + ? WHERE employee_id = ?",
+            (hours_worked, employee_id)
+        )
         
         conn.commit()
         return True
 
 def get_attendance_records(employee_id=None, date=None, start_date=None, end_date=None):
     """Get attendance records with optional filters"""
-    query = """
-        SELECT a.*, e.first_name, e.last_name, e.job_title
-        FROM attendance a
-        JOIN employees e ON a.employee_id = e.employee_id
-        WHERE 1=1
-    """
-    params = []
-    
-    if employee_id:
-        query += " AND a.employee_id = ?"
-        params.append(employee_id)
-    
-    if date:
-        query += " AND a.date = ?"
-        params.append(date)
-    
-    if start_date:
-        query += " AND a.date >= ?"
-        params.append(start_date)
-    
-    if end_date:
-        query += " AND a.date <= ?"
-        params.append(end_date)
-    
-    query += " ORDER BY a.date DESC, a.check_in_time DESC"
-    
     with get_employee_connection() as conn:
-        rows = conn.execute(query, params).fetchall()
-        return [dict(row) for row in rows]
+        return list_attendance(conn, employee_id, date, start_date, end_date)
 
 # Payroll functions
 def get_hours_worked_today(employee_id):
@@ -522,10 +1323,6 @@ def get_overtime_status(employee_id):
 def get_employee_payroll_info(employee_id):
     """Get payroll information for an employee"""
     with get_employee_connection() as conn:
-        existing_columns = {row['name'] for row in conn.execute("PRAGMA table_info(employees)")}
-        if 'hours_this_period' not in existing_columns or 'last_paid_date' not in existing_columns:
-            return {'hours_this_period': 0, 'last_paid_date': None}
-        
         row = conn.execute(
             "SELECT hours_this_period, last_paid_date FROM employees WHERE employee_id = ?",
             (employee_id,)
@@ -541,19 +1338,10 @@ def get_employee_payroll_info(employee_id):
 def get_all_employees_with_payroll():
     """Get all employees with their payroll information"""
     with get_employee_connection() as conn:
-        existing_columns = {row['name'] for row in conn.execute("PRAGMA table_info(employees)")}
-        
-        # Build SELECT query based on available columns
-        columns = ['employee_id', 'first_name', 'last_name', 'job_title', 'status', 'created_at']
-        if 'hours_this_period' in existing_columns:
-            columns.append('hours_this_period')
-        if 'last_paid_date' in existing_columns:
-            columns.append('last_paid_date')
-        if 'hourly_rate' in existing_columns:
-            columns.append('hourly_rate')
-        
-        query = f"SELECT {', '.join(columns)} FROM employees WHERE status = 'active' ORDER BY first_name, last_name"
-        employees = conn.execute(query).fetchall()
+        employees = conn.execute('''
+            SELECT employee_id, first_name, last_name, job_title, status, created_at, hours_this_period, last_paid_date, hourly_rate
+            FROM employees WHERE status = 'active' ORDER BY first_name, last_name
+        ''').fetchall()
         
         # Add default values for missing columns and calculate effective hourly rate
         role_rates = load_role_rates()
@@ -563,12 +1351,8 @@ def get_all_employees_with_payroll():
         result = []
         for row in employees:
             emp = dict(row)
-            if 'hours_this_period' not in emp:
+            if emp['hours_this_period'] is None:
                 emp['hours_this_period'] = 0
-            if 'last_paid_date' not in emp:
-                emp['last_paid_date'] = None
-            if 'hourly_rate' not in emp:
-                emp['hourly_rate'] = None
             
             # Calculate effective hourly rate
             emp['effective_hourly_rate'] = get_employee_hourly_rate(emp)
@@ -582,10 +1366,6 @@ def mark_employee_as_paid(employee_id):
     paid_date = now.strftime('%Y-%m-%d')
     
     with get_employee_connection() as conn:
-        existing_columns = {row['name'] for row in conn.execute("PRAGMA table_info(employees)")}
-        if 'hours_this_period' not in existing_columns or 'last_paid_date' not in existing_columns:
-            return False
-        
         conn.execute(
             "UPDATE employees SET hours_this_period = 0, last_paid_date = ? WHERE employee_id = ?",
             (paid_date, employee_id)
@@ -598,14 +1378,10 @@ def mark_multiple_employees_as_paid(employee_ids):
     now = datetime.now()
     paid_date = now.strftime('%Y-%m-%d')
     
+    if not employee_ids:
+        return 0
+    
     with get_employee_connection() as conn:
-        existing_columns = {row['name'] for row in conn.execute("PRAGMA table_info(employees)")}
-        if 'hours_this_period' not in existing_columns or 'last_paid_date' not in existing_columns:
-            return 0
-        
-        if not employee_ids:
-            return 0
-        
         placeholders = ','.join(['?'] * len(employee_ids))
         conn.execute(
             f"UPDATE employees SET hours_this_period = 0, last_paid_date = ? WHERE employee_id IN ({placeholders})",
@@ -625,6 +1401,105 @@ ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'admin123')
 # Create data directory if it doesn't exist
 os.makedirs(DATA_DIR, exist_ok=True)
 
+# Server-side sessions: the cookie holds only a signed session ID.
+# SESSION_BACKEND=memory keeps sessions in-process (tests, single worker).
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'sqlite')
+SESSION_CLEANUP_INTERVAL = 3600  # seconds between expired-session sweeps
+app.session_interface = ServerSideSessionInterface(
+    MemorySessionStore() if SESSION_BACKEND == 'memory' else SQLiteSessionStore(SESSIONS_DB),
+    cleanup_interval=SESSION_CLEANUP_INTERVAL
+)
+
+# Backups: snapshots of data/ into BACKUP_DIR (see data_backup.py). Each worker
+# runs a scheduler thread; the flock in backup_lock lets only one of them back up.
+# BACKUP_INTERVAL=0 disables scheduled backups (`flask --app app backup` still works).
+# The default keeps snapshots on the data disk itself (Render gives the service one disk).
+# They then undo bad writes, corruption and deletions, but do not survive losing the
+# disk: point BACKUP_DIR at another volume, or copy snapshots off it, for that.
+BACKUP_DIR = os.environ.get('BACKUP_DIR', os.path.join(DATA_DIR, 'backups'))
+BACKUP_INTERVAL = int(os.environ.get('BACKUP_INTERVAL', 6 * 3600))  # seconds between snapshots
+BACKUP_KEEP_RECENT = int(os.environ.get('BACKUP_KEEP_RECENT', 4))  # newest snapshots always kept
+BACKUP_KEEP_DAILY = int(os.environ.get('BACKUP_KEEP_DAILY', 7))  # plus the last snapshot of each of this many days
+BACKUP_CHECK_INTERVAL = 60  # seconds between "is a backup due?" checks
+BACKUP_RETRY_DELAY = 15 * 60  # seconds to wait after a failed scheduled backup
+# A snapshot is skipped if writing it would leave less free space than this on the
+# backup disk, so backups can never starve orders and check-ins of room
+BACKUP_MIN_FREE_BYTES = int(os.environ.get('BACKUP_MIN_FREE_BYTES', 100 * 1024 * 1024))
+BACKUP_PAGES_PER_STEP = 256  # SQLite pages copied per backup step (1 MB at the default page size)
+BACKUP_STEP_SLEEP = 0.05  # seconds the source database is left free between steps
+# Databases copied with the online backup API. sessions.db and users_index.db are
+# left out: sessions are disposable and the index is rebuilt from users.csv.
+BACKUP_DATABASES = [EMPLOYEES_DB, CARTS_DB, COUPONS_DB]
+BACKUP_SKIPPED_FILES = {os.path.basename(SESSIONS_DB), os.path.basename(USERS_INDEX_DB)}
+
+def backup_is_due(now=None):
+    names = data_backup.list_backups(BACKUP_DIR)
+    if not names:
+        return True
+    return (now or datetime.now()) - data_backup.snapshot_time(names[-1]) >= timedelta(seconds=BACKUP_INTERVAL)
+
+def backup_shares_data_volume():
+    """True if BACKUP_DIR is on the same filesystem as DATA_DIR (snapshots, not off-volume backups)"""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    return os.stat(BACKUP_DIR).st_dev == os.stat(DATA_DIR).st_dev
+
+def run_backup(only_if_due=False):
+    """Take a snapshot and prune old ones.
+
+    Returns (manifest, removed names); manifest is None if another process holds
+    the backup lock or, with only_if_due, if the newest snapshot is still recent.
+    """
+    with data_backup.backup_lock(BACKUP_DIR) as acquired:
+        if not acquired or (only_if_due and not backup_is_due()):
+            return None, []
+        try:
+            manifest = data_backup.create_backup(
+                DATA_DIR, BACKUP_DIR, BACKUP_DATABASES, skip=BACKUP_SKIPPED_FILES,
+                pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP, min_free_bytes=BACKUP_MIN_FREE_BYTES
+            )
+        except BaseException:
+            # Retention applies even when the snapshot failed, so failures cannot pile up;
+            # a pruning error is only logged, so the snapshot's own error is what propagates
+            try:
+                data_backup.prune_backups(BACKUP_DIR, BACKUP_KEEP_RECENT, BACKUP_KEEP_DAILY)
+            except OSError:
+                app.logger.exception('Pruning after a failed backup also failed')
+            raise
+        removed = data_backup.prune_backups(BACKUP_DIR, BACKUP_KEEP_RECENT, BACKUP_KEEP_DAILY)
+    return manifest, removed
+
+_backup_thread = None
+_backup_thread_lock = threading.Lock()
+
+@app.before_request
+def start_backup_scheduler():
+    """Start the backup scheduler lazily, so forked workers each get their own thread"""
+    global _backup_thread
+    if not BACKUP_INTERVAL or (_backup_thread is not None and _backup_thread.is_alive()):
+        return
+    with _backup_thread_lock:
+        if _backup_thread is not None and _backup_thread.is_alive():
+            return
+        def schedule():
+            if backup_shares_data_volume():
+                app.logger.warning('BACKUP_DIR %s is on the same volume as %s: these snapshots do not survive '
+                                   'losing that disk; set BACKUP_DIR to another volume or copy them off it', BACKUP_DIR, DATA_DIR)
+            delay = BACKUP_CHECK_INTERVAL
+            while True:
+                time.sleep(delay)
+                delay = BACKUP_CHECK_INTERVAL
+                try:
+                    manifest, removed = run_backup(only_if_due=True)
+                except (OSError, sqlite3.Error, data_backup.BackupError):
+                    app.logger.exception('Scheduled backup failed; retrying in %d seconds', BACKUP_RETRY_DELAY)
+                    delay = BACKUP_RETRY_DELAY
+                    continue
+                if manifest:
+                    app.logger.info('Backup %s written (%d bytes copied, %d pruned)',
+                                    manifest['name'], manifest['copied_bytes'], len(removed))
+        _backup_thread = threading.Thread(target=schedule, name='data-backup', daemon=True)
+        _backup_thread.start()
+
 # Initialize CSV files with headers if they don't exist
 def init_csv_files():
     # Users CSV
@@ -709,37 +1584,391 @@ def init_csv_files():
 init_csv_files()
 init_employee_db()
 
+# Password hashing runs on a small, capped pool so a burst of logins cannot pin every
+# request thread; work beyond the queue limit is rejected immediately.
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 8))
+PASSWORD_HASH_TIMEOUT = 10  # seconds a request waits for its hash before giving up
+
+# Sign-in throttling: failed attempts allowed per window, per account and per client IP
+LOGIN_WINDOW_SECONDS = 15 * 60
+LOGIN_MAX_FAILURES_PER_ACCOUNT = 5
+LOGIN_MAX_FAILURES_PER_IP = 30
+LOGIN_FAILURE_KEYS_MAX = 10000  # tracked accounts/IPs per worker; the least recently failed are dropped first
+LOGIN_FAILURE_SWEEP_INTERVAL = 60  # seconds between sweeps of expired entries
+
+class PasswordHasherBusy(RuntimeError):
+    """Raised when the password hashing pool is saturated"""
+
+_password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+_password_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_PENDING)
+
+def run_password_task(fn, *args):
+    """Run a hashing function on the bounded pool, or raise PasswordHasherBusy"""
+    if not _password_slots.acquire(blocking=False):
+        raise PasswordHasherBusy('Too many password operations in progress')
+    try:
+        future = _password_executor.submit(fn, *args)
+    except Exception:
+        _password_slots.release()
+        raise
+    future.add_done_callback(lambda _: _password_slots.release())
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except FutureTimeoutError:
+        raise PasswordHasherBusy('Password operation timed out')
+
+def hash_password(password):
+    return run_password_task(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+def verify_password(password_hash, password):
+    return run_password_task(check_password_hash, password_hash, password)
+
+_password_hash_method_full = None
+
+def current_password_hash_method():
+    """PASSWORD_HASH_METHOD as werkzeug spells it in hashes, with defaults filled in
+    ('scrypt' -> 'scrypt:32768:8:1', 'pbkdf2:sha256' -> 'pbkdf2:sha256:<iterations>')"""
+    global _password_hash_method_full
+    if _password_hash_method_full is None:
+        sample = generate_password_hash('', method=PASSWORD_HASH_METHOD, salt_length=1)
+        _password_hash_method_full = sample.split('$', 1)[0]
+    return _password_hash_method_full
+
+def password_needs_rehash(password_hash):
+    """True if the hash was made with different parameters than PASSWORD_HASH_METHOD"""
+    return password_hash.split('$', 1)[0] != current_password_hash_method()
+
+# (kind, key) -> failure timestamps, least recently failed first
+_login_failures = OrderedDict()
+_login_failures_lock = threading.Lock()
+_login_failures_swept = 0.0
+
+def _sweep_login_failures(now):
+    """Drop keys whose failures have all expired, so many distinct emails cannot grow the dict forever"""
+    global _login_failures_swept
+    if now - _login_failures_swept < LOGIN_FAILURE_SWEEP_INTERVAL:
+        return
+    _login_failures_swept = now
+    for key in [key for key, attempts in _login_failures.items() if now - attempts[-1] >= LOGIN_WINDOW_SECONDS]:
+        del _login_failures[key]
+
+def _recent_failures(key, now):
+    attempts = [t for t in _login_failures.get(key, []) if now - t < LOGIN_WINDOW_SECONDS]
+    if attempts:
+        _login_failures[key] = attempts
+    else:
+        _login_failures.pop(key, None)
+    return attempts
+
+def is_login_throttled(email, ip):
+    now = time.time()
+    with _login_failures_lock:
+        return (len(_recent_failures(('account', normalize_email(email)), now)) >= LOGIN_MAX_FAILURES_PER_ACCOUNT or
+                len(_recent_failures(('ip', ip), now)) >= LOGIN_MAX_FAILURES_PER_IP)
+
+def record_login_failure(email, ip):
+    now = time.time()
+    with _login_failures_lock:
+        _sweep_login_failures(now)
+        for key in (('account', normalize_email(email)), ('ip', ip)):
+            _login_failures[key] = _recent_failures(key, now) + [now]
+            _login_failures.move_to_end(key)
+        while len(_login_failures) > LOGIN_FAILURE_KEYS_MAX:
+            _login_failures.popitem(last=False)
+
+def clear_login_failures(email):
+    with _login_failures_lock:
+        _login_failures.pop(('account', normalize_email(email)), None)
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+def get_user_index_connection():
+    # Autocommit mode: index syncs manage their own BEGIN IMMEDIATE transactions
+    conn = sqlite3.connect(USERS_INDEX_DB, timeout=10, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def init_user_index():
+    with closing(get_user_index_connection()) as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS user_emails (
+                email TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                offset INTEGER NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        conn.execute("CREATE TABLE IF NOT EXISTS user_index_meta (key TEXT PRIMARY KEY, value TEXT)")
+        # Upgraded password hashes waiting for `flask rehash-passwords` to write them to users.csv
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS pending_rehashes (
+                user_id TEXT PRIMARY KEY,
+                password_hash TEXT NOT NULL
+            ) WITHOUT ROWID
+        ''')
+
+init_user_index()
+
+def iter_csv_records(f, offset):
+    """Yield (offset, end_offset, raw_bytes) for each complete CSV record from a binary file.
+
+    Quoted fields may contain newlines (addresses do), so a record ends at the
+    first newline where the number of quote characters seen so far is even
+    (escaped quotes are doubled, so they never change the parity).
+    """
+    f.seek(offset)
+    start = position = offset
+    parts = []
+    quotes = 0
+    for line in iter(f.readline, b''):
+        parts.append(line)
+        quotes += line.count(b'"')
+        position += len(line)
+        if not line.endswith(b'\n'):
+            break  # trailing record still being written
+        if quotes % 2 == 0:
+            yield start, position, b''.join(parts)
+            start = position
+            parts = []
+            quotes = 0
+
+def parse_csv_record(raw):
+    return next(csv.reader(io.StringIO(raw.decode('utf-8'), newline='')), [])
+
+def read_users_header(f):
+    f.seek(0)
+    header_line = f.readline()
+    return parse_csv_record(header_line), len(header_line)
+
+def get_user_index_meta(conn):
+    return dict(conn.execute("SELECT key, value FROM user_index_meta").fetchall())
+
+def set_user_index_meta(conn, **values):
+    conn.executemany(
+        "INSERT OR REPLACE INTO user_index_meta (key, value) VALUES (?, ?)",
+        [(key, str(value)) for key, value in values.items()]
+    )
+
+# Bytes hashed from the start of users.csv and from just before the indexed end
+USER_INDEX_FINGERPRINT_BYTES = 4096
+
+def users_csv_fingerprint(f, end):
+    """Hash of the header and the last rows before `end`: a constant-cost check that
+    the already-indexed part of users.csv was not rewritten"""
+    digest = hashlib.sha256()
+    f.seek(0)
+    digest.update(f.read(min(end, USER_INDEX_FINGERPRINT_BYTES)))
+    tail = max(0, end - USER_INDEX_FINGERPRINT_BYTES)
+    f.seek(tail)
+    digest.update(f.read(end - tail))
+    return digest.hexdigest()
+
+def _sync_user_index_locked(conn, force=False):
+    """Index rows added to users.csv since the last sync; caller holds the write lock"""
+    stat = os.stat(USERS_CSV)
+    meta = get_user_index_meta(conn)
+    indexed_size = meta.get('indexed_size')
+    max_user_id = int(meta.get('max_user_id', 0))
+    if not force and indexed_size is not None and (indexed_size, meta.get('mtime_ns')) == (str(stat.st_size), str(stat.st_mtime_ns)):
+        return
+    with open(USERS_CSV, 'rb') as f:
+        # Growth only counts as an append if it is the same file and the indexed
+        # part still starts and ends with the bytes that were indexed
+        appended = (
+            not force and indexed_size is not None and int(indexed_size) < stat.st_size
+            and meta.get('inode') == str(stat.st_ino)
+            and meta.get('fingerprint') == users_csv_fingerprint(f, int(indexed_size))
+        )
+        if not appended:
+            # Shrunk, replaced or rewritten in place: rebuild from scratch
+            conn.execute("DELETE FROM user_emails")
+            indexed_size = None
+            max_user_id = 0
+        header, header_size = read_users_header(f)
+        email_col, id_col = header.index('email'), header.index('user_id')
+        start = int(indexed_size) if indexed_size is not None else header_size
+        entries = []
+        end = start
+        for offset, end, raw in iter_csv_records(f, start):
+            row = parse_csv_record(raw)
+            if len(row) > max(email_col, id_col):
+                entries.append((normalize_email(row[email_col]), row[id_col], offset))
+                if row[id_col].isdigit():
+                    max_user_id = max(max_user_id, int(row[id_col]))
+        fingerprint = users_csv_fingerprint(f, end)
+    # First occurrence wins, matching the old linear scan
+    conn.executemany("INSERT OR IGNORE INTO user_emails (email, user_id, offset) VALUES (?, ?, ?)", entries)
+    set_user_index_meta(conn, indexed_size=end, mtime_ns=stat.st_mtime_ns, max_user_id=max_user_id,
+                        inode=stat.st_ino, fingerprint=fingerprint)
+
+def sync_user_index(conn, force=False):
+    """Bring the email index up to date with users.csv.
+
+    Appends (the normal signup path) are indexed incrementally from the last
+    indexed offset; any other change to the file (a new inode, a smaller size,
+    or different bytes at the start or just before the old end) triggers a
+    full rebuild.
+    """
+    stat = os.stat(USERS_CSV)
+    meta = get_user_index_meta(conn)
+    if not force and (meta.get('indexed_size'), meta.get('mtime_ns')) == (str(stat.st_size), str(stat.st_mtime_ns)):
+        return
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        _sync_user_index_locked(conn, force)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+def read_user_record(offset):
+    with open(USERS_CSV, 'rb') as f:
+        header, _ = read_users_header(f)
+        for _, _, raw in iter_csv_records(f, offset):
+            return dict(zip(header, parse_csv_record(raw)))
+    return None
+
 def get_user_by_email(email):
-    """Get user by email from CSV"""
-    if not os.path.exists(USERS_CSV):
+    """Get user by email (case-insensitive) via the persistent email index"""
+    key = normalize_email(email)
+    if not key or not os.path.exists(USERS_CSV):
         return None
-    with open(USERS_CSV, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row['email'] == email:
-                return row
+    for attempt in range(2):
+        with closing(get_user_index_connection()) as conn:
+            sync_user_index(conn, force=attempt > 0)
+            row = conn.execute("SELECT offset FROM user_emails WHERE email = ?", (key,)).fetchone()
+        if not row:
+            return None
+        user = read_user_record(row['offset'])
+        if user and normalize_email(user.get('email')) == key:
+            return user
+        # Offset no longer points at this user (file edited in place): rebuild once
     return None
 
-def create_user(email, password, name, phone, address):
-    """Create a new user in CSV"""
-    # Get next user_id
-    user_id = 1
-    if os.path.exists(USERS_CSV):
-        with open(USERS_CSV, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            rows = list(reader)
-            if rows:
-                user_id = int(rows[-1]['user_id']) + 1
-    
-    password_hash = generate_password_hash(password)
+def append_user(email, password_hash, name, phone, address):
+    """Allocate a user_id and append the user to users.csv in constant time.
+
+    The index database's write lock (BEGIN IMMEDIATE) serialises concurrent
+    signups across gunicorn workers, so IDs never collide and appended rows
+    never interleave. Raises ValueError if the email is already registered.
+    """
     created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    
-    with open(USERS_CSV, 'a', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow([user_id, email, password_hash, name, phone, address, created_at])
-    
+    key = normalize_email(email)
+    with closing(get_user_index_connection()) as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            _sync_user_index_locked(conn)
+            if conn.execute("SELECT 1 FROM user_emails WHERE email = ?", (key,)).fetchone():
+                raise ValueError('Email already registered')
+            user_id = int(get_user_index_meta(conn).get('max_user_id', 0)) + 1
+
+            buffer = io.StringIO()
+            csv.writer(buffer).writerow([user_id, email, password_hash, name, phone, address, created_at])
+            record = buffer.getvalue().encode('utf-8')
+            with open(USERS_CSV, 'ab') as f:
+                offset = f.seek(0, os.SEEK_END)
+                f.write(record)
+            stat = os.stat(USERS_CSV)
+            with open(USERS_CSV, 'rb') as f:
+                fingerprint = users_csv_fingerprint(f, offset + len(record))
+
+            conn.execute("INSERT INTO user_emails (email, user_id, offset) VALUES (?, ?, ?)", (key, str(user_id), offset))
+            set_user_index_meta(conn, indexed_size=offset + len(record), mtime_ns=stat.st_mtime_ns, max_user_id=user_id,
+                                inode=stat.st_ino, fingerprint=fingerprint)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
     return user_id
 
+def create_user(email, password, name, phone, address):
+    """Create a new user in CSV"""
+    # Hash outside the index lock: it is the slow part and needs no coordination
+    password_hash = hash_password(password)
+    return append_user(email, password_hash, name, phone, address)
+
+def queue_password_rehash(user_id, password_hash):
+    """Record an upgraded hash for a user; applied in bulk by apply_pending_rehashes.
+
+    Rewriting users.csv costs O(users), so it is not done on the login path. The
+    old hash stays valid until the batch runs.
+    """
+    with closing(get_user_index_connection()) as conn:
+        conn.execute("INSERT OR REPLACE INTO pending_rehashes (user_id, password_hash) VALUES (?, ?)",
+                     (str(user_id), password_hash))
+
+def is_rehash_pending(user_id):
+    with closing(get_user_index_connection()) as conn:
+        return conn.execute("SELECT 1 FROM pending_rehashes WHERE user_id = ?", (str(user_id),)).fetchone() is not None
+
+def apply_pending_rehashes():
+    """Write all queued password hashes into users.csv in one rewrite; returns how many were applied"""
+    with closing(get_user_index_connection()) as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            pending = dict(conn.execute("SELECT user_id, password_hash FROM pending_rehashes").fetchall())
+            if pending:
+                with open(USERS_CSV, 'r', newline='', encoding='utf-8') as f:
+                    reader = csv.reader(f)
+                    header = next(reader)
+                    rows = list(reader)
+                id_col, hash_col = header.index('user_id'), header.index('password_hash')
+                for row in rows:
+                    if len(row) > max(id_col, hash_col) and row[id_col] in pending:
+                        row[hash_col] = pending[row[id_col]]
+                write_csv_atomic(USERS_CSV, header, rows)
+                _sync_user_index_locked(conn, force=True)  # row offsets moved with the new hash lengths
+                conn.execute("DELETE FROM pending_rehashes")
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    return len(pending)
+
+# In-memory user_id -> name directory for admin views, versioned by users.csv's
+# inode/size/mtime. Signups only append, so growth is read from the old end offset
+# when the indexed part's fingerprint still matches; an atomic rewrite (new inode)
+# or any other change reloads the whole file.
+_user_directory = {'version': None, 'inode': None, 'size': 0, 'fingerprint': None, 'names': {}}
+_user_directory_lock = threading.Lock()
+
+def get_user_directory():
+    """Return the cached user_id -> name mapping, refreshing it if users.csv changed"""
+    if not os.path.exists(USERS_CSV):
+        return {}
+    stat = os.stat(USERS_CSV)
+    version = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    with _user_directory_lock:
+        if _user_directory['version'] == version:
+            return _user_directory['names']
+        with open(USERS_CSV, 'rb') as f:
+            # Same fingerprint check as the email index: an in-place rewrite that
+            # happens to grow the file must not be mistaken for an append
+            appended = (
+                _user_directory['inode'] == stat.st_ino and stat.st_size > _user_directory['size']
+                and _user_directory['fingerprint'] == users_csv_fingerprint(f, _user_directory['size'])
+            )
+            names = dict(_user_directory['names']) if appended else {}
+            header, header_size = read_users_header(f)
+            id_col, name_col = header.index('user_id'), header.index('name')
+            end = start = _user_directory['size'] if appended else header_size
+            for _, end, raw in iter_csv_records(f, start):
+                row = parse_csv_record(raw)
+                if len(row) > max(id_col, name_col):
+                    names[row[id_col]] = row[name_col]
+            fingerprint = users_csv_fingerprint(f, end)
+        # A partially written trailing record stays unread until the next refresh
+        _user_directory.update(version=(stat.st_ino, end, stat.st_mtime_ns) if end == stat.st_size else None,
+                               inode=stat.st_ino, size=end, fingerprint=fingerprint, names=names)
+        return names
+
+def get_user_names(user_ids):
+    """Batch lookup of display names for the given user IDs"""
+    directory = get_user_directory()
+    return {user_id: directory[user_id] for user_id in set(user_ids) if user_id in directory}
+
 # Cache for menu items to avoid repeated file reads
 _menu_items_cache = None
 _menu_items_cache_time = None
@@ -770,25 +1999,292 @@ def get_menu_items():
     _menu_items_cache_time = datetime.now()
     return items
 
+MENU_FIELDS = ['item_id', 'name', 'description', 'price', 'category', 'image']
+
+def write_csv_atomic(path, header, rows):
+    """Write a CSV to a temp file and rename it over the original, so readers never see a partial file"""
+    # One temp file per thread: concurrent writers each rename their own complete file
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def write_json_atomic(path, data):
+    """JSON counterpart of write_csv_atomic"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
 def save_menu_items(items):
     """Persist menu items to CSV"""
     global _menu_items_cache, _menu_items_cache_time
-    with open(MENU_CSV, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(['item_id', 'name', 'description', 'price', 'category', 'image'])
-        for item in items:
-            writer.writerow([
-                item['item_id'],
-                item['name'],
-                item['description'],
-                f"{float(item['price']):.2f}",
-                item['category'],
-                item.get('image', '')
-            ])
+    write_csv_atomic(MENU_CSV, MENU_FIELDS, (
+        [
+            item['item_id'],
+            item['name'],
+            item['description'],
+            f"{float(item['price']):.2f}",
+            item['category'],
+            item.get('image', '')
+        ]
+        for item in items
+    ))
     # Invalidate cache when menu is updated
     _menu_items_cache = None
     _menu_items_cache_time = None
 
+def parse_menu_upload(file_storage):
+    """Read menu rows from an uploaded CSV or JSON file"""
+    filename = (file_storage.filename or '').lower()
+    content = file_storage.read().decode('utf-8-sig')
+    if filename.endswith('.json'):
+        data = json.loads(content)
+        return data.get('items', []) if isinstance(data, dict) else data
+    if filename.endswith('.csv'):
+        return list(csv.DictReader(io.StringIO(content)))
+    raise ValueError('Upload a .csv or .json file')
+
+def validate_menu_batch(rows):
+    """Validate a batch of menu rows; returns (items, errors) and never partially accepts"""
+    items = []
+    errors = []
+    seen_ids = set()
+    if not isinstance(rows, list):
+        return [], ['Expected a list of menu items']
+    for index, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            errors.append(f'Row {index}: expected an object with menu fields')
+            continue
+        item = {field: '' if row.get(field) is None else str(row[field]).strip() for field in MENU_FIELDS}
+        missing = [field for field in ('name', 'description', 'price', 'category') if not item[field]]
+        if missing:
+            errors.append(f"Row {index}: missing {', '.join(missing)}")
+            continue
+        try:
+            item['price'] = float(item['price'])
+        except ValueError:
+            errors.append(f"Row {index}: price must be a number")
+            continue
+        if not math.isfinite(item['price']):
+            errors.append(f"Row {index}: price must be a finite number")
+            continue
+        if item['price'] < 0:
+            errors.append(f"Row {index}: price cannot be negative")
+            continue
+        if item['item_id']:
+            if not item['item_id'].isdigit():
+                errors.append(f"Row {index}: item_id must be a whole number")
+                continue
+            if item['item_id'] in seen_ids:
+                errors.append(f"Row {index}: duplicate item_id {item['item_id']}")
+                continue
+            seen_ids.add(item['item_id'])
+        items.append(item)
+    return items, errors
+
+def diff_menu_items(current, incoming, mode='merge'):
+    """Match incoming items to the catalog by item_id (or name when no id is given).
+
+    mode='merge' upserts the batch; mode='replace' also removes items not in it.
+    Returns (new_catalog, report).
+    """
+    current_by_id = {item['item_id']: item for item in current}
+    current_by_name = {item['name'].lower(): item for item in current}
+    next_id = max([int(item['item_id']) for item in current if str(item['item_id']).isdigit()] + [0]) + 1
+    report = {'added': [], 'updated': [], 'removed': [], 'unchanged': 0}
+    merged = {}
+    for item in incoming:
+        existing = current_by_id.get(item['item_id']) if item['item_id'] else current_by_name.get(item['name'].lower())
+        if existing:
+            item['item_id'] = existing['item_id']
+            if not item['image']:
+                item['image'] = existing.get('image', '')
+            changed = any(str(item[field]) != str(existing.get(field, '')) for field in MENU_FIELDS if field != 'price')
+            if changed or abs(item['price'] - float(existing['price'])) >= 0.005:
+                report['updated'].append(item['name'])
+            else:
+                report['unchanged'] += 1
+        else:
+            if not item['item_id'] or item['item_id'] in merged:
+                item['item_id'] = str(next_id)
+            next_id = max(next_id, int(item['item_id'])) + 1
+            report['added'].append(item['name'])
+        merged[item['item_id']] = item
+
+    if mode == 'replace':
+        report['removed'] = [item['name'] for item in current if item['item_id'] not in merged]
+        catalog = list(merged.values())
+    else:
+        catalog = [merged.pop(item['item_id'], item) for item in current] + list(merged.values())
+    return catalog, report
+
+def apply_menu_batch(rows, mode='merge', dry_run=False):
+    """Validate, diff and apply a whole menu batch with a single write"""
+    items, errors = validate_menu_batch(rows)
+    if errors:
+        return {'added': [], 'updated': [], 'removed': [], 'unchanged': 0, 'errors': errors, 'applied': False}
+    current = [dict(item) for item in get_menu_items()]
+    catalog, report = diff_menu_items(current, items, mode)
+    report['errors'] = []
+    report['applied'] = False
+    if not dry_run and (report['added'] or report['updated'] or report['removed']):
+        categories = get_categories()
+        new_categories = {item['category'] for item in catalog} - set(categories)
+        if new_categories:
+            save_categories(categories + list(new_categories))
+        save_menu_items(catalog)
+        report['applied'] = True
+    return report
+
+_menu_index_cache = (None, {})
+
+def get_menu_index():
+    """item_id -> menu item, rebuilt whenever get_menu_items returns a new list"""
+    global _menu_index_cache
+    items = get_menu_items()
+    if _menu_index_cache[0] is not items:
+        _menu_index_cache = (items, {item['item_id']: item for item in items})
+    return _menu_index_cache[1]
+
+# Carts and wishlists are stored per user as (item_id, quantity, note) rows;
+# names and prices always come from the current menu when they are read.
+def get_carts_connection():
+    conn = sqlite3.connect(CARTS_DB, timeout=10)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def init_carts_db():
+    with closing(get_carts_connection()) as conn, conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS cart_items (
+                entry_id INTEGER PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                item_id TEXT NOT NULL,
+                quantity INTEGER NOT NULL,
+                note TEXT NOT NULL DEFAULT ''
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cart_items_user ON cart_items(user_id, entry_id)")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS wishlist_items (
+                entry_id INTEGER PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                item_id TEXT NOT NULL,
+                UNIQUE (user_id, item_id)
+            )
+        ''')
+
+init_carts_db()
+
+def get_cart_entries(user_id):
+    with closing(get_carts_connection()) as conn:
+        return conn.execute(
+            "SELECT entry_id, item_id, quantity, note FROM cart_items WHERE user_id = ? ORDER BY entry_id", (str(user_id),)
+        ).fetchall()
+
+def add_to_cart(user_id, entries):
+    """Append (item_id, quantity, note) entries to a user's cart"""
+    with closing(get_carts_connection()) as conn, conn:
+        conn.executemany(
+            "INSERT INTO cart_items (user_id, item_id, quantity, note) VALUES (?, ?, ?, ?)",
+            [(str(user_id), item_id, quantity, note or '') for item_id, quantity, note in entries]
+        )
+
+# Cart and wishlist lines are addressed by entry_id, not position: carts are shared
+# across devices, so a removal on one would shift every later position on the others
+def _user_entry(conn, table, user_id, entry_id):
+    return conn.execute(
+        f"SELECT entry_id, item_id FROM {table} WHERE entry_id = ? AND user_id = ?", (entry_id, str(user_id))
+    ).fetchone()
+
+def update_cart_entry(user_id, entry_id, quantity):
+    """Set the quantity of a cart entry (removing it if quantity <= 0); returns its item_id"""
+    with closing(get_carts_connection()) as conn, conn:
+        entry = _user_entry(conn, 'cart_items', user_id, entry_id)
+        if entry is None:
+            return None
+        if quantity <= 0:
+            conn.execute("DELETE FROM cart_items WHERE entry_id = ? AND user_id = ?", (entry_id, str(user_id)))
+        else:
+            conn.execute("UPDATE cart_items SET quantity = ? WHERE entry_id = ? AND user_id = ?",
+                         (quantity, entry_id, str(user_id)))
+        return entry['item_id']
+
+def remove_cart_entry(user_id, entry_id):
+    return update_cart_entry(user_id, entry_id, 0)
+
+def clear_cart(user_id):
+    with closing(get_carts_connection()) as conn, conn:
+        conn.execute("DELETE FROM cart_items WHERE user_id = ?", (str(user_id),))
+
+def get_wishlist_item_ids(user_id):
+    return [entry['item_id'] for entry in get_wishlist_entries(user_id)]
+
+def get_wishlist_entries(user_id):
+    with closing(get_carts_connection()) as conn:
+        return conn.execute(
+            "SELECT entry_id, item_id FROM wishlist_items WHERE user_id = ? ORDER BY entry_id", (str(user_id),)
+        ).fetchall()
+
+def get_wishlist_item(user_id, entry_id):
+    """item_id of one of the user's wishlist entries, or None"""
+    with closing(get_carts_connection()) as conn:
+        entry = _user_entry(conn, 'wishlist_items', user_id, entry_id)
+    return entry['item_id'] if entry else None
+
+def add_to_wishlist(user_id, item_id):
+    """Add an item to a user's wishlist; returns False if it was already there"""
+    with closing(get_carts_connection()) as conn, conn:
+        return conn.execute(
+            "INSERT OR IGNORE INTO wishlist_items (user_id, item_id) VALUES (?, ?)", (str(user_id), item_id)
+        ).rowcount == 1
+
+def remove_wishlist_entry(user_id, entry_id):
+    """Remove a wishlist entry; returns its item_id"""
+    with closing(get_carts_connection()) as conn, conn:
+        entry = _user_entry(conn, 'wishlist_items', user_id, entry_id)
+        if entry is None:
+            return None
+        conn.execute("DELETE FROM wishlist_items WHERE entry_id = ? AND user_id = ?", (entry_id, str(user_id)))
+        return entry['item_id']
+
+def get_cart_counts(user_id):
+    with closing(get_carts_connection()) as conn:
+        row = conn.execute(
+            "SELECT (SELECT COUNT(*) FROM cart_items WHERE user_id = ?) AS cart, "
+            "(SELECT COUNT(*) FROM wishlist_items WHERE user_id = ?) AS wishlist", (str(user_id), str(user_id))
+        ).fetchone()
+    return row['cart'], row['wishlist']
+
+def get_priced_wishlist(user_id):
+    menu = get_menu_index()
+    wishlist = []
+    for entry in get_wishlist_entries(user_id):
+        item_id = entry['item_id']
+        item = menu.get(item_id)
+        if item is not None:
+            wishlist.append({'entry_id': entry['entry_id'], 'item_id': item_id, 'name': item['name'], 'price': item['price'],
+                             'description': item['description'], 'image': item['image']})
+    return wishlist
+
+@app.context_processor
+def inject_cart_counts():
+    if 'user_id' not in session:
+        return {'cart_count': 0, 'wishlist_count': 0}
+    cart_count, wishlist_count = get_cart_counts(session['user_id'])
+    return {'cart_count': cart_count, 'wishlist_count': wishlist_count}
+
 def get_all_orders():
     """Return all orders (admin view)"""
     orders = []
@@ -808,25 +2304,24 @@ def get_all_orders():
 
 def save_orders(orders):
     """Persist orders to CSV"""
-    with open(ORDERS_CSV, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(['order_id', 'user_id', 'items', 'allergies', 'subtotal', 'tax', 'delivery_fee', 'tip', 'total', 'status', 'created_at', 'coupon_code', 'discount'])
-        for order in orders:
-            writer.writerow([
-                order['order_id'],
-                order['user_id'],
-                json.dumps(order['items']),
-                json.dumps(order.get('allergies', [])),
-                order['subtotal'],
-                order['tax'],
-                order['delivery_fee'],
-                order['tip'],
-                order['total'],
-                order['status'],
-                order['created_at'],
-                order.get('coupon_code', ''),
-                order.get('discount', '0.00')
-            ])
+    write_csv_atomic(ORDERS_CSV, ['order_id', 'user_id', 'items', 'allergies', 'subtotal', 'tax', 'delivery_fee', 'tip', 'total', 'status', 'created_at', 'coupon_code', 'discount'], (
+        [
+            order['order_id'],
+            order['user_id'],
+            json.dumps(order['items']),
+            json.dumps(order.get('allergies', [])),
+            order['subtotal'],
+            order['tax'],
+            order['delivery_fee'],
+            order['tip'],
+            order['total'],
+            order['status'],
+            order['created_at'],
+            order.get('coupon_code', ''),
+            order.get('discount', '0.00')
+        ]
+        for order in orders
+    ))
 
 def save_order(user_id, items, allergies, subtotal, tax, delivery_fee, tip, total, coupon_code='', discount=0.0):
     """Save order to CSV"""
@@ -893,29 +2388,89 @@ def save_order(user_id, items, allergies, subtotal, tax, delivery_fee, tip, tota
     return order_id
 
 # Coupon management functions
-def get_coupons():
-    """Get all coupons"""
-    coupons = []
-    if os.path.exists(COUPONS_CSV):
+COUPON_FIELDS = ['code', 'discount_type', 'discount_value', 'min_order', 'max_discount', 'usage_limit', 'used_count', 'expiry_date', 'is_active']
+
+# Parsed coupons keyed by normalised code, reloaded only when coupons.csv changes. `rows`
+# keeps every row in file order so a save never drops rows whose codes collide.
+_coupon_cache = {'version': None, 'by_code': {}, 'rows': [], 'duplicates': []}
+
+def normalize_coupon_code(code):
+    return (code or '').strip().upper()
+
+def parse_expiry_date(value):
+    """Normalise an expiry date to YYYY-MM-DD ('' for none); raises ValueError if it is malformed"""
+    value = (value or '').strip()
+    return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d') if value else ''
+
+COUPON_DISCOUNT_TYPES = ('percentage', 'fixed')
+
+def coupon_terms_error(discount_type, discount_value, min_order=0.0, max_discount=None, usage_limit=None):
+    """Why a set of parsed coupon terms is unusable, or None if they are valid"""
+    if discount_type not in COUPON_DISCOUNT_TYPES:
+        return 'Discount type must be percentage or fixed'
+    amounts = [discount_value, min_order] + ([max_discount] if max_discount is not None else [])
+    if any(not math.isfinite(amount) or amount < 0 for amount in amounts):
+        return 'Discount, minimum order and maximum discount must be zero or more'
+    if discount_type == 'percentage' and discount_value > 100:
+        return 'A percentage discount cannot exceed 100%'
+    if usage_limit is not None and usage_limit < 0:
+        return 'Usage limit cannot be negative'
+    return None
+
+def parse_coupon_row(row):
+    row['discount_value'] = float(row['discount_value'])
+    row['min_order'] = float(row.get('min_order', 0))
+    row['max_discount'] = float(row.get('max_discount', 0)) if row.get('max_discount') else None
+    row['usage_limit'] = int(row.get('usage_limit', 0)) if row.get('usage_limit') else None
+    row['used_count'] = int(row.get('used_count', 0))
+    row['is_active'] = row.get('is_active', 'true').lower() == 'true'
+    row['expires_at'] = None
+    if row.get('expiry_date'):
+        try:
+            row['expires_at'] = datetime.strptime(row['expiry_date'], '%Y-%m-%d')
+        except ValueError:
+            pass
+    return row
+
+def get_coupon_table():
+    """Return {normalised code: coupon}; treat the coupons as read-only"""
+    if not os.path.exists(COUPONS_CSV):
+        _coupon_cache.update(version=None, by_code={}, rows=[], duplicates=[])
+        return {}
+    stat = os.stat(COUPONS_CSV)
+    version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    if _coupon_cache['version'] != version:
+        by_code = {}
+        rows = []
+        duplicates = []
         with open(COUPONS_CSV, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                row['discount_value'] = float(row['discount_value'])
-                row['min_order'] = float(row.get('min_order', 0))
-                row['max_discount'] = float(row.get('max_discount', 0)) if row.get('max_discount') else None
-                row['usage_limit'] = int(row.get('usage_limit', 0)) if row.get('usage_limit') else None
-                row['used_count'] = int(row.get('used_count', 0))
-                row['is_active'] = row.get('is_active', 'true').lower() == 'true'
-                coupons.append(row)
-    return coupons
+            for row in csv.DictReader(f):
+                coupon = parse_coupon_row(row)
+                rows.append(coupon)
+                key = normalize_coupon_code(coupon['code'])
+                if key not in by_code:
+                    by_code[key] = coupon
+                elif key not in duplicates:
+                    duplicates.append(key)
+        if duplicates:
+            app.logger.warning('coupons.csv has duplicate codes (the first row is used): %s', ', '.join(duplicates))
+        _coupon_cache.update(version=version, by_code=by_code, rows=rows, duplicates=duplicates)
+    return _coupon_cache['by_code']
+
+def get_coupons():
+    """Get all coupon rows, duplicates included (copies, safe to modify and pass to save_coupons)"""
+    get_coupon_table()
+    return [dict(coupon) for coupon in _coupon_cache['rows']]
+
+def get_duplicate_coupon_codes():
+    """Normalised codes that appear on more than one row of coupons.csv"""
+    get_coupon_table()
+    return list(_coupon_cache['duplicates'])
 
 def get_coupon_by_code(code):
-    """Get coupon by code"""
-    coupons = get_coupons()
-    for coupon in coupons:
-        if coupon['code'].upper() == code.upper():
-            return coupon
-    return None
+    """Get coupon by code, from coupons.csv or a bulk-generated campaign"""
+    key = normalize_coupon_code(code)
+    return get_coupon_table().get(key) or get_campaign_coupon(key)
 
 def validate_coupon(code, subtotal):
     """Validate and calculate discount for a coupon"""
@@ -927,20 +2482,15 @@ def validate_coupon(code, subtotal):
         return None, "Coupon is not active"
     
     # Check expiry date
-    if coupon.get('expiry_date'):
-        try:
-            expiry = datetime.strptime(coupon['expiry_date'], '%Y-%m-%d')
-            if datetime.now() > expiry:
-                return None, "Coupon has expired"
-        except ValueError:
-            pass
+    if coupon['expires_at'] and datetime.now() > coupon['expires_at']:
+        return None, "Coupon has expired"
     
     # Check minimum order
     if subtotal < coupon['min_order']:
         return None, f"Minimum order of ${coupon['min_order']:.2f} required"
     
-    # Check usage limit
-    if coupon['usage_limit'] and coupon['used_count'] >= coupon['usage_limit']:
+    # Check usage limit (redeem_coupon re-checks atomically when the order is placed)
+    if coupon['usage_limit'] and get_coupon_used_count(coupon) >= coupon['usage_limit']:
         return None, "Coupon usage limit reached"
     
     # Calculate discount
@@ -953,33 +2503,269 @@ def validate_coupon(code, subtotal):
     
     return discount, None
 
-def apply_coupon(code):
-    """Increment coupon usage count"""
-    coupons = get_coupons()
-    for coupon in coupons:
-        if coupon['code'].upper() == code.upper():
-            coupon['used_count'] += 1
-            save_coupons(coupons)
-            return True
-    return False
+# Redemption counts live in SQLite so they can be checked and incremented in one
+# atomic statement. A coupon's row is seeded from its used_count in coupons.csv on
+# first redemption; from then on the database count is authoritative.
+def get_coupons_connection():
+    conn = sqlite3.connect(COUPONS_DB, timeout=10)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def init_coupons_db():
+    with closing(get_coupons_connection()) as conn, conn:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS coupon_usage (
+                code TEXT PRIMARY KEY,
+                used_count INTEGER NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        # Bulk-generated codes: one row of shared terms per campaign, codes stored as (code, campaign_id)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS coupon_campaigns (
+                campaign_id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                discount_type TEXT NOT NULL,
+                discount_value REAL NOT NULL,
+                min_order REAL NOT NULL DEFAULT 0,
+                max_discount REAL,
+                usage_limit INTEGER,
+                expiry_date TEXT NOT NULL DEFAULT '',
+                is_active INTEGER NOT NULL DEFAULT 1,
+                created_at TEXT NOT NULL
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS campaign_codes (
+                code TEXT PRIMARY KEY,
+                campaign_id INTEGER NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_campaign_codes_campaign ON campaign_codes(campaign_id)")
+
+init_coupons_db()
+
+COUPON_CODE_ALPHABET = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'  # no 0/O or 1/I look-alikes
+COUPON_CODE_LENGTH = 8
+BULK_COUPON_MAX = 100000
+
+def get_campaign_coupon(code):
+    """Build a coupon dict for a bulk-generated code, or None"""
+    with closing(get_coupons_connection()) as conn:
+        row = conn.execute('''
+            SELECT c.code, p.* FROM campaign_codes c JOIN coupon_campaigns p ON p.campaign_id = c.campaign_id
+            WHERE c.code = ?
+        ''', (code,)).fetchone()
+    if not row:
+        return None
+    coupon = parse_coupon_row({
+        'code': row['code'],
+        'discount_type': row['discount_type'],
+        'discount_value': row['discount_value'],
+        'min_order': row['min_order'],
+        'max_discount': row['max_discount'] or '',
+        'usage_limit': row['usage_limit'] or '',
+        'used_count': 0,
+        'expiry_date': row['expiry_date'],
+        'is_active': 'true' if row['is_active'] else 'false'
+    })
+    coupon['campaign'] = row['name']
+    return coupon
+
+def create_coupon_campaign(name, count, terms, prefix=''):
+    """Mint `count` unique random codes sharing one set of coupon terms; returns the campaign_id.
+
+    Codes are drawn in batches and inserted with INSERT OR IGNORE, so collisions
+    with existing campaign codes are simply redrawn; codes already in
+    coupons.csv are skipped up front. Everything is written in one transaction.
+    """
+    prefix = normalize_coupon_code(prefix)
+    csv_codes = get_coupon_table()
+    with closing(get_coupons_connection()) as conn, conn:
+        campaign_id = conn.execute('''
+            INSERT INTO coupon_campaigns (name, discount_type, discount_value, min_order, max_discount, usage_limit, expiry_date, is_active, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (name, terms['discount_type'], terms['discount_value'], terms.get('min_order') or 0.0, terms.get('max_discount'),
+              terms.get('usage_limit'), terms.get('expiry_date', ''), 1 if terms.get('is_active', True) else 0,
+              datetime.now().strftime('%Y-%m-%d %H:%M:%S'))).lastrowid
+        remaining = count
+        while remaining > 0:
+            batch = {prefix + ''.join(secrets.choice(COUPON_CODE_ALPHABET) for _ in range(COUPON_CODE_LENGTH))
+                     for _ in range(remaining)}
+            batch.difference_update(csv_codes)
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO campaign_codes (code, campaign_id) VALUES (?, ?)",
+                             [(code, campaign_id) for code in batch])
+            remaining -= conn.total_changes - before
+    return campaign_id
+
+def get_coupon_campaigns():
+    """All campaigns, newest first, with how many codes each has and how many were redeemed"""
+    with closing(get_coupons_connection()) as conn:
+        return [dict(row) for row in conn.execute('''
+            SELECT p.campaign_id, p.name, p.discount_type, p.discount_value, p.expiry_date, p.is_active, p.created_at,
+                   COUNT(c.code) AS code_count, COALESCE(SUM(u.used_count), 0) AS redeemed
+            FROM coupon_campaigns p
+            LEFT JOIN campaign_codes c ON c.campaign_id = p.campaign_id
+            LEFT JOIN coupon_usage u ON u.code = c.code
+            GROUP BY p.campaign_id
+            ORDER BY p.campaign_id DESC
+        ''')]
+
+def set_coupon_campaign_active(campaign_id, active):
+    """Activate or deactivate every code in a campaign; False if there is no such campaign"""
+    with closing(get_coupons_connection()) as conn, conn:
+        cursor = conn.execute("UPDATE coupon_campaigns SET is_active = ? WHERE campaign_id = ?", (1 if active else 0, campaign_id))
+        return cursor.rowcount == 1
+
+def iter_campaign_codes_csv(campaign_id, chunk_size=5000):
+    """Yield a campaign's codes as CSV text, a chunk of rows at a time"""
+    with closing(get_coupons_connection()) as conn:
+        campaign = conn.execute("SELECT * FROM coupon_campaigns WHERE campaign_id = ?", (campaign_id,)).fetchone()
+        yield 'code,campaign,discount_type,discount_value,min_order,max_discount,usage_limit,expiry_date\r\n'
+        terms = [campaign['name'], campaign['discount_type'], f"{campaign['discount_value']:.2f}", f"{campaign['min_order']:.2f}",
+                 f"{campaign['max_discount']:.2f}" if campaign['max_discount'] else '',
+                 str(campaign['usage_limit']) if campaign['usage_limit'] else '', campaign['expiry_date']]
+        cursor = conn.execute("SELECT code FROM campaign_codes WHERE campaign_id = ? ORDER BY code", (campaign_id,))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows([row['code']] + terms for row in rows)
+            yield buffer.getvalue()
+
+def get_coupon_usage_counts():
+    """{normalised code: used_count} for coupons.csv codes with a recorded redemption, in one query
+    (campaign codes are left out; their totals come from get_coupon_campaigns)"""
+    with closing(get_coupons_connection()) as conn:
+        return dict(conn.execute('''
+            SELECT u.code, u.used_count FROM coupon_usage u
+            WHERE NOT EXISTS (SELECT 1 FROM campaign_codes c WHERE c.code = u.code)
+        ''').fetchall())
+
+def get_coupon_used_count(coupon):
+    with closing(get_coupons_connection()) as conn:
+        row = conn.execute("SELECT used_count FROM coupon_usage WHERE code = ?", (normalize_coupon_code(coupon['code']),)).fetchone()
+    return row['used_count'] if row else coupon['used_count']
+
+def redeem_coupon(code):
+    """Atomically count one use of a coupon; returns False if it is unknown, inactive,
+    expired or its usage limit is reached"""
+    coupon = get_coupon_by_code(code)
+    if not coupon or not coupon['is_active']:
+        return False
+    if coupon['expires_at'] and datetime.now() > coupon['expires_at']:
+        return False
+    limit = coupon['usage_limit']
+    with closing(get_coupons_connection()) as conn, conn:
+        cursor = conn.execute('''
+            INSERT INTO coupon_usage (code, used_count)
+            SELECT ?, ? WHERE ? IS NULL OR ? < ?
+            ON CONFLICT (code) DO UPDATE SET used_count = used_count + 1
+            WHERE ? IS NULL OR used_count < ?
+        ''', (normalize_coupon_code(code), coupon['used_count'] + 1, limit, coupon['used_count'], limit, limit, limit))
+        return cursor.rowcount == 1
+
+def release_coupon(code):
+    """Undo a redemption whose order could not be saved"""
+    with closing(get_coupons_connection()) as conn, conn:
+        conn.execute("UPDATE coupon_usage SET used_count = used_count - 1 WHERE code = ? AND used_count > 0", (normalize_coupon_code(code),))
+
+def reset_coupon_usage(code):
+    """Forget a code's redemption count, so a coupon recreated under it starts from its own used_count"""
+    with closing(get_coupons_connection()) as conn, conn:
+        conn.execute("DELETE FROM coupon_usage WHERE code = ?", (normalize_coupon_code(code),))
 
 def save_coupons(coupons):
     """Save coupons to CSV"""
-    with open(COUPONS_CSV, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(['code', 'discount_type', 'discount_value', 'min_order', 'max_discount', 'usage_limit', 'used_count', 'expiry_date', 'is_active'])
-        for coupon in coupons:
-            writer.writerow([
-                coupon['code'],
-                coupon['discount_type'],
-                f"{float(coupon['discount_value']):.2f}",
-                f"{float(coupon.get('min_order', 0)):.2f}",
-                f"{float(coupon['max_discount']):.2f}" if coupon.get('max_discount') else '',
-                str(coupon['usage_limit']) if coupon.get('usage_limit') else '',
-                str(coupon.get('used_count', 0)),
-                coupon.get('expiry_date', ''),
-                'true' if coupon.get('is_active', True) else 'false'
-            ])
+    write_csv_atomic(COUPONS_CSV, COUPON_FIELDS, [
+        [
+            coupon['code'],
+            coupon['discount_type'],
+            f"{float(coupon['discount_value']):.2f}",
+            f"{float(coupon.get('min_order', 0)):.2f}",
+            f"{float(coupon['max_discount']):.2f}" if coupon.get('max_discount') else '',
+            str(coupon['usage_limit']) if coupon.get('usage_limit') else '',
+            str(coupon.get('used_count', 0)),
+            coupon.get('expiry_date', ''),
+            'true' if coupon.get('is_active', True) else 'false'
+        ]
+        for coupon in coupons
+    ])
+
+# Cart pricing: one immutable result per (cart contents, menu prices, coupon), shared by
+# the cart, checkout, coupon and payment steps. Results are memoized on flask.g for
+# the current request; the menu-line pricing is also kept in a small LRU keyed by a
+# hash of the lines. Coupons are validated afresh for every request, because their
+# state (active flag, expiry, campaign, usage count) changes independently of the cart.
+CartLine = namedtuple('CartLine', ['entry_id', 'item_id', 'name', 'price', 'quantity', 'allergies', 'line_total'])
+PricedCart = namedtuple('PricedCart', ['items', 'subtotal', 'coupon_code', 'discount', 'coupon_error',
+                                       'subtotal_after_discount', 'tax', 'delivery_fee', 'cart_hash'])
+
+PRICED_CART_CACHE_SIZE = 512
+_priced_cart_cache = OrderedDict()
+_priced_cart_cache_lock = threading.Lock()
+
+def price_cart(user_id, coupon_code=''):
+    """Price a user's cart against the current menu, applying coupon_code if it validates.
+
+    Cart lines for items no longer on the menu are skipped; each line keeps its
+    stored `entry_id` for the update/remove routes. An invalid coupon leaves the
+    discount at 0 and reports why in coupon_error.
+    """
+    coupon_code = normalize_coupon_code(coupon_code)
+    memo = g.setdefault('priced_carts', {})
+    if (user_id, coupon_code) in memo:
+        return memo[(user_id, coupon_code)]
+
+    menu = get_menu_index()
+    items = tuple(
+        CartLine(entry['entry_id'], entry['item_id'], menu[entry['item_id']]['name'], menu[entry['item_id']]['price'],
+                 entry['quantity'], entry['note'], round(menu[entry['item_id']]['price'] * entry['quantity'], 2))
+        for entry in get_cart_entries(user_id) if entry['item_id'] in menu
+    )
+    # What the customer is buying and at which prices; payment_success compares it
+    # with the hash taken when the payment was created
+    cart_hash = hashlib.sha256(json.dumps(
+        [[line.item_id, line.name, line.price, line.quantity, line.allergies] for line in items] +
+        [TAX_RATE, DELIVERY_FEE]
+    ).encode('utf-8')).hexdigest()
+
+    with _priced_cart_cache_lock:
+        subtotal = _priced_cart_cache.get(cart_hash)
+        if subtotal is not None:
+            _priced_cart_cache.move_to_end(cart_hash)
+    if subtotal is None:
+        subtotal = sum(line.price * line.quantity for line in items)
+        with _priced_cart_cache_lock:
+            _priced_cart_cache[cart_hash] = subtotal
+            while len(_priced_cart_cache) > PRICED_CART_CACHE_SIZE:
+                _priced_cart_cache.popitem(last=False)
+
+    discount, coupon_error = 0.0, None
+    if coupon_code:
+        discount, coupon_error = validate_coupon(coupon_code, subtotal)
+        if discount is None:
+            discount = 0.0
+    subtotal_after_discount = max(0, subtotal - discount)
+    priced = PricedCart(items, subtotal, coupon_code if not coupon_error else '', discount, coupon_error,
+                        subtotal_after_discount, subtotal_after_discount * TAX_RATE, DELIVERY_FEE, cart_hash)
+    memo[(user_id, coupon_code)] = priced
+    return priced
+
+def compute_tip(subtotal, tip_percentage, custom_tip='0'):
+    """Tip from the checkout tip selector ('18%', 'custom' or 'no_tip'), on the pre-discount subtotal"""
+    if tip_percentage == 'custom' and custom_tip:
+        return float(custom_tip)
+    if tip_percentage and tip_percentage != 'no_tip':
+        return subtotal * float(tip_percentage.replace('%', '')) / 100
+    return 0
+
+def order_items(priced):
+    """Cart lines as the plain dicts stored with an order"""
+    return [{'item_id': line.item_id, 'name': line.name, 'price': line.price,
+             'quantity': line.quantity, 'allergies': line.allergies} for line in priced.items]
 
 def is_admin():
     return session.get('is_admin') is True
@@ -1004,9 +2790,9 @@ def render_admin_dashboard():
         filtered_items = [item for item in filtered_items if item['category'] == menu_category]
 
     orders = get_all_orders()
-    user_map = get_user_map()
+    customer_names = get_user_names(order['user_id'] for order in orders)
     for order in orders:
-        order['customer_name'] = user_map.get(order['user_id'], 'Guest Customer')
+        order['customer_name'] = customer_names.get(order['user_id'], 'Guest Customer')
 
     order_search = request.args.get('order_search', '').strip().lower()
     order_status = request.args.get('order_status', '').strip()
@@ -1142,33 +2928,32 @@ def render_admin_dashboard():
 
     employee_search = request.args.get('employee_search', '').strip()
     employee_status_filter = request.args.get('employee_status', '').strip()
-    all_employees = get_employees()
-    employee_count = len(all_employees)
-    employees_display = get_employees(
-        search_query=employee_search or None,
-        status_filter=employee_status_filter or None
-    ) if (employee_search or employee_status_filter) else all_employees
-    recent_employees = all_employees[:5]
-    gender_counts = {}
-    role_counts = {}
-    complete_profiles = 0
-    status_counts = {}
-    for employee in all_employees:
-        gender_label = employee.get('gender') or 'Not set'
-        gender_counts[gender_label] = gender_counts.get(gender_label, 0) + 1
-
-        job_title = employee.get('job_title') or 'Unassigned'
-        role_counts[job_title] = role_counts.get(job_title, 0) + 1
-
-        if employee.get('email') and employee.get('mobile') and employee.get('address'):
-            complete_profiles += 1
-        
-        status_label = employee.get('status') or 'active'
-        status_counts[status_label] = status_counts.get(status_label, 0) + 1
-
-    latest_employee = all_employees[0] if all_employees else None
+    employee_job_title = request.args.get('employee_job_title', '').strip()
+    employee_after = request.args.get('employee_after', '').strip()
+    if employee_search:
+        # Search results are ranked by relevance, so they aren't paged
+        employees_display = get_employees(
+            search_query=employee_search,
+            status_filter=employee_status_filter or None,
+            job_title=employee_job_title or None
+        )
+        employee_next_cursor = None
+    else:
+        employees_display, employee_next_cursor = get_employee_page(
+            status_filter=employee_status_filter or None,
+            job_title=employee_job_title or None,
+            cursor=employee_after or None
+        )
+    recent_employees = get_employees(limit=5)
+    employee_stats = get_employee_stats()
+    employee_count = employee_stats['total']
+    gender_counts = employee_stats['gender_counts']
+    role_counts = employee_stats['role_counts']
+    status_counts = employee_stats['status_counts']
+
+    latest_employee = recent_employees[0] if recent_employees else None
     top_roles = sorted(role_counts.items(), key=lambda x: x[1], reverse=True)[:4]
-    completion_rate = round((complete_profiles / employee_count) * 100, 1) if employee_count else 0
+    completion_rate = round((employee_stats['complete_profiles'] / employee_count) * 100, 1) if employee_count else 0
     active_count = status_counts.get('active', 0)
     suspended_count = status_counts.get('suspended', 0)
 
@@ -1207,11 +2992,17 @@ def render_admin_dashboard():
     # Get role rates and admin settings
     role_rates = load_role_rates()
     admin_settings = load_admin_settings()
+    coupon_usage = get_coupon_usage_counts()
     
     return render_template(
         'admin/dashboard.html',
         menu_items=filtered_items,
         all_categories=categories,
+        coupons=[dict(coupon, used_count=coupon_usage.get(normalize_coupon_code(coupon['code']), coupon['used_count']))
+                 for coupon in get_coupons()],
+        coupon_duplicates=get_duplicate_coupon_codes(),
+        coupon_campaigns=get_coupon_campaigns(),
+        bulk_coupon_max=BULK_COUPON_MAX,
         menu_search=request.args.get('menu_search', ''),
         menu_category=menu_category,
         admin_email=session.get('admin_email', ADMIN_EMAIL),
@@ -1240,6 +3031,10 @@ def render_admin_dashboard():
         category_chart=json.dumps(category_chart),
         recent_activity=recent_activity,
         employees=employees_display,
+        employee_next_cursor=employee_next_cursor,
+        employee_after=employee_after,
+        employee_job_title=employee_job_title,
+        employee_choices=get_employee_choices(),
         employee_search=employee_search,
         employee_count=employee_count,
         role_rates=role_rates,
@@ -1278,8 +3073,7 @@ def load_admin_profile():
 
 def save_admin_profile(profile):
     os.makedirs(DATA_DIR, exist_ok=True)
-    with open(ADMIN_PROFILE_JSON, 'w', encoding='utf-8') as f:
-        json.dump(profile, f, indent=2)
+    write_json_atomic(ADMIN_PROFILE_JSON, profile)
     return profile
 
 def load_admin_settings():
@@ -1297,8 +3091,7 @@ def load_admin_settings():
 def save_admin_settings(settings):
     """Save admin settings"""
     os.makedirs(DATA_DIR, exist_ok=True)
-    with open(ADMIN_SETTINGS_JSON, 'w', encoding='utf-8') as f:
-        json.dump(settings, f, indent=2)
+    write_json_atomic(ADMIN_SETTINGS_JSON, settings)
     return settings
 
 def load_role_rates():
@@ -1314,8 +3107,7 @@ def load_role_rates():
 def save_role_rates(role_rates):
     """Save role-based hourly rates"""
     os.makedirs(DATA_DIR, exist_ok=True)
-    with open(ROLE_RATES_JSON, 'w', encoding='utf-8') as f:
-        json.dump(role_rates, f, indent=2)
+    write_json_atomic(ROLE_RATES_JSON, role_rates)
     return role_rates
 
 def get_employee_hourly_rate(employee):
@@ -1370,7 +3162,15 @@ def signup():
             return render_template('signup.html')
         
         # Create user
-        user_id = create_user(email, password, name, phone, address)
+        try:
+            user_id = create_user(email, password, name, phone, address)
+        except ValueError:
+            # Another signup for the same email won the race
+            flash('Email already registered. Please sign in.', 'error')
+            return render_template('signup.html')
+        except PasswordHasherBusy:
+            flash('We are handling a lot of sign-ups right now. Please try again in a moment.', 'error')
+            return render_template('signup.html'), 503
         flash('Account created successfully! Please sign in.', 'success')
         return redirect(url_for('signin'))
     
@@ -1387,14 +3187,30 @@ def signin():
             flash('Please enter email and password', 'error')
             return render_template('signin.html')
         
+        client_ip = request.remote_addr or 'unknown'
+        if is_login_throttled(email, client_ip):
+            flash('Too many sign-in attempts. Please wait a few minutes and try again.', 'error')
+            return render_template('signin.html'), 429
+        
         user = get_user_by_email(email)
-        if user and check_password_hash(user['password_hash'], password):
+        try:
+            valid = bool(user) and verify_password(user['password_hash'], password)
+            if valid and password_needs_rehash(user['password_hash']) and not is_rehash_pending(user['user_id']):
+                queue_password_rehash(user['user_id'], hash_password(password))
+        except PasswordHasherBusy:
+            flash('We are handling a lot of sign-ins right now. Please try again in a moment.', 'error')
+            return render_template('signin.html'), 503
+        
+        if valid:
+            clear_login_failures(email)
+            session.regenerate()
             session['user_id'] = user['user_id']
             session['user_name'] = user['name']
             session['user_email'] = user['email']
             flash(f'Welcome back, {user["name"]}!', 'success')
             return redirect(url_for('menu'))
         else:
+            record_login_failure(email, client_ip)
             flash('Invalid email or password', 'error')
             return render_template('signin.html')
     
@@ -1440,8 +3256,8 @@ def menu():
     
     # Get wishlist item IDs for easy checking in template
     wishlist_ids = []
-    if 'wishlist' in session:
-        wishlist_ids = [w['item_id'] for w in session['wishlist']]
+    if 'user_id' in session:
+        wishlist_ids = get_wishlist_item_ids(session['user_id'])
     
     return render_template('menu.html', 
                          categories=categories, 
@@ -1464,30 +3280,17 @@ def cart():
         quantity = int(request.form.get('quantity', 1))
         allergies = request.form.get('allergies', '')
         
-        if 'cart' not in session:
-            session['cart'] = []
-        
-        items = get_menu_items()
-        item = next((i for i in items if i['item_id'] == item_id), None)
+        item = get_menu_index().get(item_id)
         
         if item:
-            cart_item = {
-                'item_id': item_id,
-                'name': item['name'],
-                'price': float(item['price']),
-                'quantity': quantity,
-                'allergies': allergies
-            }
-            session['cart'].append(cart_item)
-            session.modified = True
+            add_to_cart(session['user_id'], [(item_id, quantity, allergies)])
             flash(f'{item["name"]} added to cart!', 'success')
         
         return redirect(url_for('menu'))
     
-    cart = session.get('cart', [])
-    subtotal = sum(item['price'] * item['quantity'] for item in cart)
+    priced = price_cart(session['user_id'])
     
-    return render_template('cart.html', cart=cart, subtotal=subtotal, user_name=session.get('user_name'))
+    return render_template('cart.html', cart=priced.items, subtotal=priced.subtotal, user_name=session.get('user_name'))
 
 @app.route('/update_cart_quantity', methods=['POST'])
 def update_cart_quantity():
@@ -1496,31 +3299,28 @@ def update_cart_quantity():
         flash('Please sign in', 'error')
         return redirect(url_for('signin'))
     
-    index = int(request.form.get('index', -1))
+    entry_id = int(request.form.get('entry_id', -1))
     quantity = int(request.form.get('quantity', 1))
     
-    if 'cart' in session and 0 <= index < len(session['cart']):
+    # A quantity of 0 or less removes the item
+    item_id = update_cart_entry(session['user_id'], entry_id, quantity)
+    if item_id is not None:
         if quantity <= 0:
-            # Remove item if quantity is 0 or less
-            item_name = session['cart'][index]['name']
-            session['cart'].pop(index)
-            session.modified = True
-            flash(f'{item_name} removed from cart', 'info')
+            item = get_menu_index().get(item_id)
+            flash(f'{item["name"] if item else "Item"} removed from cart', 'info')
         else:
-            session['cart'][index]['quantity'] = quantity
-            session.modified = True
             flash('Cart updated', 'success')
     
     return redirect(url_for('cart'))
 
-@app.route('/remove_from_cart/<int:index>')
-def remove_from_cart(index):
+@app.route('/remove_from_cart/<int:entry_id>')
+def remove_from_cart(entry_id):
     """Remove item from cart"""
-    if 'cart' in session and 0 <= index < len(session['cart']):
-        item_name = session['cart'][index]['name']
-        session['cart'].pop(index)
-        session.modified = True
-        flash(f'{item_name} removed from cart', 'info')
+    if 'user_id' in session:
+        item_id = remove_cart_entry(session['user_id'], entry_id)
+        if item_id is not None:
+            item = get_menu_index().get(item_id)
+            flash(f'{item["name"] if item else "Item"} removed from cart', 'info')
     return redirect(url_for('cart'))
 
 @app.route('/wishlist', methods=['GET', 'POST'])
@@ -1534,63 +3334,37 @@ def wishlist():
         # Add item to wishlist
         item_id = request.form.get('item_id')
         
-        if 'wishlist' not in session:
-            session['wishlist'] = []
-        
-        items = get_menu_items()
-        item = next((i for i in items if i['item_id'] == item_id), None)
+        item = get_menu_index().get(item_id)
         
         if item:
-            # Check if item already in wishlist
-            wishlist_item_ids = [w['item_id'] for w in session['wishlist']]
-            if item_id not in wishlist_item_ids:
-                wishlist_item = {
-                    'item_id': item_id,
-                    'name': item['name'],
-                    'price': float(item['price']),
-                    'description': item['description'],
-                    'image': item['image']
-                }
-                session['wishlist'].append(wishlist_item)
-                session.modified = True
+            if add_to_wishlist(session['user_id'], item_id):
                 flash(f'{item["name"]} added to wishlist!', 'success')
             else:
                 flash(f'{item["name"]} is already in your wishlist', 'info')
         
         return redirect(url_for('menu'))
     
-    wishlist = session.get('wishlist', [])
+    wishlist = get_priced_wishlist(session['user_id'])
     return render_template('wishlist.html', wishlist=wishlist, user_name=session.get('user_name'))
 
-@app.route('/remove_from_wishlist/<int:index>')
-def remove_from_wishlist(index):
+@app.route('/remove_from_wishlist/<int:entry_id>')
+def remove_from_wishlist(entry_id):
     """Remove item from favorites"""
-    if 'wishlist' in session and 0 <= index < len(session['wishlist']):
-        item_name = session['wishlist'][index]['name']
-        session['wishlist'].pop(index)
-        session.modified = True
-        flash(f'{item_name} removed from favorites', 'info')
+    if 'user_id' in session:
+        item_id = remove_wishlist_entry(session['user_id'], entry_id)
+        if item_id is not None:
+            item = get_menu_index().get(item_id)
+            flash(f'{item["name"] if item else "Item"} removed from favorites', 'info')
     return redirect(url_for('wishlist'))
 
-@app.route('/add_wishlist_to_cart/<int:index>')
-def add_wishlist_to_cart(index):
+@app.route('/add_wishlist_to_cart/<int:entry_id>')
+def add_wishlist_to_cart(entry_id):
     """Add favorites item to cart"""
-    if 'wishlist' in session and 0 <= index < len(session['wishlist']):
-        wishlist_item = session['wishlist'][index]
-        
-        if 'cart' not in session:
-            session['cart'] = []
-        
-        cart_item = {
-            'item_id': wishlist_item['item_id'],
-            'name': wishlist_item['name'],
-            'price': wishlist_item['price'],
-            'quantity': 1,
-            'allergies': ''
-        }
-        session['cart'].append(cart_item)
-        session.modified = True
-        flash(f'{wishlist_item["name"]} added to cart!', 'success')
+    if 'user_id' in session:
+        item = get_menu_index().get(get_wishlist_item(session['user_id'], entry_id))
+        if item:
+            add_to_cart(session['user_id'], [(item['item_id'], 1, '')])
+            flash(f'{item["name"]} added to cart!', 'success')
     
     return redirect(url_for('wishlist'))
 
@@ -1601,8 +3375,10 @@ def checkout():
         flash('Please sign in to checkout', 'error')
         return redirect(url_for('signin'))
     
-    cart = session.get('cart', [])
-    if not cart:
+    # Applied coupon from session if any; an invalid one simply gives no discount
+    applied_coupon = session.get('applied_coupon', '')
+    priced = price_cart(session['user_id'], applied_coupon)
+    if not priced.items:
         flash('Your cart is empty', 'error')
         return redirect(url_for('menu'))
     
@@ -1611,28 +3387,13 @@ def checkout():
         # Payment will be processed via Stripe, then order saved in success route
         pass
     
-    subtotal = sum(item['price'] * item['quantity'] for item in cart)
-    
-    # Get applied coupon from session if any
-    applied_coupon = session.get('applied_coupon', '')
-    discount = 0.0
-    if applied_coupon:
-        discount, _ = validate_coupon(applied_coupon, subtotal)
-        if discount is None:
-            discount = 0.0
-    
-    # Calculate tax on discounted subtotal
-    subtotal_after_discount = max(0, subtotal - discount)
-    tax = subtotal_after_discount * TAX_RATE
-    delivery_fee = DELIVERY_FEE
-    
     return render_template('checkout.html', 
-                         cart=cart, 
-                         subtotal=round(subtotal, 2),
-                         tax=round(tax, 2),
+                         cart=priced.items, 
+                         subtotal=round(priced.subtotal, 2),
+                         tax=round(priced.tax, 2),
                          tax_rate=TAX_RATE * 100,
-                         delivery_fee=delivery_fee,
-                         discount=round(discount, 2),
+                         delivery_fee=priced.delivery_fee,
+                         discount=round(priced.discount, 2),
                          applied_coupon=applied_coupon,
                          user_name=session.get('user_name'),
                          stripe_publishable_key=STRIPE_PUBLISHABLE_KEY)
@@ -1649,47 +3410,26 @@ def create_payment_intent():
         custom_tip = data.get('custom_tip', '0')
         coupon_code = data.get('coupon_code', '').strip().upper()
         
-        cart = session.get('cart', [])
-        if not cart:
+        priced = price_cart(session['user_id'], coupon_code)
+        if not priced.items:
             return jsonify({'error': 'Cart is empty'}), 400
+        if priced.coupon_error:
+            return jsonify({'error': f'Coupon error: {priced.coupon_error}'}), 400
         
-        # Calculate totals
-        subtotal = sum(item['price'] * item['quantity'] for item in cart)
-        
-        # Apply coupon if provided
-        discount = 0.0
-        applied_coupon = ''
-        if coupon_code:
-            discount, error_msg = validate_coupon(coupon_code, subtotal)
-            if error_msg:
-                return jsonify({'error': f'Coupon error: {error_msg}'}), 400
-            applied_coupon = coupon_code
-        
-        # Apply discount to subtotal
-        subtotal_after_discount = max(0, subtotal - discount)
-        tax = subtotal_after_discount * TAX_RATE
-        delivery_fee = DELIVERY_FEE
-        
-        # Calculate tip
-        tip = 0
-        if tip_percentage == 'custom' and custom_tip:
-            tip = float(custom_tip)
-        elif tip_percentage and tip_percentage != 'no_tip':
-            tip_percent = float(tip_percentage.replace('%', '')) / 100
-            tip = subtotal * tip_percent
-        
-        total = subtotal_after_discount + tax + delivery_fee + tip
+        tip = compute_tip(priced.subtotal, tip_percentage, custom_tip)
+        total = priced.subtotal_after_discount + priced.tax + priced.delivery_fee + tip
         
         # Store order details in session for later
         session['pending_order'] = {
-            'subtotal': round(subtotal, 2),
-            'tax': round(tax, 2),
-            'delivery_fee': delivery_fee,
+            'subtotal': round(priced.subtotal, 2),
+            'tax': round(priced.tax, 2),
+            'delivery_fee': priced.delivery_fee,
             'tip': round(tip, 2),
             'total': round(total, 2),
-            'coupon_code': applied_coupon,
-            'discount': round(discount, 2),
-            'tip_percentage': tip_percentage
+            'coupon_code': priced.coupon_code,
+            'discount': round(priced.discount, 2),
+            'tip_percentage': tip_percentage,
+            'cart_hash': priced.cart_hash
         }
         session.modified = True
         
@@ -1742,10 +3482,18 @@ def payment_success():
             flash('Order information not found', 'error')
             return redirect(url_for('menu'))
         
-        cart = session.get('cart', [])
-        if not cart:
+        priced = price_cart(session['user_id'])
+        if not priced.items:
             flash('Cart is empty', 'error')
             return redirect(url_for('menu'))
+        # The cart is shared across devices and priced from the live menu: if it changed
+        # since the payment was created, the charge no longer matches what would be saved
+        if priced.cart_hash != pending_order.get('cart_hash'):
+            stripe.Refund.create(payment_intent=payment_intent_id)
+            session.pop('pending_order', None)
+            flash('Your cart or its prices changed while you were paying. Your payment has been refunded; please review your order and check out again.', 'error')
+            return redirect(url_for('checkout'))
+        cart = order_items(priced)
         
         # Collect allergies
         allergies = []
@@ -1753,22 +3501,37 @@ def payment_success():
             if item.get('allergies'):
                 allergies.append(f"{item['name']}: {item['allergies']}")
         
+        # Count the coupon use before saving the order; if the last use went to
+        # another checkout in the meantime, refund rather than honour it
+        coupon_code = pending_order['coupon_code']
+        if coupon_code and not redeem_coupon(coupon_code):
+            stripe.Refund.create(payment_intent=payment_intent_id)
+            session.pop('pending_order', None)
+            session.pop('applied_coupon', None)
+            flash(f'Sorry, coupon "{coupon_code}" is no longer available. Your payment has been refunded; please check out again.', 'error')
+            return redirect(url_for('checkout'))
+        
         # Save order
-        order_id = save_order(
-            session['user_id'],
-            cart,
-            allergies,
-            pending_order['subtotal'],
-            pending_order['tax'],
-            pending_order['delivery_fee'],
-            pending_order['tip'],
-            pending_order['total'],
-            pending_order['coupon_code'],
-            pending_order['discount']
-        )
+        try:
+            order_id = save_order(
+                session['user_id'],
+                cart,
+                allergies,
+                pending_order['subtotal'],
+                pending_order['tax'],
+                pending_order['delivery_fee'],
+                pending_order['tip'],
+                pending_order['total'],
+                pending_order['coupon_code'],
+                pending_order['discount']
+            )
+        except Exception:
+            if coupon_code:
+                release_coupon(coupon_code)
+            raise
         
         # Clear cart and pending order
-        session['cart'] = []
+        clear_cart(session['user_id'])
         session.pop('pending_order', None)
         session.modified = True
         session['has_new_order'] = True
@@ -1799,6 +3562,7 @@ def admin():
         email = request.form.get('email', '').strip()
         password = request.form.get('password', '')
         if email == ADMIN_EMAIL and password == ADMIN_PASSWORD:
+            session.regenerate()
             session['is_admin'] = True
             session['admin_email'] = email
             flash('Welcome back, Admin!', 'success')
@@ -1905,13 +3669,11 @@ def admin_update_employee_rate():
     if not hourly_rate:
         # Clear individual rate (will use role-based or default)
         with get_employee_connection() as conn:
-            existing_columns = {row['name'] for row in conn.execute("PRAGMA table_info(employees)")}
-            if 'hourly_rate' in existing_columns:
-                conn.execute(
-                    "UPDATE employees SET hourly_rate = NULL WHERE employee_id = ?",
-                    (employee_id,)
-                )
-                conn.commit()
+            conn.execute(
+                "UPDATE employees SET hourly_rate = NULL WHERE employee_id = ?",
+                (employee_id,)
+            )
+            conn.commit()
         flash('Employee hourly rate cleared. Will use role-based or default rate.', 'success')
         return redirect(request.referrer or url_for('admin', section='payroll'))
     
@@ -1922,10 +3684,6 @@ def admin_update_employee_rate():
             return redirect(request.referrer or url_for('admin', section='payroll'))
         
         with get_employee_connection() as conn:
-            existing_columns = {row['name'] for row in conn.execute("PRAGMA table_info(employees)")}
-            if 'hourly_rate' not in existing_columns:
-                conn.execute("ALTER TABLE employees ADD COLUMN hourly_rate REAL")
-            
             conn.execute(
                 "UPDATE employees SET hourly_rate = ? WHERE employee_id = ?",
                 (rate, employee_id)
@@ -1973,13 +3731,11 @@ def admin_bulk_update_role_rate():
         
         if clear_individual:
             with get_employee_connection() as conn:
-                existing_columns = {row['name'] for row in conn.execute("PRAGMA table_info(employees)")}
-                if 'hourly_rate' in existing_columns:
-                    conn.execute(
-                        "UPDATE employees SET hourly_rate = NULL WHERE job_title = ?",
-                        (role,)
-                    )
-                    conn.commit()
+                conn.execute(
+                    "UPDATE employees SET hourly_rate = NULL WHERE job_title = ?",
+                    (role,)
+                )
+                conn.commit()
         
         count = 0
         with get_employee_connection() as conn:
@@ -2093,6 +3849,69 @@ def admin_menu_delete(item_id):
         flash('Menu item removed', 'info')
     return redirect(request.referrer or url_for('admin'))
 
+@app.route('/admin/menu/import', methods=['POST'])
+def admin_menu_import():
+    """Bulk import menu items from a CSV/JSON upload or a JSON request body"""
+    if not is_admin():
+        if request.is_json:
+            return jsonify({'error': 'Not authenticated'}), 401
+        flash('Please sign in as admin', 'error')
+        return redirect(url_for('admin'))
+
+    if request.is_json:
+        payload = request.get_json(silent=True)
+        rows = payload.get('items') if isinstance(payload, dict) else payload
+        mode = payload.get('mode', 'merge') if isinstance(payload, dict) else 'merge'
+        dry_run = bool(payload.get('dry_run')) if isinstance(payload, dict) else False
+        if mode not in ('merge', 'replace'):
+            return jsonify({'error': "mode must be 'merge' or 'replace'"}), 400
+        report = apply_menu_batch(rows, mode=mode, dry_run=dry_run)
+        return jsonify(report), (400 if report['errors'] else 200)
+
+    upload = request.files.get('menu_file')
+    mode = 'replace' if request.form.get('mode') == 'replace' else 'merge'
+    dry_run = request.form.get('dry_run') == 'on'
+    if not upload or not upload.filename:
+        flash('Choose a CSV or JSON file to import', 'error')
+        return redirect(request.referrer or url_for('admin', section='menu'))
+    try:
+        rows = parse_menu_upload(upload)
+    except (ValueError, UnicodeDecodeError) as e:
+        flash(f'Could not read menu file: {e}', 'error')
+        return redirect(request.referrer or url_for('admin', section='menu'))
+
+    report = apply_menu_batch(rows, mode=mode, dry_run=dry_run)
+    if report['errors']:
+        shown = '; '.join(report['errors'][:5])
+        more = f" (+{len(report['errors']) - 5} more)" if len(report['errors']) > 5 else ''
+        flash(f'Import rejected, nothing was changed: {shown}{more}', 'error')
+    else:
+        summary = f"{len(report['added'])} added, {len(report['updated'])} updated, {len(report['removed'])} removed, {report['unchanged']} unchanged"
+        flash(f"{'Dry run: ' if dry_run else 'Menu imported: '}{summary}", 'success' if not dry_run else 'info')
+    return redirect(request.referrer or url_for('admin', section='menu'))
+
+@app.route('/admin/menu/export')
+def admin_menu_export():
+    """Download the full menu as CSV or JSON"""
+    if not is_admin():
+        flash('Please sign in as admin', 'error')
+        return redirect(url_for('admin'))
+
+    items = get_menu_items()
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    if request.args.get('format') == 'json':
+        data = json.dumps({'items': [{field: item.get(field, '') for field in MENU_FIELDS} for item in items]}, indent=2)
+        return Response(data, mimetype='application/json',
+                        headers={'Content-Disposition': f'attachment; filename=menu_{timestamp}.json'})
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(MENU_FIELDS)
+    for item in items:
+        writer.writerow([item['item_id'], item['name'], item['description'], f"{float(item['price']):.2f}", item['category'], item.get('image', '')])
+    return Response(buffer.getvalue(), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename=menu_{timestamp}.csv'})
+
 @app.route('/admin/employees/add', methods=['POST'])
 def admin_add_employee():
     if not is_admin():
@@ -2133,6 +3952,54 @@ def admin_add_employee():
 
     return redirect(url_for('admin', section='employees'))
 
+@app.route('/admin/api/employees')
+def admin_api_employees():
+    """Page through the employee directory as JSON; pass back next_cursor as ?after="""
+    if not is_admin():
+        return jsonify({'error': 'Not authenticated'}), 401
+    try:
+        limit = min(max(int(request.args.get('limit', EMPLOYEE_PAGE_SIZE)), 1), 500)
+    except ValueError:
+        return jsonify({'error': 'limit must be a number'}), 400
+    employees, next_cursor = get_employee_page(
+        status_filter=request.args.get('status', '').strip() or None,
+        job_title=request.args.get('job_title', '').strip() or None,
+        cursor=request.args.get('after', '').strip() or None,
+        limit=limit
+    )
+    return jsonify({'employees': [employee.as_dict() for employee in employees], 'next_cursor': next_cursor})
+
+@app.route('/admin/employees/import', methods=['POST'])
+def admin_import_employees():
+    """Onboard a batch of employees from a CSV upload"""
+    if not is_admin():
+        flash('Please sign in as admin', 'error')
+        return redirect(url_for('admin'))
+
+    upload = request.files.get('employees_file')
+    if not upload or not upload.filename:
+        flash('Choose a CSV file to import', 'error')
+        return redirect(url_for('admin', section='employees'))
+    try:
+        rows = parse_employee_upload(upload)
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        flash(f'Could not read employee file: {e}', 'error')
+        return redirect(url_for('admin', section='employees'))
+    if len(rows) > EMPLOYEE_IMPORT_MAX:
+        flash(f'Import at most {EMPLOYEE_IMPORT_MAX:,} employees at a time', 'error')
+        return redirect(url_for('admin', section='employees'))
+
+    report = import_employees(rows)
+    if report['added']:
+        flash(f"{len(report['added'])} employee(s) imported", 'success')
+    if report['errors']:
+        shown = '; '.join(report['errors'][:5])
+        more = f" (+{len(report['errors']) - 5} more)" if len(report['errors']) > 5 else ''
+        flash(f"Skipped {len(report['errors'])} row(s): {shown}{more}", 'error')
+    if not rows:
+        flash('The file has no employee rows', 'info')
+    return redirect(url_for('admin', section='employees'))
+
 @app.route('/admin/employees/update/<employee_id>', methods=['POST'])
 def admin_update_employee(employee_id):
     if not is_admin():
@@ -2427,21 +4294,18 @@ def apply_coupon_checkout():
     
     coupon_code = request.form.get('coupon_code', '').strip().upper()
     remove_coupon = request.form.get('remove', '').strip()
-    cart = session.get('cart', [])
-    subtotal = sum(item['price'] * item['quantity'] for item in cart)
-    
     if remove_coupon or not coupon_code:
         session.pop('applied_coupon', None)
         session.modified = True
         flash('Coupon removed', 'info')
     elif coupon_code:
-        discount, error_msg = validate_coupon(coupon_code, subtotal)
-        if error_msg:
-            flash(f'Coupon error: {error_msg}', 'error')
+        priced = price_cart(session['user_id'], coupon_code)
+        if priced.coupon_error:
+            flash(f'Coupon error: {priced.coupon_error}', 'error')
         else:
             session['applied_coupon'] = coupon_code
             session.modified = True
-            flash(f'Coupon "{coupon_code}" applied! Discount: ${discount:.2f}', 'success')
+            flash(f'Coupon "{coupon_code}" applied! Discount: ${priced.discount:.2f}', 'success')
     
     return redirect(url_for('checkout'))
 
@@ -2511,21 +4375,11 @@ def reorder(order_id):
                 if int(row['order_id']) == order_id and row['user_id'] == session['user_id']:
                     items = json.loads(row['items'])
                     
-                    # Add items to cart
-                    if 'cart' not in session:
-                        session['cart'] = []
-                    
-                    for item in items:
-                        cart_item = {
-                            'item_id': item['item_id'],
-                            'name': item['name'],
-                            'price': float(item['price']),
-                            'quantity': item['quantity'],
-                            'allergies': item.get('allergies', '')
-                        }
-                        session['cart'].append(cart_item)
+                    # Add items to cart; they are re-priced from the current menu
+                    add_to_cart(session['user_id'], [
+                        (item['item_id'], item['quantity'], item.get('allergies', '')) for item in items
+                    ])
                     
-                    session.modified = True
                     flash(f'Order #{order_id} added to cart!', 'success')
                     return redirect(url_for('cart'))
     
@@ -2563,6 +4417,7 @@ def worker_login():
             return render_template('worker/login.html')
         
         # Set worker session
+        session.regenerate()
         session['worker_id'] = employee['employee_id']
         session['worker_name'] = f"{employee['first_name']} {employee['last_name']}"
         session['worker_job_title'] = employee.get('job_title', 'Employee')
@@ -2674,41 +4529,24 @@ def worker_checkin():
         return redirect(url_for('worker_login'))
     
     # Check if employee has a schedule for today
-    today_weekday = datetime.now().strftime('%A').lower()
-    schedule = employee.get('schedule', {})
-    today_schedule = schedule.get(today_weekday, {})
-    has_schedule_today = today_schedule.get('enabled', False) == True or today_schedule.get('enabled') == 'true' or today_schedule.get('enabled') == 1
+    now = datetime.now()
+    today_schedule = get_day_schedule(employee_id, now.weekday())
     
-    if not has_schedule_today:
+    if not today_schedule or not today_schedule['enabled']:
         flash('You do not have a schedule for today. Please contact your administrator.', 'error')
         return redirect(url_for('worker_dashboard'))
     
     # Check if current time is within scheduled time window
-    now = datetime.now()
-    current_time = now.time()
+    current_minute = now.hour * 60 + now.minute + now.second / 60
     
-    start_time_str = today_schedule.get('start', '09:00')
-    end_time_str = today_schedule.get('end', '17:00')
+    # Allow check-in 15 minutes before scheduled start time
+    if current_minute < today_schedule['start_minute'] - 15:
+        flash(f'You can only check in 15 minutes before your scheduled time. Your schedule starts at {minutes_to_time(today_schedule["start_minute"])}.', 'error')
+        return redirect(url_for('worker_dashboard'))
     
-    try:
-        start_time = datetime.strptime(start_time_str, '%H:%M').time()
-        end_time = datetime.strptime(end_time_str, '%H:%M').time()
-        
-        # Allow check-in 15 minutes before scheduled start time
-        start_window = (datetime.combine(now.date(), start_time) - timedelta(minutes=15)).time()
-        
-        # Check if current time is within the allowed window
-        if current_time < start_window:
-            flash(f'You can only check in 15 minutes before your scheduled time. Your schedule starts at {start_time_str}.', 'error')
-            return redirect(url_for('worker_dashboard'))
-        
-        if current_time > end_time:
-            flash(f'Your scheduled time has ended ({end_time_str}). Please contact your administrator if you need to check in.', 'error')
-            return redirect(url_for('worker_dashboard'))
-        
-    except ValueError:
-        # If time parsing fails, allow check-in but log warning
-        pass
+    if current_minute > today_schedule['end_minute']:
+        flash(f'Your scheduled time has ended ({minutes_to_time(today_schedule["end_minute"])}). Please contact your administrator if you need to check in.', 'error')
+        return redirect(url_for('worker_dashboard'))
     
     success = check_in_employee(employee_id)
     
@@ -2742,12 +4580,9 @@ def worker_checkout():
         return redirect(url_for('worker_dashboard'))
     
     # Verify they have a schedule for today (for consistency)
-    today_weekday = datetime.now().strftime('%A').lower()
-    schedule = employee.get('schedule', {})
-    today_schedule = schedule.get(today_weekday, {})
-    has_schedule_today = today_schedule.get('enabled', False) == True or today_schedule.get('enabled') == 'true' or today_schedule.get('enabled') == 1
+    today_schedule = get_day_schedule(employee_id, datetime.now().weekday())
     
-    if not has_schedule_today:
+    if not today_schedule or not today_schedule['enabled']:
         flash('You do not have a schedule for today. Please contact your administrator.', 'error')
         return redirect(url_for('worker_dashboard'))
     
@@ -2788,29 +4623,13 @@ def worker_upload_profile_picture():
     
     # Update employee record
     with get_employee_connection() as conn:
-        existing_columns = {row['name'] for row in conn.execute("PRAGMA table_info(employees)")}
-        if 'profile_picture' in existing_columns:
-            # Delete old profile picture if exists
-            old_picture = conn.execute(
-                "SELECT profile_picture FROM employees WHERE employee_id = ?",
-                (employee_id,)
-            ).fetchone()
-            if old_picture and old_picture['profile_picture']:
-                old_path = os.path.join(app.config['UPLOAD_FOLDER'], old_picture['profile_picture'])
-                if os.path.exists(old_path):
-                    try:
-                        os.remove(old_path)
-                    except:
-                        pass
-            
-            conn.execute(
-                "UPDATE employees SET profile_picture = ? WHERE employee_id = ?",
-                (filename, employee_id)
-            )
-            conn.commit()
-            flash('Profile picture updated successfully', 'success')
-        else:
-            flash('Profile picture feature not available', 'error')
+        # The old picture may be shared with other records; `flask gc-images` reclaims it once unused
+        conn.execute(
+            "UPDATE employees SET profile_picture = ? WHERE employee_id = ?",
+            (filename, employee_id)
+        )
+        conn.commit()
+    flash('Profile picture updated successfully', 'success')
     
     return redirect(url_for('worker_dashboard'))
 
@@ -2879,12 +4698,12 @@ def admin_add_coupon():
     
     if not all([code, discount_value]):
         flash('Code and discount value are required', 'error')
-        return redirect(request.referrer or url_for('admin'))
+        return redirect(url_for('admin', section='coupons'))
     
     # Check if coupon code already exists
     if get_coupon_by_code(code):
         flash('Coupon code already exists', 'error')
-        return redirect(request.referrer or url_for('admin'))
+        return redirect(url_for('admin', section='coupons'))
     
     try:
         discount_value = float(discount_value)
@@ -2893,7 +4712,16 @@ def admin_add_coupon():
         usage_limit = int(usage_limit) if usage_limit else None
     except ValueError:
         flash('Invalid numeric values', 'error')
-        return redirect(request.referrer or url_for('admin'))
+        return redirect(url_for('admin', section='coupons'))
+    error = coupon_terms_error(discount_type, discount_value, min_order, max_discount, usage_limit)
+    if error:
+        flash(error, 'error')
+        return redirect(url_for('admin', section='coupons'))
+    try:
+        expiry_date = parse_expiry_date(expiry_date)
+    except ValueError:
+        flash('Expiry date must be in YYYY-MM-DD format', 'error')
+        return redirect(url_for('admin', section='coupons'))
     
     coupons = get_coupons()
     coupons.append({
@@ -2907,9 +4735,82 @@ def admin_add_coupon():
         'expiry_date': expiry_date,
         'is_active': is_active
     })
+    reset_coupon_usage(code)
     save_coupons(coupons)
     flash(f'Coupon "{code}" added successfully', 'success')
-    return redirect(request.referrer or url_for('admin'))
+    return redirect(url_for('admin', section='coupons'))
+
+@app.route('/admin/coupons/bulk', methods=['POST'])
+def admin_bulk_coupons():
+    """Generate a campaign of unique single-use codes and download them as CSV"""
+    if not is_admin():
+        flash('Please sign in as admin', 'error')
+        return redirect(url_for('admin'))
+    
+    name = request.form.get('campaign_name', '').strip()
+    prefix = request.form.get('prefix', '').strip()
+    discount_value = request.form.get('discount_value', '').strip()
+    try:
+        count = int(request.form.get('count', '0'))
+        terms = {
+            'discount_type': request.form.get('discount_type', 'percentage'),
+            'discount_value': float(discount_value),
+            'min_order': float(request.form.get('min_order', '').strip() or 0),
+            'max_discount': float(request.form['max_discount']) if request.form.get('max_discount', '').strip() else None,
+            'usage_limit': int(request.form.get('usage_limit', '').strip() or 1),
+            'is_active': request.form.get('is_active', 'true') == 'true'
+        }
+    except ValueError:
+        flash('Invalid numeric values', 'error')
+        return redirect(url_for('admin', section='coupons'))
+    error = coupon_terms_error(terms['discount_type'], terms['discount_value'], terms['min_order'],
+                               terms['max_discount'], terms['usage_limit'])
+    if error:
+        flash(error, 'error')
+        return redirect(url_for('admin', section='coupons'))
+    try:
+        terms['expiry_date'] = parse_expiry_date(request.form.get('expiry_date'))
+    except ValueError:
+        flash('Expiry date must be in YYYY-MM-DD format', 'error')
+        return redirect(url_for('admin', section='coupons'))
+    
+    if not name or not 0 < count <= BULK_COUPON_MAX:
+        flash(f'Campaign name and a count between 1 and {BULK_COUPON_MAX:,} are required', 'error')
+        return redirect(url_for('admin', section='coupons'))
+    
+    campaign_id = create_coupon_campaign(name, count, terms, prefix=prefix)
+    return redirect(url_for('admin_campaign_codes', campaign_id=campaign_id))
+
+@app.route('/admin/coupons/campaign/<int:campaign_id>/codes.csv')
+def admin_campaign_codes(campaign_id):
+    """Stream a campaign's codes as a CSV download"""
+    if not is_admin():
+        flash('Please sign in as admin', 'error')
+        return redirect(url_for('admin'))
+    
+    with closing(get_coupons_connection()) as conn:
+        campaign = conn.execute("SELECT name FROM coupon_campaigns WHERE campaign_id = ?", (campaign_id,)).fetchone()
+    if not campaign:
+        flash('Campaign not found', 'error')
+        return redirect(url_for('admin', section='coupons'))
+    
+    filename = secure_filename(f"coupons_{campaign['name']}_{campaign_id}.csv")
+    return Response(iter_campaign_codes_csv(campaign_id), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+@app.route('/admin/coupons/campaign/<int:campaign_id>/active', methods=['POST'])
+def admin_set_campaign_active(campaign_id):
+    """Deactivate (or reactivate) all codes in a campaign"""
+    if not is_admin():
+        flash('Please sign in as admin', 'error')
+        return redirect(url_for('admin'))
+    
+    active = request.form.get('is_active') == 'true'
+    if set_coupon_campaign_active(campaign_id, active):
+        flash(f"Campaign {'reactivated' if active else 'deactivated'}", 'success' if active else 'info')
+    else:
+        flash('Campaign not found', 'error')
+    return redirect(url_for('admin', section='coupons'))
 
 @app.route('/admin/coupons/update/<code>', methods=['POST'])
 def admin_update_coupon(code):
@@ -2921,7 +4822,7 @@ def admin_update_coupon(code):
     coupons = get_coupons()
     updated = False
     for coupon in coupons:
-        if coupon['code'].upper() == code.upper():
+        if normalize_coupon_code(coupon['code']) == normalize_coupon_code(code):
             discount_type = request.form.get('discount_type', coupon['discount_type'])
             discount_value = request.form.get('discount_value', '').strip()
             min_order = request.form.get('min_order', '0').strip()
@@ -2932,17 +4833,27 @@ def admin_update_coupon(code):
             
             if discount_value:
                 try:
-                    coupon['discount_type'] = discount_type
-                    coupon['discount_value'] = float(discount_value)
-                    coupon['min_order'] = float(min_order) if min_order else 0.0
-                    coupon['max_discount'] = float(max_discount) if max_discount else None
-                    coupon['usage_limit'] = int(usage_limit) if usage_limit else None
-                    coupon['expiry_date'] = expiry_date
-                    coupon['is_active'] = is_active
-                    updated = True
+                    coupon['expiry_date'] = parse_expiry_date(expiry_date)
+                except ValueError:
+                    flash('Expiry date must be in YYYY-MM-DD format', 'error')
+                    return redirect(url_for('admin', section='coupons'))
+                try:
+                    terms = {
+                        'discount_type': discount_type,
+                        'discount_value': float(discount_value),
+                        'min_order': float(min_order) if min_order else 0.0,
+                        'max_discount': float(max_discount) if max_discount else None,
+                        'usage_limit': int(usage_limit) if usage_limit else None
+                    }
                 except ValueError:
                     flash('Invalid numeric values', 'error')
-                    return redirect(request.referrer or url_for('admin'))
+                    return redirect(url_for('admin', section='coupons'))
+                error = coupon_terms_error(**terms)
+                if error:
+                    flash(error, 'error')
+                    return redirect(url_for('admin', section='coupons'))
+                coupon.update(terms, is_active=is_active)
+                updated = True
             break
     
     if updated:
@@ -2950,7 +4861,7 @@ def admin_update_coupon(code):
         flash(f'Coupon "{code}" updated', 'success')
     else:
         flash('Coupon not found', 'error')
-    return redirect(request.referrer or url_for('admin'))
+    return redirect(url_for('admin', section='coupons'))
 
 @app.route('/admin/coupons/delete/<code>', methods=['POST'])
 def admin_delete_coupon(code):
@@ -2960,13 +4871,14 @@ def admin_delete_coupon(code):
         return redirect(url_for('admin'))
     
     coupons = get_coupons()
-    filtered = [c for c in coupons if c['code'].upper() != code.upper()]
+    filtered = [c for c in coupons if normalize_coupon_code(c['code']) != normalize_coupon_code(code)]
     if len(filtered) == len(coupons):
         flash('Coupon not found', 'error')
     else:
         save_coupons(filtered)
+        reset_coupon_usage(code)
         flash('Coupon removed', 'info')
-    return redirect(request.referrer or url_for('admin'))
+    return redirect(url_for('admin', section='coupons'))
 
 @app.route('/admin/categories/add', methods=['POST'])
 def admin_add_category():
@@ -2987,6 +4899,152 @@ def admin_add_category():
         flash(f'Category "{category}" added', 'success')
     return redirect(request.referrer or url_for('admin'))
 
+@app.cli.command('backfill-images')
+@click.option('--force', is_flag=True, help='Regenerate derivatives that already exist.')
+def backfill_images_command(force):
+    """Generate responsive derivatives for images already in static/images"""
+    manifest = load_image_manifest()
+    processed = skipped = 0
+    for filename in sorted(os.listdir(app.config['UPLOAD_FOLDER'])):
+        if not allowed_file(filename) or not os.path.isfile(os.path.join(app.config['UPLOAD_FOLDER'], filename)):
+            continue
+        if filename in manifest and not force:
+            skipped += 1
+            continue
+        if generate_image_derivatives(filename):
+            processed += 1
+            print(f"Processed {filename}")
+        else:
+            print(f"Skipped {filename} (not a still image)")
+    print(f"Done: {processed} processed, {skipped} already up to date")
+
+@app.cli.command('build-css')
+def build_css_command():
+    """Split style.css into shared/storefront/admin/worker bundles and critical CSS"""
+    build_css.print_summary(build_css.build_bundles())
+
+@app.cli.command('build-static')
+def build_static_command():
+    """Split CSS bundles, then fingerprint and precompress static assets into static/dist"""
+    build_css.print_summary(build_css.build_bundles())
+    assets = build_static_assets()
+    compressed = sum(1 for entry in assets.values() if entry['encodings'])
+    print(f"Built {len(assets)} asset(s) into {STATIC_DIST_DIR} ({compressed} precompressed)")
+    if brotli is None:
+        print("Brotli not installed: only gzip variants were written")
+
+@app.cli.command('gc-images')
+@click.option('--dry-run', is_flag=True, help='Report what would be removed without deleting anything.')
+@click.option('--grace', default=IMAGE_GC_GRACE_SECONDS, show_default=True, help='Keep unreferenced uploads younger than this many seconds.')
+def gc_images_command(dry_run, grace):
+    """Remove uploaded images no longer used by the menu, employees or admin profile"""
+    removed, bytes_freed = collect_unreferenced_images(dry_run=dry_run, grace_seconds=grace)
+    for filename in removed:
+        print(f"{'Would remove' if dry_run else 'Removed'} {filename}")
+    print(f"{len(removed)} image(s), {bytes_freed / (1024 * 1024):.1f} MB {'reclaimable' if dry_run else 'reclaimed'}")
+
+@app.cli.command('migrate-db')
+def migrate_db_command():
+    """Apply pending employees.db schema migrations"""
+    applied = migrate_employee_db()
+    for version, description in applied:
+        print(f"Applied migration {version}: {description}")
+    with closing(open_employee_connection()) as conn:
+        print(f"employees.db is at schema version {get_employee_schema_version(conn)}")
+
+# Dashboard queries and the index each must use; `flask check-query-plans` fails if
+# any of them falls back to a table scan or a temporary sort
+QUERY_PLAN_CHECKS = [
+    ('employee list', lambda: employee_list_statement(), 'idx_employees_created_at_id'),
+    ('recent employees', lambda: employee_list_statement(limit=5), 'idx_employees_created_at_id'),
+    ('employees by status', lambda: employee_list_statement(status_filter='active'), 'idx_employees_status_created_at_id'),
+    ('directory page', lambda: employee_page_statement(after=('2025-01-06 12:00:00', '000001')), 'idx_employees_created_at_id'),
+    ('directory page by status', lambda: employee_page_statement(status_filter='active', after=('2025-01-06 12:00:00', '000001')),
+     'idx_employees_status_created_at_id'),
+    ('directory page by role', lambda: employee_page_statement(job_title='Cook', after=('2025-01-06 12:00:00', '000001')),
+     'idx_employees_job_title_created_at_id'),
+    ('employee counts by role', lambda: ("SELECT job_title, COUNT(*) FROM employees GROUP BY job_title", []),
+     'idx_employees_job_title'),
+    ('employee counts by status', lambda: ("SELECT status, COUNT(*) FROM employees GROUP BY status", []),
+     'idx_employees_status_created_at_id'),
+    ('employee search', lambda: employee_list_statement(search_query='mar', status_filter='active'), 'VIRTUAL TABLE INDEX'),
+    ("today's attendance", lambda: attendance_statement(date='2025-01-06'), 'idx_attendance_date'),
+    ('attendance date range', lambda: attendance_statement(start_date='2025-01-06', end_date='2025-01-12'), 'idx_attendance_date'),
+    ('weekly hours for one employee', lambda: attendance_statement(employee_id='000001', start_date='2025-01-06', end_date='2025-01-12'),
+     'sqlite_autoindex_attendance_1'),
+    ('scheduled Friday 11:00-14:00', lambda: scheduled_employees_query(4, 660, 840), 'idx_schedules_weekday'),
+    ('active employees by role', lambda: ("SELECT COUNT(*) FROM employees WHERE job_title = ? AND status = 'active'", ['Cook']),
+     'idx_employees_job_title_status'),
+]
+
+def check_query_plans():
+    """Return a list of (label, problem, plan) for dashboard queries that miss their index"""
+    failures = []
+    with get_employee_connection() as conn:
+        for label, build, expected_index in QUERY_PLAN_CHECKS:
+            query, params = build()
+            plan = [row['detail'] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+            text = '\n'.join(plan)
+            if expected_index not in text:
+                failures.append((label, f'does not use {expected_index}', plan))
+            elif 'TEMP B-TREE' in text:
+                failures.append((label, 'sorts with a temporary b-tree', plan))
+            elif any(detail.startswith('SCAN') and 'USING' not in detail and 'VIRTUAL TABLE' not in detail for detail in plan):
+                failures.append((label, 'scans a whole table', plan))
+    return failures
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Verify that dashboard employee/attendance queries use their indexes"""
+    failures = check_query_plans()
+    for label, problem, plan in failures:
+        print(f"FAIL {label}: {problem}")
+        for detail in plan:
+            print(f"       {detail}")
+    print(f"{len(QUERY_PLAN_CHECKS) - len(failures)}/{len(QUERY_PLAN_CHECKS)} query plans OK")
+    if failures:
+        sys.exit(1)
+
+@app.cli.command('backup')
+@click.option('--list', 'list_only', is_flag=True, help='List existing snapshots instead of taking one.')
+@click.option('--prune-only', is_flag=True, help='Apply the retention policy without taking a snapshot.')
+def backup_command(list_only, prune_only):
+    """Snapshot employees.db, carts.db, coupons.db and the CSV/JSON stores into BACKUP_DIR"""
+    if list_only:
+        for name in data_backup.list_backups(BACKUP_DIR):
+            manifest = data_backup.load_manifest(BACKUP_DIR, name)
+            print(f"{name}  {len(manifest['files'])} file(s), {manifest['copied_bytes'] / 1024:.1f} KB copied")
+        return
+    if prune_only:
+        with data_backup.backup_lock(BACKUP_DIR) as acquired:
+            if not acquired:
+                sys.exit("Another backup is running")
+            removed = data_backup.prune_backups(BACKUP_DIR, BACKUP_KEEP_RECENT, BACKUP_KEEP_DAILY)
+    else:
+        manifest, removed = run_backup()
+        if manifest is None:
+            sys.exit("Another backup is running")
+        linked = sum(1 for entry in manifest['files'].values() if entry['linked'])
+        print(f"Wrote {os.path.join(BACKUP_DIR, manifest['name'])}: {len(manifest['files'])} file(s), "
+              f"{linked} unchanged and hard-linked, {manifest['copied_bytes'] / 1024:.1f} KB copied "
+              f"in {manifest['duration_seconds']:.2f} s")
+        if backup_shares_data_volume():
+            print(f"Note: {BACKUP_DIR} is on the same volume as {DATA_DIR}; copy snapshots off it to survive losing the disk")
+    for name in removed:
+        print(f"Pruned {name}")
+
+@app.cli.command('rehash-passwords')
+def rehash_passwords_command():
+    """Write password hashes upgraded at login into users.csv"""
+    applied = apply_pending_rehashes()
+    print(f"Applied {applied} upgraded password hash(es)")
+
+@app.cli.command('cleanup-sessions')
+def cleanup_sessions_command():
+    """Delete expired server-side sessions"""
+    removed = app.session_interface.store.cleanup()
+    print(f"Removed {removed} expired session(s)")
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     app.run(debug=True, host='0.0.0.0', port=port)
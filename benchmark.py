@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for TastyCorner hot paths
+
+Each benchmark runs against a throwaway copy of the data directory in a temp
+folder, so it never touches data/ in the project.
+
+Usage:
+  python benchmark.py signup [SIZES]  - Signup append latency vs. existing users
+                                        (SIZES defaults to 1000,10000,100000,1000000)
+  python benchmark.py employees        - Concurrent check-ins/outs alongside admin reads,
+                                        pooled WAL connections vs. per-call connections
+  python benchmark.py repository       - Worker/admin read paths: employee_repository statements
+                                        and __slots__ rows vs. concatenated SQL and dict rows
+"""
+import csv
+import functools
+import os
+import statistics
+import sys
+import sqlite3
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import closing
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_app(workdir):
+    """Import app.py with its relative data/ and static/ paths pointing at workdir"""
+    os.chdir(workdir)
+    if PROJECT_DIR not in sys.path:
+        sys.path.insert(0, PROJECT_DIR)
+    import app
+    return app
+
+
+def write_users(path, count):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['user_id', 'email', 'password_hash', 'name', 'phone', 'address', 'created_at'])
+        for user_id in range(1, count + 1):
+            writer.writerow([
+                user_id, f'user{user_id}@example.com', 'scrypt:32768:8:1$benchmark$0',
+                f'User {user_id}', '225-555-0100', f'{user_id} Main Street\nBaton Rouge', '2025-01-01 12:00:00'
+            ])
+
+
+def report(label, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"  {label:<16} median {statistics.median(samples) * 1000:7.3f} ms   p95 {p95 * 1000:7.3f} ms")
+
+
+def benchmark_signup(sizes, signups=200):
+    """Time append_user (ID allocation + CSV append + index update) at each user count.
+
+    Password hashing is excluded: scrypt costs the same at any size and would
+    hide the part that used to grow with the user base.
+    """
+    print(f"Signup append latency ({signups} signups per size)")
+    with tempfile.TemporaryDirectory() as workdir:
+        app = load_app(workdir)
+        for size in sizes:
+            write_users(app.USERS_CSV, size)
+            if os.path.exists(app.USERS_INDEX_DB):
+                os.remove(app.USERS_INDEX_DB)
+            app.init_user_index()
+            started = time.perf_counter()
+            app.get_user_by_email('user1@example.com')  # one-time index build
+            build_time = time.perf_counter() - started
+
+            samples = []
+            for i in range(signups):
+                started = time.perf_counter()
+                app.append_user(f'new{i}@example.com', 'scrypt:32768:8:1$benchmark$0', 'New User', '225-555-0199', 'Campus')
+                samples.append(time.perf_counter() - started)
+            report(f"{size:,} users", samples)
+            print(f"  {'':<16} (initial index build {build_time:.2f} s)")
+        os.chdir(PROJECT_DIR)
+
+
+
+def run_attendance_load(app, employee_ids, writers=4, readers=4):
+    """Check every employee in and out from `writers` threads while `readers` threads
+    render the admin employee/attendance queries; returns (elapsed, writes, reads, errors)"""
+    today = time.strftime('%Y-%m-%d')
+    chunks = [employee_ids[i::writers] for i in range(writers)]
+    counts = {'writes': 0, 'reads': 0, 'errors': 0}
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def bump(key):
+        with lock:
+            counts[key] += 1
+
+    def write(chunk):
+        for employee_id in chunk:
+            for action in (app.check_in_employee, app.check_out_employee):
+                try:
+                    action(employee_id)
+                    bump('writes')
+                except sqlite3.OperationalError:
+                    bump('errors')
+
+    def read():
+        while not done.is_set():
+            try:
+                app.get_employees(limit=50)
+                app.get_attendance_records(date=today)
+                bump('reads')
+            except sqlite3.OperationalError:
+                bump('errors')
+
+    reader_threads = [threading.Thread(target=read) for _ in range(readers)]
+    writer_threads = [threading.Thread(target=write, args=(chunk,)) for chunk in chunks]
+    started = time.perf_counter()
+    for thread in reader_threads + writer_threads:
+        thread.start()
+    for thread in writer_threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    done.set()
+    for thread in reader_threads:
+        thread.join()
+    return elapsed, counts['writes'], counts['reads'], counts['errors']
+
+
+def benchmark_employees(employees=1000, writers=4, readers=4):
+    """Attendance writes plus admin reads, with pooled WAL connections and with the
+    old fresh-connection-per-call, rollback-journal setup"""
+    print(f"Employee DB throughput ({employees} employees, {writers} writer + {readers} reader threads)")
+    with tempfile.TemporaryDirectory() as workdir:
+        app = load_app(workdir)
+        with app.get_employee_connection() as conn:
+            conn.executemany(
+                "INSERT INTO employees (employee_id, first_name, last_name, email, job_title, status, created_at) VALUES (?, ?, ?, ?, ?, 'active', ?)",
+                [(f"{i:06d}", 'Bench', f'Worker{i}', f'worker{i}@example.com', 'Cook', '2025-01-01 12:00:00') for i in range(employees)]
+            )
+        employee_ids = [f"{i:06d}" for i in range(employees)]
+
+        def legacy_connection():
+            conn = sqlite3.connect(app.EMPLOYEES_DB)
+            conn.row_factory = sqlite3.Row
+            return conn
+
+        pooled_connection = app.get_employee_connection
+        for label, journal_mode, factory in [('per-call/rollback', 'DELETE', legacy_connection), ('pooled/WAL', 'WAL', pooled_connection)]:
+            app.close_employee_connection()
+            with closing(sqlite3.connect(app.EMPLOYEES_DB)) as conn:
+                conn.execute("DELETE FROM attendance")
+                conn.commit()
+                conn.execute(f"PRAGMA journal_mode={journal_mode}")
+            app.get_employee_connection = factory
+            elapsed, writes, reads, errors = run_attendance_load(app, employee_ids, writers, readers)
+            print(f"  {label:<18} {writes / elapsed:8.0f} writes/s   {reads / elapsed:8.0f} dashboard reads/s   {errors} lock errors")
+        app.get_employee_connection = pooled_connection
+        os.chdir(PROJECT_DIR)
+
+def legacy_reads(conn):
+    """The employee/attendance reads as they were before employee_repository:
+    SQL concatenated per call, sqlite3.Row results copied into dicts"""
+    def employee_by_id(employee_id):
+        row = conn.execute(
+            "SELECT employee_id, first_name, last_name, email, gender, dob, mobile, address, job_title, notes, status, created_at, "
+            "hourly_rate, profile_picture FROM employees WHERE employee_id = ?", (employee_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def attendance_for_day(employee_id, date):
+        row = conn.execute("SELECT * FROM attendance WHERE employee_id = ? AND date = ?", (employee_id, date)).fetchone()
+        return dict(row) if row else None
+
+    def attendance_records(employee_id=None, date=None, start_date=None, end_date=None):
+        query = "SELECT a.*, e.first_name, e.last_name, e.job_title FROM attendance a JOIN employees e ON a.employee_id = e.employee_id WHERE 1=1"
+        params = []
+        for clause, value in ((" AND a.employee_id = ?", employee_id), (" AND a.date = ?", date),
+                              (" AND a.date >= ?", start_date), (" AND a.date <= ?", end_date)):
+            if value:
+                query += clause
+                params.append(value)
+        query += " ORDER BY a.date DESC, a.check_in_time DESC"
+        return [dict(row) for row in conn.execute(query, params).fetchall()]
+
+    def employee_page(limit=50):
+        query = ("SELECT e.employee_id, e.first_name, e.last_name, e.email, e.gender, e.dob, e.mobile, e.address, e.job_title, "
+                 "e.notes, e.status, e.created_at, e.hourly_rate, e.profile_picture FROM employees e WHERE 1=1")
+        query += " AND e.status = ?"
+        query += " ORDER BY e.created_at DESC, e.employee_id DESC LIMIT ?"
+        return [dict(row) for row in conn.execute(query, ['active', limit + 1]).fetchall()][:limit]
+
+    return employee_by_id, attendance_for_day, attendance_records, employee_page
+
+
+def repository_reads(conn, repository):
+    return (
+        functools.partial(repository.get_employee, conn),
+        functools.partial(repository.get_attendance, conn),
+        functools.partial(repository.list_attendance, conn),
+        lambda limit=50: repository.page_employees(conn, 'active', None, None, limit)[0],
+    )
+
+
+def benchmark_repository(employees=2000, days=14, iterations=2000):
+    """Per-call time and allocations for the worker dashboard and admin directory reads"""
+    print(f"Employee read paths ({employees} employees, {days} days of attendance, {iterations} calls each)")
+    with tempfile.TemporaryDirectory() as workdir:
+        app = load_app(workdir)
+        import employee_repository
+        with app.get_employee_connection() as conn:
+            conn.executemany(
+                "INSERT INTO employees (employee_id, first_name, last_name, email, job_title, status, created_at) VALUES (?, ?, ?, ?, ?, 'active', ?)",
+                [(f"{i:06d}", 'Bench', f'Worker{i}', f'worker{i}@example.com', 'Cook', f'2025-01-01 12:{i // 60 % 60:02d}:{i % 60:02d}')
+                 for i in range(employees)]
+            )
+            dates = [f'2025-01-{day:02d}' for day in range(1, days + 1)]
+            conn.executemany(
+                "INSERT INTO attendance (employee_id, date, check_in_time, check_out_time, hours_worked, created_at) VALUES (?, ?, ?, ?, 8, ?)",
+                [(f"{i:06d}", date, f'{date} 09:00:00', f'{date} 17:00:00', f'{date} 09:00:00') for i in range(employees) for date in dates]
+            )
+        conn = app.get_employee_connection()
+        week_start, today = dates[-7], dates[-1]
+
+        for label, (employee_by_id, attendance_for_day, attendance_records, employee_page) in [
+            ('dict rows', legacy_reads(conn)),
+            ('repository', repository_reads(conn, employee_repository)),
+        ]:
+            def worker_path(i):
+                employee_id = f"{i % employees:06d}"
+                employee_by_id(employee_id)
+                attendance_for_day(employee_id, today)
+                return attendance_records(employee_id=employee_id, start_date=week_start, end_date=today)
+
+            def admin_path(i):
+                return employee_page(), attendance_records(date=today)
+
+            for path_label, path in (('worker dashboard', worker_path), ('admin directory', admin_path)):
+                path(0)  # warm the statement cache
+                started = time.perf_counter()
+                for i in range(iterations):
+                    path(i)
+                per_call = (time.perf_counter() - started) / iterations
+
+                tracemalloc.start()
+                kept = path(1)
+                retained, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                del kept
+                print(f"  {label:<11} {path_label:<17} {per_call * 1e6:8.1f} us/call   "
+                      f"{retained / 1024:7.1f} KiB kept   {peak / 1024:7.1f} KiB peak")
+        os.chdir(PROJECT_DIR)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'signup':
+        sizes = [int(s) for s in sys.argv[2].split(',')] if len(sys.argv) > 2 else [1000, 10000, 100000, 1000000]
+        benchmark_signup(sizes)
+    elif len(sys.argv) > 1 and sys.argv[1] == 'employees':
+        benchmark_employees()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'repository':
+        benchmark_repository()
+    else:
+        print(__doc__.strip().split('Usage:')[1].strip())
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Split static/style.css into per-area bundles and extract critical CSS
+
+Every rule is assigned to the template families (storefront, admin, worker)
+whose markup uses its selectors. Rules used by more than one family, or by
+plain element selectors, go to the shared bundle. Above-the-fold rules for
+the home and menu pages are written separately so they can be inlined.
+
+Usage:
+  python build_css.py          - Write static/css/*.css and bundles.json
+  python build_css.py --stats  - Show bundle sizes without writing files
+"""
+import json
+import os
+import re
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+STATIC_URL_PREFIX = '/static/'
+SOURCE_CSS = os.path.join(STATIC_DIR, 'style.css')
+OUTPUT_DIR = os.path.join(STATIC_DIR, 'css')
+BUNDLES_JSON = os.path.join(OUTPUT_DIR, 'bundles.json')
+
+SHARED = 'shared'
+# Template family -> templates (relative to templates/) that belong to it
+FAMILIES = {
+    'storefront': lambda path: '/' not in path,
+    'admin': lambda path: path.startswith('admin/'),
+    'worker': lambda path: path.startswith('worker/'),
+}
+# Pages whose above-the-fold rules are inlined; markup after FOLD_MARKER is ignored
+CRITICAL_PAGES = {'index': 'index.html', 'menu': 'menu.html'}
+CRITICAL_BASE = 'base.html'
+FOLD_MARKER = '<!-- above-the-fold -->'
+
+TEMPLATE_DEP_RE = re.compile(r"""{%-?\s*(?:extends|include|import|from)\s+["']([^"']+)["']""")
+WORD_RE = re.compile(r'[A-Za-z_][\w-]*')
+SELECTOR_TOKEN_RE = re.compile(r'[.#](-?[A-Za-z_][\w-]*)')
+NOT_RE = re.compile(r':not\([^)]*\)')
+CSS_URL_RE = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+ANIMATION_RE = re.compile(r'animation(?:-name)?\s*:\s*([^;]+)')
+BLOCK_AT_RULES_WITH_RULES = ('@media', '@supports')
+
+
+# --- CSS parsing -----------------------------------------------------------
+
+def strip_comments(css):
+    return re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+
+def find_block_end(css, start):
+    """Return the index of the '}' closing the block that opens at css[start] == '{'"""
+    depth = 0
+    quote = None
+    i = start
+    while i < len(css):
+        ch = css[i]
+        if quote:
+            if ch == '\\':
+                i += 1
+            elif ch == quote:
+                quote = None
+        elif ch in '"\'':
+            quote = ch
+        elif ch == '{':
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+            if depth == 0:
+                return i
+        i += 1
+    raise ValueError('Unbalanced braces in stylesheet')
+
+def parse_css(css):
+    """Parse a stylesheet into nodes.
+
+    Nodes are dicts: {'type': 'rule', 'selector', 'body'},
+    {'type': 'group', 'prelude', 'children'} for @media/@supports, or
+    {'type': 'raw', 'text'} for other at-rules (@keyframes, @font-face, @import).
+    """
+    nodes = []
+    i = 0
+    while i < len(css):
+        brace = css.find('{', i)
+        semicolon = css.find(';', i)
+        head_end = brace if brace != -1 else len(css)
+        head = css[i:head_end].strip()
+        if not head and brace == -1:
+            break
+        if head.startswith('@') and semicolon != -1 and (brace == -1 or semicolon < brace):
+            nodes.append({'type': 'raw', 'text': css[i:semicolon + 1].strip()})
+            i = semicolon + 1
+            continue
+        if brace == -1:
+            break
+        end = find_block_end(css, brace)
+        inner = css[brace + 1:end]
+        if head.startswith(BLOCK_AT_RULES_WITH_RULES):
+            nodes.append({'type': 'group', 'prelude': head, 'children': parse_css(inner)})
+        elif head.startswith('@'):
+            nodes.append({'type': 'raw', 'text': f"{head} {{{inner}}}"})
+        else:
+            nodes.append({'type': 'rule', 'selector': head, 'body': inner.strip()})
+        i = end + 1
+    return nodes
+
+def rebase_urls(css, from_dir, to_dir=None):
+    """Rewrite relative url() references for a stylesheet moved from from_dir to to_dir.
+
+    With no to_dir the references become absolute /static/ URLs, as needed for
+    CSS inlined into a page.
+    """
+    def replace(match):
+        quote, target = match.group(1), match.group(2).strip()
+        if target.startswith(('data:', 'http:', 'https:', '//', '#', '/')):
+            return match.group(0)
+        if to_dir is None:
+            moved = STATIC_URL_PREFIX + os.path.relpath(os.path.join(from_dir, target), STATIC_DIR).replace(os.sep, '/')
+        else:
+            moved = os.path.relpath(os.path.join(from_dir, target), to_dir).replace(os.sep, '/')
+        return f"url({quote}{moved}{quote})"
+    return CSS_URL_RE.sub(replace, css)
+
+def serialize(nodes, minify=False, indent=''):
+    out = []
+    for node in nodes:
+        if node['type'] == 'rule':
+            if minify:
+                body = re.sub(r'\s*([:;,{}])\s*', r'\1', re.sub(r'\s+', ' ', node['body'])).strip()
+                selector = re.sub(r'\s*,\s*', ',', re.sub(r'\s+', ' ', node['selector']))
+                out.append(f"{selector}{{{body}}}")
+            else:
+                lines = [line.strip() for line in node['body'].splitlines() if line.strip()]
+                body = ''.join(f"\n{indent}    {line}" for line in lines)
+                out.append(f"{indent}{node['selector']} {{{body}\n{indent}}}")
+        elif node['type'] == 'group':
+            children = serialize(node['children'], minify, '' if minify else indent + '    ')
+            if minify:
+                out.append(f"{node['prelude']}{{{children}}}")
+            else:
+                out.append(f"{indent}{node['prelude']} {{\n{children}\n{indent}}}")
+        else:
+            out.append(re.sub(r'\s+', ' ', node['text']) if minify else indent + node['text'])
+    return ('' if minify else '\n\n').join(out)
+
+
+# --- Template analysis -----------------------------------------------------
+
+def list_templates():
+    templates = []
+    for root, _, files in os.walk(TEMPLATES_DIR):
+        for name in files:
+            if name.endswith('.html'):
+                templates.append(os.path.relpath(os.path.join(root, name), TEMPLATES_DIR).replace(os.sep, '/'))
+    return sorted(templates)
+
+def read_template(path):
+    with open(os.path.join(TEMPLATES_DIR, path), 'r', encoding='utf-8') as f:
+        return f.read()
+
+def with_dependencies(paths):
+    """Add the templates each template extends, includes or imports"""
+    seen = set()
+    pending = list(paths)
+    while pending:
+        path = pending.pop()
+        if path in seen or not os.path.exists(os.path.join(TEMPLATES_DIR, path)):
+            continue
+        seen.add(path)
+        pending.extend(TEMPLATE_DEP_RE.findall(read_template(path)))
+    return seen
+
+class TokenSet:
+    """Words that appear in markup; words ending in '-' are treated as class prefixes
+    (e.g. ``status-{{ order.status }}`` or ``'status-' + status`` in inline JS)."""
+
+    def __init__(self, texts):
+        self.words = set()
+        for text in texts:
+            self.words.update(WORD_RE.findall(text))
+        self.prefixes = tuple(sorted(w for w in self.words if w.endswith('-')))
+
+    def __contains__(self, token):
+        return token in self.words or token.startswith(self.prefixes)
+
+def selector_tokens(selector):
+    return SELECTOR_TOKEN_RE.findall(NOT_RE.sub('', selector))
+
+def rule_matches(selector_list, tokens):
+    """True if any selector in the list only needs classes/ids present in tokens"""
+    for selector in selector_list.split(','):
+        needed = selector_tokens(selector)
+        if all(token in tokens for token in needed):
+            return True
+    return False
+
+def is_element_only(selector_list):
+    return not any(selector_tokens(selector) for selector in selector_list.split(','))
+
+
+# --- Bundling --------------------------------------------------------------
+
+def assign_bundles(nodes, family_tokens):
+    """Distribute nodes into {bundle: [nodes]}, preserving source order"""
+    bundles = {SHARED: []}
+    bundles.update({family: [] for family in family_tokens})
+    for node in nodes:
+        if node['type'] == 'group':
+            nested = assign_bundles(node['children'], family_tokens)
+            for bundle, children in nested.items():
+                if children:
+                    bundles[bundle].append({'type': 'group', 'prelude': node['prelude'], 'children': children})
+            continue
+        if node['type'] == 'raw' or is_element_only(node['selector']):
+            bundles[SHARED].append(node)
+            continue
+        users = [family for family, tokens in family_tokens.items() if rule_matches(node['selector'], tokens)]
+        # Rules no template references stay shared: their classes may come from data at runtime
+        bundles[users[0] if len(users) == 1 else SHARED].append(node)
+    return bundles
+
+def referenced_animations(nodes):
+    names = set()
+    for node in nodes:
+        if node['type'] == 'group':
+            names |= referenced_animations(node['children'])
+        elif node['type'] == 'rule':
+            for value in ANIMATION_RE.findall(node['body']):
+                names.update(WORD_RE.findall(value))
+    return names
+
+def extract_critical(nodes, tokens):
+    """Rules needed to paint the markup described by tokens"""
+    critical = []
+    for node in nodes:
+        if node['type'] == 'group':
+            children = extract_critical(node['children'], tokens)
+            if children:
+                critical.append({'type': 'group', 'prelude': node['prelude'], 'children': children})
+        elif node['type'] == 'rule' and (is_element_only(node['selector']) or rule_matches(node['selector'], tokens)):
+            critical.append(node)
+    # Keep the keyframes the critical rules animate with, or animated content stays hidden
+    animations = referenced_animations(critical)
+    for node in nodes:
+        if node['type'] == 'raw' and node['text'].startswith('@keyframes'):
+            name = node['text'].split()[1]
+            if name in animations:
+                critical.append(node)
+    return critical
+
+def critical_markup(page):
+    base = read_template(CRITICAL_BASE)
+    base = base.split('{% block content %}', 1)[0]
+    content = read_template(page).split(FOLD_MARKER, 1)[0]
+    return [base, content]
+
+def build_bundles(write=True):
+    """Split the stylesheet; returns {'bundles': {...}, 'critical': {...}} with byte sizes"""
+    with open(SOURCE_CSS, 'r', encoding='utf-8') as f:
+        css = rebase_urls(strip_comments(f.read()), os.path.dirname(SOURCE_CSS), OUTPUT_DIR)
+    nodes = parse_css(css)
+
+    templates = list_templates()
+    family_tokens = {}
+    for family, belongs in FAMILIES.items():
+        members = with_dependencies([t for t in templates if belongs(t)])
+        family_tokens[family] = TokenSet(read_template(t) for t in members)
+
+    bundles = assign_bundles(nodes, family_tokens)
+    outputs = {f"{name}.css": serialize(bundle_nodes) + '\n' for name, bundle_nodes in bundles.items()}
+    storefront_nodes = bundles[SHARED] + bundles['storefront']
+    for name, page in CRITICAL_PAGES.items():
+        critical = extract_critical(storefront_nodes, TokenSet(critical_markup(page)))
+        outputs[f"critical-{name}.css"] = rebase_urls(serialize(critical, minify=True), OUTPUT_DIR)
+
+    summary = {
+        'bundles': {name: len(outputs[f"{name}.css"].encode('utf-8')) for name in bundles},
+        'critical': {name: len(outputs[f"critical-{name}.css"].encode('utf-8')) for name in CRITICAL_PAGES},
+    }
+    if write:
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        for filename, css in outputs.items():
+            with open(os.path.join(OUTPUT_DIR, filename), 'w', encoding='utf-8') as f:
+                f.write(css)
+        with open(BUNDLES_JSON, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+    return summary
+
+def print_summary(summary):
+    with open(SOURCE_CSS, 'rb') as f:
+        source_size = len(f.read())
+    print(f"Source style.css: {source_size / 1024:.1f} KB")
+    for name, size in summary['bundles'].items():
+        print(f"  {name + '.css':<22} {size / 1024:8.1f} KB")
+    for name, size in summary['critical'].items():
+        print(f"  {'critical-' + name + '.css':<22} {size / 1024:8.1f} KB (inlined)")
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--stats':
+        print_summary(build_bundles(write=False))
+    elif len(sys.argv) > 1:
+        print(__doc__.strip().split('Usage:')[1].strip())
+    else:
+        summary = build_bundles()
+        print_summary(summary)
+        print(f"\nBundles written to {OUTPUT_DIR}")
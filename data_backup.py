@@ -0,0 +1,289 @@
+"""
+Online snapshots of the TastyCorner data directory
+
+SQLite databases are copied with the online backup API a few hundred pages at
+a time, releasing the source between steps so check-ins and coupon redemptions
+keep committing while a backup runs. CSV/JSON stores are copied from an open
+file descriptor, which relies on the app's writers either replacing those files
+with os.replace (write_csv_atomic/write_json_atomic; the open descriptor keeps
+reading the old, complete version) or appending whole rows, in which case the
+copy is retried. A writer that truncated and rewrote a file in place could be
+caught empty in between, so new stores must use one of those two patterns.
+
+Each snapshot is built in a `.partial` directory and renamed into place once
+its manifest is written, so a crash never leaves a half-written snapshot that
+looks finished. Files identical to the previous snapshot are hard-linked to it
+instead of copied, so frequent snapshots only cost what actually changed.
+"""
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+from datetime import datetime, timedelta
+
+try:
+    import fcntl
+except ImportError:  # no flock on Windows; overlapping runs are then possible
+    fcntl = None
+
+SNAPSHOT_FORMAT = '%Y%m%d-%H%M%S'
+MANIFEST_NAME = 'manifest.json'
+PARTIAL_SUFFIX = '.partial'
+LOCK_NAME = '.lock'
+COPY_CHUNK_SIZE = 1024 * 1024
+SNAPSHOT_FILE_ATTEMPTS = 5
+# Sidecar and scratch files that are never part of a snapshot
+SKIPPED_SUFFIXES = ('-wal', '-shm', '-journal', '.tmp')
+# Each write to the source from another connection between steps restarts the
+# backup; past this many restarts the remainder is copied in one step, which in
+# WAL mode is a single read transaction and still does not block writers
+MAX_BACKUP_RESTARTS = 10
+
+
+class BackupError(Exception):
+    pass
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def backup_sqlite(source, target, pages=256, sleep=0.05):
+    """Copy a live SQLite database to `target`, `pages` pages per step.
+
+    The copy is switched to a rollback journal so it is one self-contained file,
+    then checked with PRAGMA quick_check. Returns how many times the backup
+    restarted because the source changed mid-copy.
+    """
+    restarts = 0
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > MAX_BACKUP_RESTARTS:
+                raise _TooManyRestarts
+        last_remaining = remaining
+
+    with closing(sqlite3.connect(source, timeout=10)) as src, closing(sqlite3.connect(target)) as dst:
+        try:
+            src.backup(dst, pages=pages, progress=progress, sleep=sleep)
+        except _TooManyRestarts:
+            src.backup(dst, pages=-1)
+        dst.execute('PRAGMA journal_mode=DELETE')
+        result = dst.execute('PRAGMA quick_check').fetchone()[0]
+    if result != 'ok':
+        raise BackupError(f"{os.path.basename(source)}: quick_check failed on the copy: {result}")
+    return restarts
+
+
+def snapshot_file(source, target):
+    """Copy a file that may be replaced or appended to while it is read.
+
+    Returns False if the file no longer exists; raises BackupError if it kept
+    changing through every attempt.
+    """
+    for attempt in range(SNAPSHOT_FILE_ATTEMPTS):
+        try:
+            f = open(source, 'rb')
+        except FileNotFoundError:
+            return False
+        with f:
+            before = os.fstat(f.fileno())
+            with open(target, 'wb') as out:
+                shutil.copyfileobj(f, out, COPY_CHUNK_SIZE)
+                copied = out.tell()
+            after = os.fstat(f.fileno())
+        if copied == after.st_size and (before.st_size, before.st_mtime_ns) == (after.st_size, after.st_mtime_ns):
+            os.utime(target, ns=(after.st_atime_ns, after.st_mtime_ns))
+            return True
+        time.sleep(0.05 * (attempt + 1))
+    raise BackupError(f"{os.path.basename(source)} kept changing during {SNAPSHOT_FILE_ATTEMPTS} copy attempts")
+
+
+def snapshot_time(name):
+    """The creation time encoded in a snapshot directory name, or None if it is not one"""
+    try:
+        return datetime.strptime(name, SNAPSHOT_FORMAT)
+    except ValueError:
+        return None
+
+
+def list_backups(backup_dir):
+    """Names of finished snapshots, oldest first"""
+    if not os.path.isdir(backup_dir):
+        return []
+    return sorted(
+        name for name in os.listdir(backup_dir)
+        if snapshot_time(name) and os.path.isfile(os.path.join(backup_dir, name, MANIFEST_NAME))
+    )
+
+
+def load_manifest(backup_dir, name):
+    with open(os.path.join(backup_dir, name, MANIFEST_NAME), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _reuse_previous(path, previous_path):
+    """Replace `path` with a hard link to the identical file from the previous snapshot"""
+    link_path = f"{path}.link"
+    try:
+        os.link(previous_path, link_path)
+    except OSError:
+        return False  # filesystem without hard links: keep the copy
+    os.replace(link_path, path)
+    return True
+
+
+def _snapshot_sources(data_dir, databases, skip):
+    """(database paths that exist, other files to copy) for one snapshot"""
+    database_names = {os.path.basename(database) for database in databases}
+    files = [
+        os.path.join(data_dir, filename) for filename in sorted(os.listdir(data_dir))
+        if filename not in database_names and filename not in skip and not filename.endswith(SKIPPED_SUFFIXES)
+        and os.path.isfile(os.path.join(data_dir, filename))
+    ]
+    return [database for database in databases if os.path.exists(database)], files
+
+
+def remove_partial_backups(backup_dir):
+    """Delete unfinished snapshot directories; only call this while holding backup_lock"""
+    removed = []
+    for name in sorted(os.listdir(backup_dir)):
+        if name.endswith(PARTIAL_SUFFIX) and snapshot_time(name[:-len(PARTIAL_SUFFIX)]):
+            shutil.rmtree(os.path.join(backup_dir, name), ignore_errors=True)
+            removed.append(name)
+    return removed
+
+
+def create_backup(data_dir, backup_dir, databases=(), skip=(), pages=256, sleep=0.05, min_free_bytes=0, now=None):
+    """Snapshot `databases` (with the online backup API) and every other regular file
+    in `data_dir` into backup_dir/<YYYYmmdd-HHMMSS>/.
+
+    `skip` lists file names to leave out (caches and other rebuildable state).
+    Raises BackupError without writing anything if a full copy would leave less
+    than `min_free_bytes` free; a failed snapshot removes its partial copy.
+    Returns the snapshot's manifest. Callers serialise runs with backup_lock.
+    """
+    now = now or datetime.now()
+    name = now.strftime(SNAPSHOT_FORMAT)
+    final_path = os.path.join(backup_dir, name)
+    if os.path.exists(final_path):
+        raise BackupError(f"Snapshot {name} already exists")
+    remove_partial_backups(backup_dir)  # left behind by a crashed run
+
+    database_paths, file_paths = _snapshot_sources(data_dir, databases, skip)
+    needed = sum(os.path.getsize(path) for path in database_paths + file_paths if os.path.exists(path))
+    free = shutil.disk_usage(backup_dir).free
+    if free - needed < min_free_bytes:
+        raise BackupError(f"Not enough free space for a snapshot: {needed} bytes needed, {free} free, "
+                          f"{min_free_bytes} must stay free")
+
+    partial_path = final_path + PARTIAL_SUFFIX
+    os.makedirs(partial_path)
+    try:
+        manifest = _write_snapshot(backup_dir, name, partial_path, database_paths, file_paths, pages, sleep, now)
+        os.rename(partial_path, final_path)
+    except BaseException:
+        shutil.rmtree(partial_path, ignore_errors=True)
+        raise
+    return manifest
+
+
+def _write_snapshot(backup_dir, name, partial_path, database_paths, file_paths, pages, sleep, now):
+    """Fill partial_path with the copies and their manifest; returns the manifest"""
+    existing = list_backups(backup_dir)
+    previous = existing[-1] if existing else None
+    previous_files = load_manifest(backup_dir, previous)['files'] if previous else {}
+
+    files = {}
+    started = time.perf_counter()
+    for database in database_paths:
+        filename = os.path.basename(database)
+        restarts = backup_sqlite(database, os.path.join(partial_path, filename), pages=pages, sleep=sleep)
+        files[filename] = {'kind': 'sqlite', 'restarts': restarts}
+
+    for source in file_paths:
+        filename = os.path.basename(source)
+        if snapshot_file(source, os.path.join(partial_path, filename)):
+            files[filename] = {'kind': 'file'}
+
+    copied_bytes = 0
+    for filename, entry in files.items():
+        path = os.path.join(partial_path, filename)
+        entry['size'] = os.path.getsize(path)
+        entry['sha256'] = file_sha256(path)
+        earlier = previous_files.get(filename)
+        entry['linked'] = bool(
+            earlier and (earlier['size'], earlier['sha256']) == (entry['size'], entry['sha256'])
+            and _reuse_previous(path, os.path.join(backup_dir, previous, filename))
+        )
+        if not entry['linked']:
+            copied_bytes += entry['size']
+
+    manifest = {
+        'name': name,
+        'created_at': now.strftime('%Y-%m-%d %H:%M:%S'),
+        'duration_seconds': round(time.perf_counter() - started, 3),
+        'previous': previous,
+        'copied_bytes': copied_bytes,
+        'files': files,
+    }
+    with open(os.path.join(partial_path, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    return manifest
+
+
+def prune_backups(backup_dir, keep_recent=4, keep_daily=7, now=None):
+    """Delete snapshots outside the retention policy; returns the names removed.
+
+    Kept: the `keep_recent` newest snapshots, plus the newest snapshot of each of
+    the last `keep_daily` days. Unfinished `.partial` directories are removed too,
+    so only call this while holding backup_lock.
+    """
+    now = now or datetime.now()
+    names = list_backups(backup_dir)
+    keep = set(names[-keep_recent:]) if keep_recent > 0 else set()
+    oldest_day = (now - timedelta(days=keep_daily - 1)).date()
+    newest_per_day = {}
+    for name in names:
+        newest_per_day[snapshot_time(name).date()] = name
+    keep.update(name for day, name in newest_per_day.items() if keep_daily > 0 and day >= oldest_day)
+
+    removed = remove_partial_backups(backup_dir)
+    for name in names:
+        if name not in keep:
+            shutil.rmtree(os.path.join(backup_dir, name))
+            removed.append(name)
+    return removed
+
+
+@contextmanager
+def backup_lock(backup_dir):
+    """Non-blocking cross-process lock on backup_dir. Yields whether this process
+    got it, so a second worker's scheduler simply skips that run."""
+    os.makedirs(backup_dir, exist_ok=True)
+    with open(os.path.join(backup_dir, LOCK_NAME), 'a') as f:
+        if fcntl is None:
+            yield True
+            return
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        yield True  # closing the file releases the lock
@@ -0,0 +1,232 @@
+"""
+Employee and attendance data access for TastyCorner
+
+Every statement here is a constant string, chosen from a small table by which
+filters are in use, so each connection's sqlite3 statement cache prepares it
+once and reuses it instead of re-parsing freshly concatenated SQL. Rows come
+back as __slots__ objects built straight from the result tuples rather than
+sqlite3.Row plus a dict per row; they still answer row['field'] and
+row.get('field'), so callers and templates written against dicts keep working.
+
+Functions take an open employees.db connection and never commit; transactions
+stay with the caller.
+"""
+import itertools
+import re
+
+
+class _SlotRow:
+    """Attribute access plus the small part of the dict API callers rely on"""
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return self.__slots__
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)})"
+
+
+class Employee(_SlotRow):
+    __slots__ = ('employee_id', 'first_name', 'last_name', 'email', 'gender', 'dob', 'mobile', 'address',
+                 'job_title', 'notes', 'status', 'created_at', 'hourly_rate', 'profile_picture', 'schedule')
+
+    def __init__(self, employee_id, first_name, last_name, email, gender, dob, mobile, address,
+                 job_title, notes, status, created_at, hourly_rate, profile_picture, schedule=None):
+        self.employee_id = employee_id
+        self.first_name = first_name
+        self.last_name = last_name
+        self.email = email
+        self.gender = gender
+        self.dob = dob
+        self.mobile = mobile
+        self.address = address
+        self.job_title = job_title
+        self.notes = notes
+        self.status = status
+        self.created_at = created_at
+        self.hourly_rate = hourly_rate
+        self.profile_picture = profile_picture
+        self.schedule = schedule
+
+
+class Attendance(_SlotRow):
+    """One attendance row; first_name/last_name/job_title are filled by list_attendance"""
+    __slots__ = ('id', 'employee_id', 'date', 'check_in_time', 'check_out_time', 'hours_worked', 'created_at',
+                 'first_name', 'last_name', 'job_title')
+
+    def __init__(self, id, employee_id, date, check_in_time, check_out_time, hours_worked, created_at,
+                 first_name=None, last_name=None, job_title=None):
+        self.id = id
+        self.employee_id = employee_id
+        self.date = date
+        self.check_in_time = check_in_time
+        self.check_out_time = check_out_time
+        self.hours_worked = hours_worked
+        self.created_at = created_at
+        self.first_name = first_name
+        self.last_name = last_name
+        self.job_title = job_title
+
+
+# Select lists match the constructor argument order above
+EMPLOYEE_COLUMNS = ', '.join(f'e.{name}' for name in Employee.__slots__ if name != 'schedule')
+ATTENDANCE_COLUMNS = 'a.id, a.employee_id, a.date, a.check_in_time, a.check_out_time, a.hours_worked, a.created_at'
+EMPLOYEE_UPDATABLE_FIELDS = ('first_name', 'last_name', 'email', 'gender', 'dob', 'mobile', 'address', 'job_title', 'notes')
+
+
+def _employee_list_sql(search, status, job_title, limit):
+    if search:
+        sql = (f"SELECT {EMPLOYEE_COLUMNS} FROM employee_search JOIN employees e ON e.id = employee_search.rowid"
+               " WHERE employee_search MATCH ?")
+    else:
+        sql = f"SELECT {EMPLOYEE_COLUMNS} FROM employees e WHERE 1=1"
+    if status:
+        sql += " AND e.status = ?"
+    if job_title:
+        sql += " AND e.job_title = ?"
+    # created_at is stored as sortable text, so this ordering can walk an index
+    sql += " ORDER BY employee_search.rank" if search else " ORDER BY e.created_at DESC"
+    if limit:
+        sql += " LIMIT ?"
+    return sql
+
+
+def _employee_page_sql(status, job_title, after):
+    sql = f"SELECT {EMPLOYEE_COLUMNS} FROM employees e WHERE 1=1"
+    if status:
+        sql += " AND e.status = ?"
+    if job_title:
+        sql += " AND e.job_title = ?"
+    if after:
+        sql += " AND (e.created_at, e.employee_id) < (?, ?)"
+    return sql + " ORDER BY e.created_at DESC, e.employee_id DESC LIMIT ?"
+
+
+def _attendance_sql(employee_id, date, start_date, end_date):
+    sql = (f"SELECT {ATTENDANCE_COLUMNS}, e.first_name, e.last_name, e.job_title"
+           " FROM attendance a JOIN employees e ON a.employee_id = e.employee_id WHERE 1=1")
+    if employee_id:
+        sql += " AND a.employee_id = ?"
+    if date:
+        sql += " AND a.date = ?"
+    if start_date:
+        sql += " AND a.date >= ?"
+    if end_date:
+        sql += " AND a.date <= ?"
+    return sql + " ORDER BY a.date DESC, a.check_in_time DESC"
+
+
+# Every statement variant, built once at import
+EMPLOYEE_LIST_STATEMENTS = {flags: _employee_list_sql(*flags) for flags in itertools.product((False, True), repeat=4)}
+EMPLOYEE_PAGE_STATEMENTS = {flags: _employee_page_sql(*flags) for flags in itertools.product((False, True), repeat=3)}
+ATTENDANCE_STATEMENTS = {flags: _attendance_sql(*flags) for flags in itertools.product((False, True), repeat=4)}
+EMPLOYEE_BY_ID = f"SELECT {EMPLOYEE_COLUMNS} FROM employees e WHERE e.employee_id = ?"
+ATTENDANCE_FOR_DAY = f"SELECT {ATTENDANCE_COLUMNS} FROM attendance a WHERE a.employee_id = ? AND a.date = ?"
+UPDATE_EMPLOYEE = (
+    "UPDATE employees SET "
+    + ', '.join(f"{field} = COALESCE(?, {field})" for field in EMPLOYEE_UPDATABLE_FIELDS)
+    + " WHERE employee_id = ?"
+)
+STATEMENT_COUNT = len(EMPLOYEE_LIST_STATEMENTS) + len(EMPLOYEE_PAGE_STATEMENTS) + len(ATTENDANCE_STATEMENTS) + 3
+
+
+def employee_search_expression(search_query):
+    """Turn free text into an FTS5 query: every word must match the start of some token"""
+    words = re.findall(r'\w+', search_query or '')
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def employee_list_statement(search_query=None, status_filter=None, job_title=None, limit=None):
+    """SQL and parameters for list_employees.
+
+    Searches go through the employee_search FTS5 index and are ordered by
+    relevance; otherwise the newest employees come first.
+    """
+    match = employee_search_expression(search_query)
+    params = [value for value in (match, status_filter, job_title, limit) if value]
+    return EMPLOYEE_LIST_STATEMENTS[bool(match), bool(status_filter), bool(job_title), bool(limit)], params
+
+
+def employee_page_statement(status_filter=None, job_title=None, after=None, limit=50):
+    """SQL and parameters for one directory page, newest first.
+
+    `after` is the (created_at, employee_id) of the previous page's last row; the
+    row-value comparison seeks straight to it in the index rather than skipping
+    OFFSET rows. One extra row is fetched to tell whether another page follows.
+    """
+    params = [value for value in (status_filter, job_title) if value]
+    if after:
+        params.extend(after)
+    params.append(limit + 1)
+    return EMPLOYEE_PAGE_STATEMENTS[bool(status_filter), bool(job_title), bool(after)], params
+
+
+def attendance_statement(employee_id=None, date=None, start_date=None, end_date=None):
+    """SQL and parameters for list_attendance"""
+    filters = (employee_id, date, start_date, end_date)
+    return ATTENDANCE_STATEMENTS[tuple(bool(value) for value in filters)], [value for value in filters if value]
+
+
+def _fetch(conn, row_class, sql, params):
+    cursor = conn.cursor()
+    cursor.row_factory = None  # plain tuples; the row class does the naming
+    return list(itertools.starmap(row_class, cursor.execute(sql, params)))
+
+
+def _fetch_one(conn, row_class, sql, params):
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    row = cursor.execute(sql, params).fetchone()
+    return row_class(*row) if row else None
+
+
+def list_employees(conn, search_query=None, status_filter=None, job_title=None, limit=None):
+    sql, params = employee_list_statement(search_query, status_filter, job_title, limit)
+    return _fetch(conn, Employee, sql, params)
+
+
+def page_employees(conn, status_filter=None, job_title=None, after=None, limit=50):
+    """Up to `limit` employees after the `after` key, and whether more follow"""
+    sql, params = employee_page_statement(status_filter, job_title, after, limit)
+    employees = _fetch(conn, Employee, sql, params)
+    return employees[:limit], len(employees) > limit
+
+
+def get_employee(conn, employee_id):
+    return _fetch_one(conn, Employee, EMPLOYEE_BY_ID, (employee_id,))
+
+
+def update_employee(conn, employee_id, fields):
+    """Set the given directory fields (None leaves a field alone); False if there was nothing to set"""
+    values = [fields.get(field) for field in EMPLOYEE_UPDATABLE_FIELDS]
+    if all(value is None for value in values):
+        return False
+    conn.execute(UPDATE_EMPLOYEE, values + [employee_id])
+    return True
+
+
+def get_attendance(conn, employee_id, date):
+    return _fetch_one(conn, Attendance, ATTENDANCE_FOR_DAY, (employee_id, date))
+
+
+def list_attendance(conn, employee_id=None, date=None, start_date=None, end_date=None):
+    sql, params = attendance_statement(employee_id, date, start_date, end_date)
+    return _fetch(conn, Attendance, sql, params)
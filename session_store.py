@@ -0,0 +1,183 @@
+"""
+Server-side sessions for TastyCorner
+
+The session cookie only carries a signed, random session ID; the session data
+itself lives in a pluggable store. SQLiteSessionStore (a file under data/) is
+the default, MemorySessionStore is handy for tests and single-process runs.
+
+Sessions are written back only when modified, and expire PERMANENT_SESSION_LIFETIME
+after their last write. Expired rows are removed by a background thread in
+each process (and by `flask --app app cleanup-sessions`).
+"""
+import secrets
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session dict that remembers its ID and whether it was changed"""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(session):
+            session.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.rotate_sid = False
+
+    def regenerate(self):
+        """Move the data to a fresh session ID on the next save (call on login)"""
+        self.rotate_sid = True
+        self.modified = True
+
+
+class MemorySessionStore:
+    """Process-local store; sessions vanish on restart"""
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        with self._lock:
+            entry = self._sessions.get(sid)
+        if entry is None or entry[1] < time.time():
+            return None
+        return entry[0]
+
+    def save(self, sid, data, expires):
+        with self._lock:
+            self._sessions[sid] = (data, expires)
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def cleanup(self):
+        now = time.time()
+        with self._lock:
+            expired = [sid for sid, (_, expires) in self._sessions.items() if expires < now]
+            for sid in expired:
+                del self._sessions[sid]
+        return len(expired)
+
+
+class SQLiteSessionStore:
+    """Sessions in a single SQLite file, shared by all gunicorn workers"""
+
+    def __init__(self, path):
+        self.path = path
+        with closing(self._connect()) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS sessions (
+                    sid TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    expires REAL NOT NULL
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def load(self, sid):
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT data FROM sessions WHERE sid = ? AND expires >= ?', (sid, time.time())).fetchone()
+        return row[0] if row else None
+
+    def save(self, sid, data, expires):
+        with closing(self._connect()) as conn:
+            conn.execute('INSERT OR REPLACE INTO sessions (sid, data, expires) VALUES (?, ?, ?)', (sid, data, expires))
+
+    def delete(self, sid):
+        with closing(self._connect()) as conn:
+            conn.execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+
+    def cleanup(self):
+        with closing(self._connect()) as conn:
+            return conn.execute('DELETE FROM sessions WHERE expires < ?', (time.time(),)).rowcount
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Flask session interface backed by one of the stores above"""
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store, cleanup_interval=3600):
+        self.store = store
+        self.cleanup_interval = cleanup_interval
+        self._cleanup_thread = None
+        self._cleanup_lock = threading.Lock()
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='server-session')
+
+    def _start_cleanup(self):
+        """Start the expiry sweeper lazily, so forked workers each get their own thread"""
+        with self._cleanup_lock:
+            if self._cleanup_thread is not None and self._cleanup_thread.is_alive():
+                return
+            def sweep():
+                while True:
+                    time.sleep(self.cleanup_interval)
+                    try:
+                        self.store.cleanup()
+                    except sqlite3.Error:
+                        pass  # try again next interval
+            self._cleanup_thread = threading.Thread(target=sweep, name='session-cleanup', daemon=True)
+            self._cleanup_thread.start()
+
+    def open_session(self, app, request):
+        if self.cleanup_interval:
+            self._start_cleanup()
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode('ascii')
+            except BadSignature:
+                sid = None
+            data = self.store.load(sid) if sid else None
+            if data is not None:
+                return ServerSideSession(self.serializer.loads(data), sid=sid)
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not session.modified:
+            return
+
+        if session.rotate_sid:
+            if not session.new:
+                self.store.delete(session.sid)
+            session.sid = secrets.token_urlsafe(32)
+            session.rotate_sid = False
+        expires = time.time() + app.permanent_session_lifetime.total_seconds()
+        self.store.save(session.sid, self.serializer.dumps(dict(session)), expires)
+        response.vary.add('Cookie')
+        response.set_cookie(
+            name,
+            self._signer(app).sign(session.sid).decode('ascii'),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
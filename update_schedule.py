@@ -3,12 +3,19 @@
 Script to update employee schedules in the SQLite database
 """
 import sqlite3
-import json
 import os
 import sys
 
 # Database path
 DB_PATH = os.path.join('data', 'employees.db')
+DAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+def to_minutes(value):
+    hours, minutes = value.split(':')
+    return int(hours) * 60 + int(minutes)
+
+def to_time(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
 
 def get_default_schedule():
     """Get default schedule (Mon-Fri, 9AM-5PM)"""
@@ -39,11 +46,22 @@ def update_schedule(employee_id, schedule_dict):
         conn.close()
         return False
     
-    # Convert schedule dict to JSON string
-    schedule_json = json.dumps(schedule_dict)
+    # One row per weekday (0 = Monday), times as minutes after midnight
+    try:
+        rows = [
+            (employee_id, weekday, int(bool(schedule_dict[day]['enabled'])),
+             to_minutes(schedule_dict[day]['start']), to_minutes(schedule_dict[day]['end']))
+            for weekday, day in enumerate(DAYS)
+        ]
+    except (KeyError, ValueError):
+        print("Schedule must give enabled/start/end (HH:MM) for every day.")
+        conn.close()
+        return False
     
-    # Update schedule
-    cursor.execute("UPDATE employees SET schedule = ? WHERE employee_id = ?", (schedule_json, employee_id))
+    cursor.executemany("""
+        INSERT OR REPLACE INTO schedules (employee_id, weekday, enabled, start_minute, end_minute)
+        VALUES (?, ?, ?, ?, ?)
+    """, rows)
     conn.commit()
     conn.close()
     
@@ -74,27 +92,26 @@ def update_schedule_interactive():
     
     employee_id = input("\nEnter Employee ID: ").strip()
     
-    # Get current schedule
-    cursor.execute("SELECT schedule FROM employees WHERE employee_id = ?", (employee_id,))
-    row = cursor.fetchone()
-    
-    if not row:
+    cursor.execute("SELECT employee_id FROM employees WHERE employee_id = ?", (employee_id,))
+    if not cursor.fetchone():
         print(f"Employee {employee_id} not found.")
         conn.close()
         return
     
-    # Parse current schedule or use default
-    current_schedule = {}
-    if row['schedule']:
-        try:
-            current_schedule = json.loads(row['schedule'])
-        except:
-            current_schedule = get_default_schedule()
-    else:
-        current_schedule = get_default_schedule()
+    # Get current schedule (days without a row fall back to the default)
+    current_schedule = get_default_schedule()
+    cursor.execute("""
+        SELECT weekday, enabled, start_minute, end_minute FROM schedules WHERE employee_id = ?
+    """, (employee_id,))
+    for row in cursor.fetchall():
+        current_schedule[DAYS[row['weekday']]] = {
+            'enabled': bool(row['enabled']),
+            'start': to_time(row['start_minute']),
+            'end': to_time(row['end_minute'])
+        }
     
     print("\nCurrent schedule:")
-    days = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+    days = DAYS
     for day in days:
         day_data = current_schedule.get(day, {})
         if day_data.get('enabled', False):
@@ -156,41 +173,36 @@ def show_sql_examples():
     print("""
 To update schedules directly in SQLite:
 
+Schedules have one row per employee per weekday (0 = Monday ... 6 = Sunday),
+with start/end stored as minutes after midnight (09:00 = 540, 17:00 = 1020).
+
 1. Open SQLite:
    sqlite3 data/employees.db
 
-2. Update entire schedule (replace with your JSON):
-   UPDATE employees 
-   SET schedule = '{"monday":{"enabled":true,"start":"09:00","end":"17:00"},"tuesday":{"enabled":true,"start":"09:00","end":"17:00"},"wednesday":{"enabled":true,"start":"09:00","end":"17:00"},"thursday":{"enabled":true,"start":"09:00","end":"17:00"},"friday":{"enabled":true,"start":"09:00","end":"17:00"},"saturday":{"enabled":false,"start":"09:00","end":"17:00"},"sunday":{"enabled":false,"start":"09:00","end":"17:00"}}'
-   WHERE employee_id = '209228';
+2. Replace an entire week (Mon-Fri 9AM-5PM, weekend off):
+   INSERT OR REPLACE INTO schedules (employee_id, weekday, enabled, start_minute, end_minute) VALUES
+       ('209228', 0, 1, 540, 1020), ('209228', 1, 1, 540, 1020), ('209228', 2, 1, 540, 1020),
+       ('209228', 3, 1, 540, 1020), ('209228', 4, 1, 540, 1020),
+       ('209228', 5, 0, 540, 1020), ('209228', 6, 0, 540, 1020);
 
-3. Update specific day using JSON functions (SQLite 3.38+):
-   UPDATE employees
-   SET schedule = json_set(
-       schedule,
-       '$.monday.enabled', 1,
-       '$.monday.start', '10:00',
-       '$.monday.end', '18:00'
-   )
-   WHERE employee_id = '209228';
+3. Change one day (Monday 10:00-18:00):
+   UPDATE schedules
+   SET enabled = 1, start_minute = 600, end_minute = 1080
+   WHERE employee_id = '209228' AND weekday = 0;
 
 4. Enable/disable a day:
-   UPDATE employees
-   SET schedule = json_set(schedule, '$.monday.enabled', 1)
-   WHERE employee_id = '209228';
-
-5. View before updating:
-   SELECT employee_id, first_name, last_name, schedule 
-   FROM employees 
-   WHERE employee_id = '209228';
+   UPDATE schedules
+   SET enabled = 1
+   WHERE employee_id = '209228' AND weekday = 0;
 
-6. Verify update:
-   SELECT employee_id, 
-          json_extract(schedule, '$.monday.enabled') as monday_enabled,
-          json_extract(schedule, '$.monday.start') as monday_start,
-          json_extract(schedule, '$.monday.end') as monday_end
-   FROM employees 
-   WHERE employee_id = '209228';
+5. View before updating / verify update:
+   SELECT weekday,
+          enabled,
+          printf('%02d:%02d', start_minute / 60, start_minute % 60) AS start,
+          printf('%02d:%02d', end_minute / 60, end_minute % 60) AS end
+   FROM schedules
+   WHERE employee_id = '209228'
+   ORDER BY weekday;
 """)
 
 if __name__ == '__main__':
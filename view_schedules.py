@@ -1,11 +1,23 @@
 """
 Script to view employee schedules in the SQLite database
+
+Usage:
+  python view_schedules.py                        - Every employee's weekly schedule
+  python view_schedules.py --on friday 11:00-14:00 - Active employees on shift in that window
 """
 import sqlite3
-import json
 import os
+import sys
 
 DB_PATH = os.path.join('data', 'employees.db')
+DAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+def to_minutes(value):
+    hours, minutes = value.split(':')
+    return int(hours) * 60 + int(minutes)
+
+def to_time(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
 
 def view_schedules():
     """View all employee schedules"""
@@ -17,18 +29,14 @@ def view_schedules():
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
-   
-    cursor.execute("PRAGMA table_info(employees)")
-    columns = [row[1] for row in cursor.fetchall()]
-    
-    if 'schedule' not in columns:
-        print("Schedule column does not exist in employees table.")
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'schedules'")
+    if not cursor.fetchone():
+        print("Schedules table does not exist yet. Run: flask --app app migrate-db")
         conn.close()
         return
     
-    
     cursor.execute("""
-        SELECT employee_id, first_name, last_name, email, schedule 
+        SELECT employee_id, first_name, last_name, email
         FROM employees 
         ORDER BY employee_id
     """)
@@ -50,23 +58,19 @@ def view_schedules():
         print(f"Name: {row['first_name']} {row['last_name']}")
         print(f"Email: {row['email']}")
         
-        schedule_str = row['schedule']
-        if schedule_str:
-            try:
-                schedule = json.loads(schedule_str)
-                print(f"\nSchedule (JSON):")
-                print(json.dumps(schedule, indent=2))
-                
-                print(f"\nSchedule (Formatted):")
-                days = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
-                for day in days:
-                    day_data = schedule.get(day, {})
-                    if day_data.get('enabled', False):
-                        print(f"  {day.capitalize():12} : {day_data.get('start', 'N/A')} - {day_data.get('end', 'N/A')}")
-                    else:
-                        print(f"  {day.capitalize():12} : OFF")
-            except json.JSONDecodeError:
-                print(f"\nSchedule (Raw): {schedule_str}")
+        days = cursor.execute("""
+            SELECT weekday, enabled, start_minute, end_minute
+            FROM schedules
+            WHERE employee_id = ?
+            ORDER BY weekday
+        """, (row['employee_id'],)).fetchall()
+        if days:
+            print(f"\nSchedule:")
+            for day in days:
+                if day['enabled']:
+                    print(f"  {DAYS[day['weekday']].capitalize():12} : {to_time(day['start_minute'])} - {to_time(day['end_minute'])}")
+                else:
+                    print(f"  {DAYS[day['weekday']].capitalize():12} : OFF")
         else:
             print("\nSchedule: Not assigned")
     
@@ -74,6 +78,28 @@ def view_schedules():
     print(f"Total employees: {len(rows)}")
     conn.close()
 
+def view_scheduled_at(day, window):
+    """List active employees whose shift on `day` overlaps `window` ('HH:MM-HH:MM')"""
+    if not os.path.exists(DB_PATH):
+        print(f"Database not found at {DB_PATH}")
+        return
+    
+    start, end = (to_minutes(part) for part in window.split('-'))
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute("""
+        SELECT e.employee_id, e.first_name, e.last_name, e.job_title, s.start_minute, s.end_minute
+        FROM schedules s JOIN employees e ON e.employee_id = s.employee_id
+        WHERE s.weekday = ? AND s.enabled = 1 AND s.start_minute < ? AND s.end_minute > ? AND e.status = 'active'
+        ORDER BY s.start_minute
+    """, (DAYS.index(day.lower()), end, start)).fetchall()
+    conn.close()
+    
+    print(f"Scheduled on {day.capitalize()} between {to_time(start)} and {to_time(end)}:")
+    for row in rows:
+        print(f"  {row['employee_id']}  {row['first_name']} {row['last_name']:20} {row['job_title'] or '':20} {to_time(row['start_minute'])} - {to_time(row['end_minute'])}")
+    print(f"Total: {len(rows)}")
+
 def view_schedule_sql():
     """Show SQL queries to view schedules"""
     print("\n" + "=" * 100)
@@ -85,35 +111,37 @@ To view schedules using SQLite command line:
 1. Open SQLite:
    sqlite3 data/employees.db
 
-2. View all schedules:
-   SELECT employee_id, first_name, last_name, schedule FROM employees;
+   Schedules have one row per employee per weekday (0 = Monday ... 6 = Sunday),
+   with start/end stored as minutes after midnight.
 
-3. View schedule for specific employee:
-   SELECT employee_id, first_name, last_name, schedule 
-   FROM employees 
-   WHERE employee_id = '000001';
+2. View all schedules:
+   SELECT employee_id, weekday, enabled, start_minute, end_minute FROM schedules ORDER BY employee_id, weekday;
 
-4. View only employees with schedules:
-   SELECT employee_id, first_name, last_name, schedule 
-   FROM employees 
-   WHERE schedule IS NOT NULL AND schedule != '';
+3. View schedule for specific employee, with readable times:
+   SELECT weekday,
+          enabled,
+          printf('%02d:%02d', start_minute / 60, start_minute % 60) AS start,
+          printf('%02d:%02d', end_minute / 60, end_minute % 60) AS end
+   FROM schedules
+   WHERE employee_id = '000001'
+   ORDER BY weekday;
 
-5. View schedule column structure:
-   PRAGMA table_info(employees);
+4. Who is scheduled on Friday between 11:00 and 14:00 (uses idx_schedules_weekday):
+   SELECT e.employee_id, e.first_name, e.last_name
+   FROM schedules s JOIN employees e ON e.employee_id = s.employee_id
+   WHERE s.weekday = 4 AND s.enabled = 1 AND s.start_minute < 840 AND s.end_minute > 660
+   ORDER BY s.start_minute;
 
-6. Pretty print a schedule (example):
-   SELECT 
-       employee_id,
-       first_name,
-       last_name,
-       json_extract(schedule, '$.monday.enabled') as monday_enabled,
-       json_extract(schedule, '$.monday.start') as monday_start,
-       json_extract(schedule, '$.monday.end') as monday_end
-   FROM employees
-   WHERE employee_id = '000001';
+5. View schedules table structure:
+   PRAGMA table_info(schedules);
 """)
 
 if __name__ == '__main__':
-    view_schedules()
-    view_schedule_sql()
+    if len(sys.argv) == 4 and sys.argv[1] == '--on':
+        view_scheduled_at(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) > 1:
+        print(__doc__.strip().split('Usage:')[1].strip())
+    else:
+        view_schedules()
+        view_schedule_sql()
 